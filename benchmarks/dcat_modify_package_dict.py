@@ -0,0 +1,90 @@
+"""Measures the overhead of `BasketDcatJsonHarvester.modify_package_dict`
+before and after it stopped parsing the harvest object content and the
+source config for every object.
+
+The transmute step is replaced with a no-op, because it costs the same in
+both cases. Run it inside the CKAN virtualenv:
+
+    python benchmarks/dcat_modify_package_dict.py --datasets 10000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from ckanext.harvest_basket.harvesters.dcat import BasketDcatJsonHarvester
+
+
+def make_dataset(idx: int) -> dict:
+    return {
+        "identifier": f"dataset-{idx}",
+        "title": f"Dataset {idx}",
+        "description": "Lorem ipsum dolor sit amet. " * 40,
+        "keyword": [f"keyword-{n}" for n in range(10)],
+        "modified": "2024-01-01T00:00:00Z",
+        "publisher": {"name": "Publisher"},
+        "distribution": [
+            {
+                "downloadURL": f"https://example.com/{idx}/{n}.csv",
+                "mediaType": "text/csv",
+                "title": f"Resource {n}",
+            }
+            for n in range(5)
+        ],
+    }
+
+
+def before(harvester, package_dict, dcat_dict, harvest_object):
+    # the implementation replaced by the optimization
+    harvester.base_context = {"user": harvester._get_user_name()}
+    package_dict = json.loads(harvest_object.content)
+    harvester.config = json.loads(harvest_object.source.config)
+    harvester._transmute_content(package_dict)
+    return package_dict
+
+
+def after(harvester, package_dict, dcat_dict, harvest_object):
+    return harvester.modify_package_dict(package_dict, dcat_dict, harvest_object)
+
+
+def measure(func, harvester, objects) -> float:
+    started = time.perf_counter()
+    for dcat_dict, harvest_object in objects:
+        func(harvester, {}, dict(dcat_dict), harvest_object)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--datasets", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    source = SimpleNamespace(
+        config=json.dumps({"tsm_schema": {"root": "Dataset", "types": {}}})
+    )
+    objects = []
+    for idx in range(args.datasets):
+        dataset = make_dataset(idx)
+        harvest_object = SimpleNamespace(
+            content=json.dumps(dataset), source=source, harvest_job_id=None
+        )
+        objects.append((dataset, harvest_object))
+
+    harvester = BasketDcatJsonHarvester()
+    harvester._get_user_name = lambda: "benchmark"
+    harvester.transmute_data = lambda data, schema: None
+    harvester._track_progress = lambda *args, **kwargs: None
+
+    for name, func in (("before", before), ("after", after)):
+        best = min(measure(func, harvester, objects) for _ in range(args.rounds))
+        print(
+            f"{name:>6}: {best:.3f}s for {args.datasets} datasets, "
+            f"{best / args.datasets * 1e6:.1f}us per dataset"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compares the standard json module with `ckanext.harvest_basket.codec`,
+that uses `orjson` when it's installed, on the JSON work of the harvest
+object life cycle: the remote dataset is parsed, serialized into the object
+content by the fetch stage and parsed once again by the import stage.
+
+    pip install ckanext-harvest-basket[fast]
+    python benchmarks/json_codec.py --datasets 10000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+
+from ckanext.harvest_basket import codec
+
+
+def make_dataset(idx: int) -> dict:
+    return {
+        "id": f"dataset-{idx}",
+        "name": f"dataset-{idx}",
+        "title": f"Dataset {idx}",
+        "notes": "Lorem ipsum dolor sit amet. " * 20,
+        "metadata_modified": "2024-01-01T00:00:00.000000",
+        "tags": [{"name": f"tag-{n}"} for n in range(5)],
+        "extras": [{"key": f"key-{n}", "value": f"value-{n}"} for n in range(5)],
+        "resources": [
+            {
+                "id": f"resource-{idx}-{n}",
+                "url": f"https://example.com/{idx}/{n}.csv",
+                "format": "CSV",
+                "size": 1024 * n,
+            }
+            for n in range(3)
+        ],
+    }
+
+
+def life_cycle(loads, dumps, documents: list[bytes]):
+    for document in documents:
+        content = dumps(loads(document))
+        loads(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--datasets", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    documents = [
+        json.dumps(make_dataset(idx)).encode("utf8") for idx in range(args.datasets)
+    ]
+    size = sum(map(len, documents)) / len(documents)
+    print(f"{args.datasets} datasets, {size / 1024:.1f} KB each")
+    if codec.orjson is None:
+        print("orjson is not installed, codec falls back to the json module")
+
+    for name, loads, dumps in (
+        ("json", json.loads, json.dumps),
+        ("codec", codec.loads, codec.dumps),
+    ):
+        best = float("inf")
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            life_cycle(loads, dumps, documents)
+            best = min(best, time.perf_counter() - started)
+
+        print(f"{name:>6}: {best * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
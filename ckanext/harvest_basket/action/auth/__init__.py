@@ -6,4 +6,6 @@ def get_auth_functions():
         "harvest_basket_check_source": get.check_source,
         "package_search": get.package_search,
         "harvest_basket_update_config": get.update_config,
+        "harvest_basket_job_progress": get.job_progress,
+        "harvest_basket_job_history": get.job_history,
     }
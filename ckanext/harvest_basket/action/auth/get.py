@@ -22,3 +22,13 @@ def package_search(next_, context, data_dict):
 def update_config(ctx, data_dict):
     # sysadmins only
     return {"success": False}
+
+
+def job_progress(ctx, data_dict):
+    # sysadmins only
+    return {"success": False}
+
+
+def job_history(ctx, data_dict):
+    # sysadmins only
+    return {"success": False}
@@ -1,8 +1,11 @@
-from . import get
+from . import get, update
 
 
 def get_actions():
     return {
         "harvest_basket_check_source": get.check_source,
         "harvest_basket_update_config": get.update_config,
+        "harvest_basket_job_progress": get.job_progress,
+        "harvest_basket_job_history": get.job_history,
+        "harvest_jobs_run": update.harvest_jobs_run,
     }
@@ -1,12 +1,15 @@
 from __future__ import annotations
 
 import json
+from datetime import datetime, timezone
 from typing import Any, Optional
 
 from jsonschema import validate, ValidationError as SchemaValidationError
 
 import ckan.plugins.toolkit as tk
+from ckan import model
 
+from ckanext.harvest.model import HarvestJob, HarvestSource
 from ckanext.harvest_basket.harvesters import (
     DKANHarvester,
     JunarHarvester,
@@ -15,8 +18,17 @@ from ckanext.harvest_basket.harvesters import (
     CustomCKANHarvester,
     ODSHarvester,
 )
+from ckanext.harvest_basket.utils import (
+    REGRESSION_THRESHOLD,
+    REGRESSION_WINDOW,
+    find_regressions,
+    get_job_history,
+    get_job_progress,
+)
 from ckanext.transmute.utils import get_json_schema
 
+PROGRESS_STAGES = ("gathered", "fetched", "imported", "errors")
+
 
 @tk.side_effect_free
 def check_source(ctx: dict[str, Any], data_dict: dict) -> dict[str, Any]:
@@ -65,3 +77,81 @@ def update_config(ctx: dict[str, Any], data_dict: dict) -> dict[str, Any]:
         validate(config, schema)
     except SchemaValidationError as e:
         return f"{e.message}"
+
+
+@tk.side_effect_free
+def job_progress(ctx: dict[str, Any], data_dict: dict) -> dict[str, Any]:
+    """Returns the progress of the harvest job: number of objects processed
+    by each stage, rate of the fetch and import stages in objects per second
+    and estimated number of seconds before the job is finished"""
+    tk.check_access("harvest_basket_job_progress", ctx, data_dict)
+
+    job_id: str = tk.get_or_bust(data_dict, "id")
+    job = model.Session.query(HarvestJob).get(job_id)
+
+    if not job:
+        raise tk.ObjectNotFound(f"Harvest job {job_id} not found")
+
+    progress = get_job_progress(job.id)
+    result: dict[str, Any] = {
+        "id": job.id,
+        "source_id": job.source_id,
+        "status": job.status,
+    }
+
+    for stage in PROGRESS_STAGES:
+        result[stage] = int(progress.get(stage, 0))
+
+    # objects of the harvesters with the upstream fetch stage are counted
+    # only by the import stage
+    result["fetched"] = max(result["fetched"], result["imported"])
+
+    for stage, name in (("fetched", "fetch_rate"), ("imported", "import_rate")):
+        elapsed = progress.get(f"{stage}_updated", 0) - progress.get(
+            f"{stage}_started", 0
+        )
+        rate = result[stage] / elapsed if elapsed > 0 else None
+        result[name] = round(rate, 2) if rate else None
+
+    result["eta"] = None
+    if job.status == "Finished":
+        result["eta"] = 0
+    elif job.gather_finished and result["import_rate"]:
+        left = max(result["gathered"] - result["imported"], 0)
+        result["eta"] = round(left / result["import_rate"])
+
+    updated = [v for k, v in progress.items() if k.endswith("_updated")]
+    result["updated"] = (
+        datetime.fromtimestamp(max(updated), timezone.utc).isoformat() if updated else None
+    )
+
+    return result
+
+
+@tk.side_effect_free
+def job_history(ctx: dict[str, Any], data_dict: dict) -> list[dict[str, Any]]:
+    """Returns the performance summaries of the finished jobs of the harvest
+    source, the latest first. Each summary has `regressions`: the metrics,
+    that are worse than the median of `window` previous jobs by more than
+    `threshold`"""
+    tk.check_access("harvest_basket_job_history", ctx, data_dict)
+
+    source_id: str = tk.get_or_bust(data_dict, "id")
+    if not model.Session.query(HarvestSource).get(source_id):
+        raise tk.ObjectNotFound(f"Harvest source {source_id} not found")
+
+    try:
+        limit = int(data_dict.get("limit", 20))
+        window = int(data_dict.get("window", REGRESSION_WINDOW))
+        threshold = float(data_dict.get("threshold", REGRESSION_THRESHOLD))
+    except ValueError as e:
+        raise tk.ValidationError(f"Invalid parameter: {e}")
+
+    # the oldest of the returned jobs need their own baseline
+    history = get_job_history(source_id, limit + window)
+
+    for idx, summary in enumerate(history[:limit]):
+        baseline = history[idx + 1 : idx + 1 + window]
+        summary["regressions"] = find_regressions(summary, baseline, threshold)
+
+    return history[:limit]
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any
+
+from sqlalchemy import extract, func
+
+import ckan.plugins.toolkit as tk
+from ckan import model
+from ckan.lib import search
+
+from ckanext.harvest.model import HarvestGatherError, HarvestJob, HarvestObject
+from ckanext.harvest_basket.utils import (
+    REGRESSION_THRESHOLD,
+    REGRESSION_WINDOW,
+    add_job_summary,
+    find_regressions,
+    get_job_history,
+    get_job_progress,
+    is_index_commit_deferred,
+)
+
+log = logging.getLogger(__name__)
+
+
+@tk.chained_action
+def harvest_jobs_run(next_, ctx: dict[str, Any], data_dict: dict) -> Any:
+    """Commits the search index for the jobs, that are marked as finished by
+    the upstream action and have deferred the commit. Records the performance
+    summary of these jobs and logs their regressions"""
+    running = [
+        job_id
+        for job_id, in model.Session.query(HarvestJob.id).filter(
+            HarvestJob.status == "Running"
+        )
+    ]
+
+    result = next_(ctx, data_dict)
+
+    if not running:
+        return result
+
+    finished = (
+        model.Session.query(HarvestJob)
+        .filter(HarvestJob.id.in_(running), HarvestJob.status == "Finished")
+        .all()
+    )
+
+    # the fetch consumers commit the index by batches, so the tail of
+    # the last batch is committed once the whole job is imported
+    if any(_is_index_commit_deferred(job) for job in finished):
+        try:
+            search.commit()
+        except search.SearchIndexError as e:
+            log.error("Search index commit of the finished jobs failed: %s", e)
+
+    for job in finished:
+        try:
+            _record_job_summary(job)
+        except Exception as e:
+            # the history is not worth failing the job run
+            log.warning("Summary of the harvest job %s is not recorded: %s", job.id, e)
+
+    return result
+
+
+def _is_index_commit_deferred(job: HarvestJob) -> bool:
+    try:
+        config = json.loads(job.source.config or "{}")
+    except ValueError:
+        return False
+    return isinstance(config, dict) and is_index_commit_deferred(config)
+
+
+def _record_job_summary(job: HarvestJob):
+    summary = _get_job_summary(job)
+    baseline = get_job_history(job.source_id, REGRESSION_WINDOW)
+    add_job_summary(job.source_id, summary)
+
+    regressions = find_regressions(summary, baseline, REGRESSION_THRESHOLD)
+    for name, regression in regressions.items():
+        log.warning(
+            "%s: %s of the harvest job %s is %s, the median of the previous "
+            "jobs is %s",
+            summary["harvester"],
+            name,
+            job.id,
+            regression["value"],
+            regression["baseline"],
+        )
+
+
+def _get_job_summary(job: HarvestJob) -> dict[str, Any]:
+    """Summarizes the performance of the finished job. The stage durations
+    are the sums of the object fetch and import times, because both stages
+    of the objects run interleaved in the fetch consumer"""
+
+    def _seconds(started, finished):
+        return func.coalesce(func.sum(extract("epoch", finished - started)), 0)
+
+    objects, errors, fetch_seconds, import_seconds = (
+        model.Session.query(
+            func.count(HarvestObject.id),
+            func.count(HarvestObject.id).filter(HarvestObject.state == "ERROR"),
+            _seconds(HarvestObject.fetch_started, HarvestObject.fetch_finished),
+            _seconds(HarvestObject.import_started, HarvestObject.import_finished),
+        )
+        .filter(HarvestObject.harvest_job_id == job.id)
+        .one()
+    )
+    errors += (
+        model.Session.query(HarvestGatherError)
+        .filter(HarvestGatherError.harvest_job_id == job.id)
+        .count()
+    )
+
+    started = job.gather_started or job.created
+    finished = job.finished or job.gather_finished or started
+    duration = max((finished - started).total_seconds(), 0.0)
+
+    gather_seconds = None
+    if job.gather_started and job.gather_finished:
+        gather_seconds = (job.gather_finished - job.gather_started).total_seconds()
+
+    progress = get_job_progress(job.id)
+
+    return {
+        "job_id": job.id,
+        "source_id": job.source_id,
+        "harvester": job.source.type,
+        "finished": finished.isoformat(),
+        "duration": round(duration, 1),
+        "gather_seconds": _round(gather_seconds),
+        "fetch_seconds": _round(float(fetch_seconds)),
+        "import_seconds": _round(float(import_seconds)),
+        "objects": objects,
+        "errors": errors,
+        "error_rate": round(errors / max(objects, 1), 4),
+        "requests": int(progress.get("requests", 0)),
+        "bytes": int(progress.get("bytes", 0)),
+        "objects_per_second": round(objects / duration, 2) if duration else None,
+        "peak_memory": int(progress["peak_memory"])
+        if "peak_memory" in progress
+        else None,
+    }
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import base64
+import json
+import zlib
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZLIB_PREFIX = "zlib:"
+ZSTD_PREFIX = "zstd:"
+
+COMPRESSION_METHODS = ("zlib", "zstd")
+
+# orjson turns integers bigger than 64 bit into floats. Such integers have at
+# least 19 digits, so the documents with long numbers are left to the json
+# module, that keeps them precise. Digits are translated to zeros and the
+# rest of bytes to spaces, because the substring search is several times
+# faster than the regex one
+LONG_NUMBER = b"0" * 19
+DIGITS_TABLE = bytes(
+    ord("0") if ord("0") <= i <= ord("9") else ord(" ") for i in range(256)
+)
+
+
+def dumps(data: Any) -> str:
+    """Serializes data to JSON. Uses the optional `orjson` package, that is
+    several times faster than the standard library, if it's available.
+
+    Args:
+        data (Any): JSON-serializable data
+
+    Returns:
+        str: JSON string
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf8")
+        except orjson.JSONEncodeError:
+            # e.g integers bigger than 64 bit, let the json module try it
+            pass
+
+    return json.dumps(data)
+
+
+def loads(content: str | bytes) -> Any:
+    """Parses JSON. Uses the optional `orjson` package if it's available.
+    Documents, that orjson can't parse exactly as the json module does, e.g
+    with NaN or integers bigger than 64 bit, are parsed by the json module.
+
+    Args:
+        content (str | bytes): JSON string
+
+    Raises:
+        ValueError: if the content is not a valid JSON
+
+    Returns:
+        Any: parsed data
+    """
+    if orjson is not None and not _has_long_numbers(content):
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity are rejected by orjson, but the portals emit
+            # them. Invalid documents are rejected by the json module as well
+            pass
+
+    return json.loads(content)
+
+
+def _has_long_numbers(content: str | bytes) -> bool:
+    if isinstance(content, str):
+        content = content.encode("utf8")
+    return LONG_NUMBER in content.translate(DIGITS_TABLE)
+
+
+def is_compression_available(method: str) -> bool:
+    """zlib is always available, zstd requires the optional `zstandard`
+    package"""
+    if method == "zstd":
+        return zstandard is not None
+
+    return method in COMPRESSION_METHODS
+
+
+def compress(content: str, method: Optional[str]) -> str:
+    """Compresses the harvest object content. The result is base64 encoded,
+    because the content is stored in the text column, and marked with the
+    method prefix, so it could be told apart from the plain content.
+
+    Args:
+        content (str): plain content
+        method (Optional[str]): `zlib`, `zstd` or None to keep it plain
+
+    Returns:
+        str: compressed content
+    """
+    if not method:
+        return content
+
+    data = content.encode("utf8")
+
+    if method == "zstd":
+        prefix = ZSTD_PREFIX
+        data = zstandard.ZstdCompressor().compress(data)
+    else:
+        prefix = ZLIB_PREFIX
+        data = zlib.compress(data)
+
+    return prefix + base64.b64encode(data).decode("ascii")
+
+
+def decompress(content: str) -> str:
+    """Restores the harvest object content, compressed by `compress`. The
+    plain content is returned as is, so objects created before the
+    compression was enabled are still readable.
+
+    Args:
+        content (str): stored content
+
+    Raises:
+        ValueError: if the content is corrupted or the `zstandard` package
+                    required to decompress it is missing
+
+    Returns:
+        str: plain content
+    """
+    if content.startswith(ZLIB_PREFIX):
+        try:
+            data = zlib.decompress(base64.b64decode(content[len(ZLIB_PREFIX):]))
+        except (zlib.error, ValueError) as e:
+            raise ValueError(f"Compressed content is corrupted: {e}") from e
+
+    elif content.startswith(ZSTD_PREFIX):
+        if zstandard is None:
+            raise ValueError("`zstandard` package is required to read the content")
+
+        try:
+            data = zstandard.ZstdDecompressor().decompress(
+                base64.b64decode(content[len(ZSTD_PREFIX):])
+            )
+        except (zstandard.ZstdError, ValueError) as e:
+            raise ValueError(f"Compressed content is corrupted: {e}") from e
+
+    else:
+        return content
+
+    return data.decode("utf8")
@@ -1,15 +1,14 @@
 from __future__ import annotations
-import json
 import logging
-from typing import Any
+from typing import Any, Optional, Union
 
 
 from ckan.plugins import toolkit as tk
 from ckan.lib.munge import munge_name
 
-from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.harvesters.ckanharvester import ContentFetchError, SearchError
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
 
 log = logging.getLogger(__name__)
@@ -17,6 +16,12 @@ log = logging.getLogger(__name__)
 
 class ArcGISHarvester(BasketBasicHarvester):
     SRC_ID = "ArcGIS"
+    # layer definitions, only layer IDs and names are used
+    PRUNE_FIELDS = (
+        "resources.*.extent",
+        "resources.*.drawingInfo",
+        "resources.*.fields",
+    )
 
     def info(self):
         return {
@@ -28,7 +33,7 @@ class ArcGISHarvester(BasketBasicHarvester):
     def gather_stage(self, harvest_job):
         source_url = self._get_src_url(harvest_job)
 
-        self._set_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
         log.info(f"{self.SRC_ID}: gather stage started: {source_url}")
 
         try:
@@ -36,7 +41,8 @@ class ArcGISHarvester(BasketBasicHarvester):
         except SearchError as e:
             log.error(f"{self.SRC_ID}: searching for datasets failed: {e}")
             self._save_gather_error(
-                f"{self.SRC_ID}: unable to search the remote ArcGIS portal for datasets: {harvest_job}"
+                f"{self.SRC_ID}: unable to search the remote ArcGIS portal for datasets: {source_url}",
+                harvest_job,
             )
             return []
 
@@ -63,39 +69,52 @@ class ArcGISHarvester(BasketBasicHarvester):
 
                 package_ids.add(pkg_id)
 
-                log.info(
+                log.debug(
                     f"{self.SRC_ID}: creating harvest_object for package: {pkg_id}"
                 )
-                obj = HarvestObject(
-                    guid=pkg_id, job=harvest_job, content=json.dumps(pkg_dict)
-                )
-                obj.save()
-                object_ids.append(obj.id)
+                obj = self._make_harvest_object(pkg_id, harvest_job, pkg_dict)
+                if obj:
+                    object_ids.append(obj.id)
 
-            return object_ids
+            # the services, that failed to be fetched, are not deleted
+            return self._finish_gather(
+                harvest_job, object_ids, complete=not self._gather_stats["failed"]
+            )
         except Exception as e:
             log.debug(f"{self.SRC_ID}: the error occured during the gather stage: {e}")
             self._save_gather_error("{}".format(e), harvest_job)
-            return []
+            return self._finish_gather(harvest_job, object_ids, complete=False)
+
+    def _get_remote_modified(self, pkg_dict):
+        return self._parse_remote_modified(pkg_dict.get("modified"))
 
     def _search_datasets(self, source_url: str) -> list[dict[str, Any]]:
         services_dicts = []
         services_urls: list[str] = self._get_all_services_urls_list(source_url)
         max_datasets = tk.asint(self.config.get("max_datasets", 0))
 
-        for service in services_urls:
-            log.info(f"{self.SRC_ID}: gathering remote dataset: {service}")
-            log.info(
-                f"{self.SRC_ID}: progress "
-                f"{services_urls.index(service) + 1}/{len(services_urls) + 1}"
+        for number, service in enumerate(services_urls, start=1):
+            if self._is_gather_deadline_passed():
+                break
+
+            log.debug(
+                f"{self.SRC_ID}: gathering remote dataset "
+                f"{number}/{len(services_urls)}: {service}"
             )
             service_meta = self._get_service_metadata(service)
-            service_meta["resources"] = self._get_service_metadata(service, res=True)
+            resources = self._get_service_metadata(service, res=True)
+
+            if service_meta is None or resources is None:
+                self._gather_stats["failed"] += 1
+                continue
 
             if not service_meta.get("id"):
                 log.error(f"{self.SRC_ID}: the dataset has no id. Skipping...")
+                self._gather_stats["failed"] += 1
                 continue
 
+            service_meta["resources"] = resources
+
             services_dicts.append(service_meta)
 
             if max_datasets and len(services_dicts) == max_datasets:
@@ -127,7 +146,7 @@ class ArcGISHarvester(BasketBasicHarvester):
             return []
 
         try:
-            content = json.loads(resp.text)
+            content = codec.loads(resp.content)
         except ValueError as e:
             raise SearchError(
                 f"{self.SRC_ID}: response from remote portal was not a JSON: {e}"
@@ -143,7 +162,9 @@ class ArcGISHarvester(BasketBasicHarvester):
 
         return services_urls
 
-    def _get_service_metadata(self, service_url: str, res: bool = False) -> dict:
+    def _get_service_metadata(
+        self, service_url: str, res: bool = False
+    ) -> Optional[Union[dict, list]]:
         """Fetches service metadata or service resource metadata
         Uses two different methods depends on `res` parameter
 
@@ -152,29 +173,39 @@ class ArcGISHarvester(BasketBasicHarvester):
             res (bool, optional): Flag to change the fetch method. Defaults to False.
 
         Returns:
-            dict: service metadata
+            Optional[Union[dict, list]]: service metadata or a list of service
+                                         resources. None if the metadata
+                                         can't be fetched
         """
         param = "/?f=pjson" if res else "/info/itemInfo?f=pjson"
 
         try:
             resp = self._make_request((service_url + param))
-        except ContentFetchError:
-            log.debug(f"{self.SRC_ID}: Can't fetch the metadata. Access denied.")
-            return []
+        except tk.ValidationError:
+            log.error(f"{self.SRC_ID}: Can't fetch the metadata. Access denied.")
+            return None
+
+        if not resp:
+            return None
 
         try:
-            content = json.loads(resp.text)
-        except ValueError as e:
-            log.debug(
+            content = codec.loads(resp.content)
+        except ValueError:
+            log.error(
                 f"{self.SRC_ID}: Can't fetch the metadata. JSON object is corrupted"
             )
+            return None
 
-        if res:
-            resources = []
-            for res in content["layers"] + content["tables"]:
-                resources.append(res)
+        # ArcGIS reports errors with the 200 status code
+        if not isinstance(content, dict) or "error" in content:
+            log.error(
+                f"{self.SRC_ID}: Can't fetch the metadata of {service_url}: "
+                f"{content.get('error') if isinstance(content, dict) else content}"
+            )
+            return None
 
-            return resources
+        if res:
+            return content.get("layers", []) + content.get("tables", [])
 
         return content
 
@@ -183,10 +214,17 @@ class ArcGISHarvester(BasketBasicHarvester):
         return f"{offset}{pkg_id}_{res_id}.{fmt}"
 
     def fetch_stage(self, harvest_object):
+        if self._get_object_status(harvest_object) == "delete":
+            return True
+
         self.source_url = harvest_object.source.url.strip("/")
-        package_dict = json.loads(harvest_object.content)
+        self._set_config(harvest_object.source.config)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        package_dict = self._load_content(harvest_object.content)
         self._pre_map_stage(package_dict, self.source_url)
-        harvest_object.content = json.dumps(package_dict)
+        harvest_object.content = self._dump_content(package_dict)
         return True
 
     def _pre_map_stage(self, package_dict, source_url):
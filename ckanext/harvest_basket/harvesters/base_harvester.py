@@ -3,8 +3,16 @@ import requests
 import logging
 import json
 import uuid
-from typing import Any, Optional
-from datetime import datetime as dt
+import collections
+import contextlib
+import functools
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional
+from urllib.parse import urlparse
+from datetime import datetime as dt, timedelta, timezone
 from dateutil import parser
 from html import unescape
 
@@ -13,20 +21,126 @@ from html2markdown import convert
 import ckan.plugins.toolkit as tk
 from ckan.plugins import plugin_loaded
 from ckan import model
+from ckan.lib import search
+from ckan.lib.redis import connect_to_redis
 from ckan.lib.munge import munge_tag
 from ckanext.transmute.utils import get_schema
 
 from ckanext.harvest.harvesters.base import HarvesterBase
+from ckanext.harvest.model import (
+    HarvestObject,
+    HarvestObjectError,
+    HarvestObjectExtra,
+)
+from ckanext.harvest.harvesters.ckanharvester import SearchError
 try:
     from ckanext.xloader.plugin import XLoaderFormats
 except ImportError:
     from ckanext.xloader.utils import XLoaderFormats
 
+from ckanext.harvest_basket import codec
+from ckanext.harvest_basket.utils import (
+    get_memory_usage,
+    get_source_state,
+    is_index_commit_deferred,
+    prune_fields,
+    set_source_state,
+    track_job_progress,
+)
+from ckanext.harvest_basket.throttle import (
+    RETRY_STATUSES,
+    THROTTLE_STATUSES,
+    BudgetExceededError,
+    CircuitBreaker,
+    CircuitOpenError,
+    PageSizer,
+    RateLimiter,
+    RetryBudget,
+    SharedTokenBucket,
+    get_backoff_delay,
+    parse_retry_after,
+)
+
 
 log = logging.getLogger(__name__)
 
+# marks the config option, that wasn't set
+_MISSING = object()
+
+
+def _log_circuit_change(host: str, old_state: str, new_state: str):
+    # the breaker of the host is shared by all the harvesters
+    log.warning(
+        "circuit breaker of %s changed from %s to %s", host, old_state, new_state
+    )
+
 
 class BasketBasicHarvester(HarvesterBase):
+    _config_cache: tuple[Optional[str], dict[str, Any]] = (None, {})
+
+    # shared by all the harvesters in the process
+    _host_slots: dict[str, threading.BoundedSemaphore] = {}
+    _rate_limiters: dict[str, RateLimiter] = {}
+    _shared_buckets: dict[str, SharedTokenBucket] = {}
+    _circuit_breakers: dict[str, CircuitBreaker] = {}
+    _host_slots_lock = threading.Lock()
+
+    # remote fields, requested from the portals that support projection.
+    # Empty means all the fields. Could be overridden with `fields` option
+    DEFAULT_FIELDS: tuple[str, ...] = ()
+
+    # dotted paths of the bulky remote fields, that are never used by the
+    # harvester. Could be overridden with `prune_fields` option
+    PRUNE_FIELDS: tuple[str, ...] = ()
+    _pruned_bytes = 0
+
+    # default page size of the remote search and its bounds for the
+    # `adaptive_page_size` option
+    PAGE_SIZE = 50
+    PAGE_SIZE_BOUNDS: tuple[int, int] = (10, 200)
+    PAGE_SIZE_STATE = "page_size"
+    _page_sizer: Optional[PageSizer] = None
+
+    CATALOG_FINGERPRINT_STATE = "catalog_fingerprint"
+    _catalog_fingerprint: Optional[str] = None
+
+    # state of the gather stage, see `_start_gather`
+    _gather_stats: collections.Counter = collections.Counter()
+    _seen_guids: set[str] = set()
+    _harvested: dict[str, tuple[str, Optional[dt]]] = {}
+
+    # `job_deadline` of the current job, see `_set_deadline`
+    _deadline: Optional[dt] = None
+    _deadline_exceeded = False
+    # share of the `job_deadline`, that is left for the essential work
+    DEADLINE_RESERVE = 0.1
+
+    # progress counters of the job, not sent to Redis yet, see
+    # `_track_progress`. Only every PROGRESS_LOG_EVERY object is logged
+    _progress: collections.Counter = collections.Counter()
+    # number of requests and received bytes, not sent to Redis yet
+    _metrics: collections.Counter = collections.Counter()
+    _progress_job_id: Optional[str] = None
+    # the counters are updated by the threads of `_run_concurrently`
+    _progress_lock = threading.Lock()
+    # resident memory at the start of the gather stage or the object fetch,
+    # the growth since then is reported as the peak memory of the job
+    _memory_baseline: Optional[int] = None
+    PROGRESS_FLUSH_SIZE = 100
+    PROGRESS_LOG_EVERY = 1000
+
+    # datasets indexed without the search index commit in this process
+    _uncommitted = 0
+    # `ckan.search.solr_commit` is process-wide, so it's disabled while any
+    # thread imports with the deferred commit, see `_defer_search_commit`
+    _deferred_imports = 0
+    _solr_commit: Any = None
+    _solr_commit_lock = threading.Lock()
+
+    # retries left for the current harvest job, see `_reset_retry_budget`
+    _retry_budget: Optional[RetryBudget] = None
+    MAX_RETRY_DELAY = 300
+
     def _datetime_refine(self, string):
         now = dt.now().isoformat()
 
@@ -59,13 +173,62 @@ class BasketBasicHarvester(HarvesterBase):
         return convert(string)
 
     def _make_request(
-        self, url: str, stream: bool = False
+        self,
+        url: str,
+        stream: bool = False,
+        raise_for_status: bool = False,
+        method: str = "GET",
     ) -> Optional[requests.Response]:
+        """Requests the remote portal within the host limits and the request
+        timeout. Connection errors are logged and None is returned
+
+        Args:
+            url (str): request URL
+            stream (bool, optional): don't download the body at once.
+                Defaults to False.
+            raise_for_status (bool, optional): raise `HTTPError` with the
+                response instead of `ValidationError` for the bad
+                responses. Defaults to False.
+            method (str, optional): HTTP method, redirects are followed
+                for any of them. Defaults to "GET".
+
+        Raises:
+            tk.ValidationError: if the response is not successful
+            CircuitOpenError: if the circuit breaker of the host is open
+
+        Returns:
+            Optional[requests.Response]: successful response
+        """
         resp = None
         err_msg = ""
+        # throttled requests are retried only when the rate limiter is
+        # enabled, it takes care of waiting
+        retries = 0
+        if self._get_rate_limiter(url):
+            retries = tk.asint((self.config or {}).get("max_retries", 3))
 
         try:
-            resp = requests.get(url, stream=stream)
+            for attempt in range(retries + 1):
+                with self._host_slot(url):
+                    resp = requests.request(
+                        method,
+                        url,
+                        stream=stream,
+                        timeout=self._get_request_timeout(),
+                    )
+                self._report_response(url, resp, stream)
+
+                if resp.status_code not in THROTTLE_STATUSES or attempt == retries:
+                    break
+
+                log.warning(
+                    "%s: request to %s is throttled (%s, %s). Retrying",
+                    self.SRC_ID,
+                    url,
+                    resp.status_code,
+                    resp.reason,
+                )
+                resp.close()
         except requests.exceptions.HTTPError as e:
             err_msg = f"{self.SRC_ID}: The HTTP error happend during request {e}"
             log.error(err_msg)
@@ -86,6 +249,9 @@ class BasketBasicHarvester(HarvesterBase):
         if resp.status_code == 200:
             return resp
 
+        if raise_for_status:
+            resp.raise_for_status()
+
         err_msg = (
             f"{self.SRC_ID}: Bad response from remote portal: "
             f"{resp.status_code}, {resp.reason}"
@@ -93,6 +259,1053 @@ class BasketBasicHarvester(HarvesterBase):
         log.error(err_msg)
         raise tk.ValidationError({self.SRC_ID: err_msg})
 
+    def _make_page_request(
+        self,
+        url: str,
+        sizer: Optional[PageSizer] = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> requests.Response:
+        """Requests a page of the remote search results. Connection errors,
+        timeouts and server errors are retried with exponential backoff,
+        honouring the `Retry-After` header. The number of retries is limited
+        by `max_retries` per page and `max_failures` per harvest job.
+
+        Args:
+            url (str): page URL
+            sizer (Optional[PageSizer], optional): collects the response
+                time and size of the page. Defaults to None.
+            headers (Optional[dict[str, str]], optional): request headers,
+                e.g the API key. Defaults to None.
+
+        Raises:
+            SearchError: if the page couldn't be fetched
+
+        Returns:
+            requests.Response: successful response
+        """
+        config = self.config or {}
+        max_retries = tk.asint(config.get("max_retries", 3))
+        backoff = float(config.get("retry_backoff", 1))
+        attempt = 0
+
+        while True:
+            retry_after = None
+            try:
+                with self._host_slot(url):
+                    started = time.monotonic()
+                    resp = requests.get(
+                        url, headers=headers, timeout=self._get_request_timeout()
+                    )
+                self._report_response(url, resp)
+            except CircuitOpenError as e:
+                raise SearchError(f"{self.SRC_ID}: request to {url} is not sent: {e}")
+            except requests.exceptions.RequestException as e:
+                reason = str(e)
+                if sizer:
+                    sizer.fail()
+            else:
+                if resp.status_code == 200:
+                    if sizer:
+                        sizer.observe(time.monotonic() - started, len(resp.content))
+                    return resp
+
+                reason = f"{resp.status_code}, {resp.reason}"
+                if resp.status_code not in RETRY_STATUSES:
+                    raise SearchError(
+                        f"{self.SRC_ID}: Bad response from remote portal: {reason}"
+                    )
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+
+                # rate limiting has nothing to do with the page size
+                if sizer and resp.status_code != 429:
+                    sizer.fail()
+
+            budget = self._retry_budget
+            if attempt >= max_retries or (budget and not budget.spend()):
+                raise SearchError(
+                    f"{self.SRC_ID}: giving up on {url} after "
+                    f"{attempt + 1} attempts: {reason}"
+                )
+
+            delay = get_backoff_delay(attempt, backoff)
+            if retry_after is not None:
+                delay = min(max(delay, retry_after), self.MAX_RETRY_DELAY)
+
+            log.warning(
+                "%s: request to %s failed (%s). Retrying in %.1f seconds",
+                self.SRC_ID,
+                url,
+                reason,
+                delay,
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _paginate(
+        self,
+        url: str,
+        get_next_url: Callable[[Any], Optional[str]],
+        sizer: Optional[PageSizer] = None,
+    ) -> Iterator[Any]:
+        """Yields JSON pages of the remote search results, following the URL
+        of the next page until there is none.
+
+        Args:
+            url (str): URL of the first page
+            get_next_url (Callable[[Any], Optional[str]]): extracts the URL
+                                                           of the next page
+            sizer (Optional[PageSizer], optional): collects the response
+                time and size of the pages. Defaults to None.
+
+        Raises:
+            SearchError: if the page couldn't be fetched or it's not a JSON
+
+        Returns:
+            Iterator[Any]: parsed pages
+        """
+        while url:
+            if self._is_gather_deadline_passed():
+                return
+
+            log.debug("%s: requesting page %s", self.SRC_ID, url)
+            resp = self._make_page_request(url, sizer)
+
+            try:
+                page = codec.loads(resp.content)
+            except ValueError as e:
+                raise SearchError(
+                    f"{self.SRC_ID}: response from remote portal was not a JSON: {e}"
+                )
+
+            yield page
+            url = get_next_url(page)
+
+    def _reset_retry_budget(self):
+        """Starts the per-job retry budget"""
+        config = self.config or {}
+        self._retry_budget = RetryBudget(tk.asint(config.get("max_failures", 20)))
+
+    def _start_gather(self, harvest_job):
+        """Prepares the harvester for the gather stage of the job. Must be
+        called at the beginning of the gather stage"""
+        self._set_config(harvest_job.source.config)
+        self._set_progress_job(harvest_job.id)
+        self._memory_baseline = get_memory_usage()
+        self._reset_retry_budget()
+        self._pruned_bytes = 0
+        self._gather_stats = collections.Counter()
+        self._seen_guids = set()
+        self._harvested = {}
+        self._catalog_fingerprint = None
+        self._page_sizer = self._load_page_sizer(harvest_job)
+        self._set_deadline(harvest_job)
+
+        if self._is_skip_unchanged_enabled() or self._is_delete_missing_enabled():
+            self._harvested = self._get_harvested_objects(harvest_job.source.id)
+
+    def _finish_gather(
+        self, harvest_job, object_ids: list[str], complete: bool = False
+    ) -> list[str]:
+        """Withdraws the datasets, removed from the remote portal, and
+        reports the results of the gather stage. The missing datasets are
+        withdrawn only if the gather is explicitly marked as complete
+
+        Args:
+            harvest_job (HarvestJob): harvest job
+            object_ids (list[str]): IDs of the created harvest objects
+            complete (bool, optional): whether all the remote datasets were
+                                       gathered. Defaults to False.
+
+        Returns:
+            list[str]: IDs of the created harvest objects
+        """
+        if self._deadline_exceeded:
+            complete = False
+
+        if self._is_delete_missing_enabled():
+            max_datasets = tk.asint(self.config.get("max_datasets", 0))
+
+            if complete and not max_datasets:
+                object_ids.extend(self._withdraw_missing(harvest_job))
+            else:
+                log.info(
+                    "%s: only a part of remote datasets is gathered, "
+                    "missing datasets are not deleted",
+                    self.SRC_ID,
+                )
+
+        if complete:
+            self._save_catalog_fingerprint(harvest_job)
+            self._save_page_sizer(harvest_job)
+
+        self._flush_progress()
+
+        log.info(
+            "%s: %d harvest objects created (new: %d, changed: %d, "
+            "deleted: %d, unchanged skipped: %d, failed: %d), about %d bytes "
+            "of unused remote fields pruned",
+            self.SRC_ID,
+            len(object_ids),
+            self._gather_stats["new"],
+            self._gather_stats["change"],
+            self._gather_stats["delete"],
+            self._gather_stats["unchanged"],
+            self._gather_stats["failed"],
+            self._pruned_bytes,
+        )
+        return object_ids
+
+    def _set_deadline(self, harvest_job):
+        """Computes the deadline of the job from the `job_deadline` option,
+        number of seconds since the job has started"""
+        self._deadline_exceeded = False
+        self._deadline = None
+
+        seconds = tk.asint(self.config.get("job_deadline", 0))
+        if seconds <= 0:
+            return
+
+        started = harvest_job.gather_started or harvest_job.created or dt.utcnow()
+        self._deadline = started + timedelta(seconds=seconds)
+
+    def _get_time_left(self) -> Optional[float]:
+        """Number of seconds before the job deadline or None if the job has
+        no deadline"""
+        if not self._deadline:
+            return None
+
+        return (self._deadline - dt.utcnow()).total_seconds()
+
+    def _is_deadline_passed(self) -> bool:
+        time_left = self._get_time_left()
+        return time_left is not None and time_left <= 0
+
+    def _is_gather_deadline_passed(self) -> bool:
+        """Checks the deadline between the requests of the gather stage. Once
+        it has passed, the gather stage is considered incomplete"""
+        if not self._is_deadline_passed():
+            return False
+
+        if not self._deadline_exceeded:
+            log.warning(
+                "%s: job deadline has passed, the rest of the remote catalog "
+                "is not gathered",
+                self.SRC_ID,
+            )
+        self._deadline_exceeded = True
+        return True
+
+    def _is_time_tight(self) -> bool:
+        """Checks if the job is close to its deadline, so the optional work
+        should be skipped"""
+        time_left = self._get_time_left()
+        if time_left is None:
+            return False
+
+        deadline = tk.asint(self.config.get("job_deadline", 0))
+        return time_left < deadline * self.DEADLINE_RESERVE
+
+    def _can_enrich(self, what: str, pkg_id: str) -> bool:
+        """Checks if the optional enrichment of the dataset could be done.
+        The skipped enrichment is logged.
+
+        Args:
+            what (str): name of the enrichment, e.g `spatial coverage`
+            pkg_id (str): remote dataset ID
+
+        Returns:
+            bool: False if the job is close to its deadline
+        """
+        if not self._is_time_tight():
+            return True
+
+        log.warning(
+            "%s: job deadline is close, skipping %s of the dataset %s",
+            self.SRC_ID,
+            what,
+            pkg_id,
+        )
+        return False
+
+    def _get_request_timeout(self) -> Optional[float]:
+        """Timeout of the request to the remote portal, limited by the
+        `request_budget` option and the time left before the job deadline
+
+        Returns:
+            Optional[float]: seconds or None if there is no limit
+        """
+        config = self.config or {}
+        limits = []
+
+        budget = float(config.get("request_budget", 0))
+        if budget > 0:
+            limits.append(budget)
+
+        time_left = self._get_time_left()
+        if time_left is not None:
+            # let the request fail by timeout instead of failing it in advance
+            limits.append(max(time_left, 1.0))
+
+        return min(limits) if limits else None
+
+    def _iter_content(
+        self, resp: requests.Response, chunk_size: int
+    ) -> Iterator[bytes]:
+        """Yields the chunks of the streamed response. The timeout of the
+        request limits only the pauses between the chunks, so the download
+        as a whole is limited with `request_budget` and the job deadline here.
+
+        Args:
+            resp (requests.Response): streamed response
+            chunk_size (int): chunk size in bytes
+
+        Raises:
+            BudgetExceededError: if the download takes too long
+
+        Yields:
+            bytes: response content
+        """
+        timeout = self._get_request_timeout()
+        started = time.monotonic()
+
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            if timeout and time.monotonic() - started > timeout:
+                resp.close()
+                raise BudgetExceededError(
+                    f"download of {resp.url} takes more than {timeout:.1f} seconds"
+                )
+            yield chunk
+
+    def _start_fetch(self, harvest_object) -> bool:
+        """Prepares the harvester for the fetch stage of the object. Must be
+        called after the config is set.
+
+        Args:
+            harvest_object (HarvestObject): harvest object
+
+        Returns:
+            bool: False if the job deadline has passed and the object must
+                  not be fetched
+        """
+        self._set_deadline(harvest_object.job)
+        self._set_progress_job(harvest_object.harvest_job_id)
+        # the fetch consumer imports the object right after the fetch, so
+        # the growth covers both stages
+        self._memory_baseline = get_memory_usage()
+        self._track_progress(harvest_object.harvest_job_id, "fetched")
+
+        if not self._is_deadline_passed():
+            return True
+
+        self._save_object_error(
+            f"{self.SRC_ID}: job deadline has passed, the dataset is not fetched",
+            harvest_object,
+            "Fetch",
+        )
+        return False
+
+    def _track_progress(
+        self, job_id: str, stage: str, amount: int = 1, flush: bool = True
+    ):
+        """Counts the objects processed by the stage of the job, e.g
+        `gathered`, `fetched`, `imported` or `errors`. The counters are kept
+        in Redis and exposed by `harvest_basket_job_progress` action.
+
+        Args:
+            job_id (str): harvest job ID
+            stage (str): name of the counter
+            amount (int, optional): increment. Defaults to 1.
+            flush (bool, optional): send the counters to Redis right away,
+                otherwise they are sent by PROGRESS_FLUSH_SIZE objects.
+                Defaults to True.
+        """
+        self._set_progress_job(job_id)
+        with self._progress_lock:
+            self._progress[stage] += amount
+            pending = sum(self._progress.values())
+
+        if flush or pending >= self.PROGRESS_FLUSH_SIZE:
+            self._flush_progress()
+
+    def _set_progress_job(self, job_id: str):
+        """Switches the progress counters to the job. Requests made after
+        it are counted as the requests of this job"""
+        if job_id != self._progress_job_id:
+            self._flush_progress()
+            self._progress_job_id = job_id
+
+    def _flush_progress(self):
+        """Sends the progress counters to Redis and logs the progress each
+        PROGRESS_LOG_EVERY objects instead of every object"""
+        with self._progress_lock:
+            counts, self._progress = self._progress, collections.Counter()
+            metrics, self._metrics = self._metrics, collections.Counter()
+        job_id = self._progress_job_id
+
+        if not (counts or metrics) or not job_id:
+            return
+
+        maxima = {}
+        memory = get_memory_usage()
+        if memory is not None and self._memory_baseline is not None:
+            maxima["peak_memory"] = max(memory - self._memory_baseline, 0)
+
+        try:
+            totals = track_job_progress(job_id, dict(counts), dict(metrics), maxima)
+        except Exception as e:
+            # the progress is not worth failing the harvest
+            log.debug("%s: job progress is not tracked: %s", self.SRC_ID, e)
+            return
+
+        every = self.PROGRESS_LOG_EVERY
+        for stage, total in totals.items():
+            if total // every != (total - counts[stage]) // every:
+                log.info("%s: job %s, %s objects: %d", self.SRC_ID, job_id, stage, total)
+
+    def _save_object_error(self, message, obj, stage="Fetch", line=None):
+        self._track_progress(obj.harvest_job_id, "errors")
+        HarvestObjectError.create(message, obj, stage, line)
+
+    def _load_page_sizer(self, harvest_job) -> Optional[PageSizer]:
+        """Restores the page size, learned by the previous jobs of the
+        source, if `adaptive_page_size` option is enabled"""
+        if not tk.asbool(self.config.get("adaptive_page_size", False)):
+            return None
+
+        min_size, max_size = self.PAGE_SIZE_BOUNDS
+        try:
+            state = get_source_state(harvest_job.source.id, self.PAGE_SIZE_STATE)
+        except Exception as e:
+            log.warning("%s: learned page size is not available: %s", self.SRC_ID, e)
+            state = None
+
+        return PageSizer.from_state(state, min_size, max_size, self.PAGE_SIZE)
+
+    def _save_page_sizer(self, harvest_job):
+        """Adjusts the page size for the next job of the source"""
+        # a part of the catalog tells too little about the pagination
+        if not self._page_sizer or tk.asint(self.config.get("max_datasets", 0)):
+            return
+
+        size = self._page_sizer.size
+        new_size = self._page_sizer.adjust()
+
+        if new_size != size:
+            log.info(
+                "%s: page size is changed from %d to %d for the next job",
+                self.SRC_ID,
+                size,
+                new_size,
+            )
+
+        set_source_state(
+            harvest_job.source.id, self.PAGE_SIZE_STATE, self._page_sizer.get_state()
+        )
+
+    def _get_page_size(self, option: Optional[str] = None) -> int:
+        """Returns the page size of the remote search. The learned one, if
+        `adaptive_page_size` is enabled, otherwise the value of the
+        harvester specific option or the default one.
+
+        Args:
+            option (Optional[str], optional): name of the page size option.
+                                              Defaults to None.
+
+        Returns:
+            int: page size
+        """
+        if self._page_sizer:
+            return self._page_sizer.size
+
+        if option and option in self.config:
+            return tk.asint(self.config[option])
+
+        return self.PAGE_SIZE
+
+    def _get_catalog_fingerprint(self, source_url: str) -> Optional[str]:
+        """Returns a cheap summary of the remote catalog, e.g the number of
+        datasets and the latest modification date, that changes whenever
+        any of the datasets is changed. It should take one or two requests.
+
+        Args:
+            source_url (str): remote portal URL
+
+        Returns:
+            Optional[str]: fingerprint or None if it's not supported
+        """
+        return None
+
+    def _is_catalog_unchanged(self, harvest_job, source_url: str) -> bool:
+        """Checks if the remote catalog wasn't changed since the previous
+        job, so the gather stage could be skipped. The check is enabled by
+        `skip_unchanged_catalog` option. Must be called after the config
+        is set.
+
+        Args:
+            harvest_job (HarvestJob): harvest job
+            source_url (str): remote portal URL
+
+        Returns:
+            bool: True if the job could finish without any objects
+        """
+        self._catalog_fingerprint = None
+        config = self.config or {}
+
+        if not tk.asbool(config.get("skip_unchanged_catalog", False)):
+            return False
+
+        try:
+            fingerprint = self._get_catalog_fingerprint(source_url)
+        except Exception as e:
+            log.warning("%s: catalog fingerprint is not available: %s", self.SRC_ID, e)
+            return False
+
+        if not fingerprint:
+            return False
+
+        # the same catalog could give different datasets with another config
+        self._catalog_fingerprint = hashlib.sha1(
+            f"{fingerprint}\n{harvest_job.source.config}".encode("utf8")
+        ).hexdigest()
+
+        state = get_source_state(harvest_job.source.id, self.CATALOG_FINGERPRINT_STATE)
+        if not state or state["fingerprint"] != self._catalog_fingerprint:
+            return False
+
+        # the datasets, that failed during the previous job, must be retried
+        last_job = self.last_error_free_job(harvest_job)
+        if not last_job or last_job.id != state["job_id"]:
+            log.info(
+                "%s: the previous job has errors, gathering the catalog", self.SRC_ID
+            )
+            return False
+
+        log.info(
+            "%s: the remote catalog is not changed since the job %s, "
+            "skipping the gather stage",
+            self.SRC_ID,
+            state["job_id"],
+        )
+        self._save_catalog_fingerprint(harvest_job)
+        return True
+
+    def _save_catalog_fingerprint(self, harvest_job):
+        """Remembers the catalog fingerprint for the next job. The job ID
+        is stored too, so the next job could tell if this one had errors"""
+        if not self._catalog_fingerprint or harvest_job.gather_errors:
+            return
+
+        set_source_state(
+            harvest_job.source.id,
+            self.CATALOG_FINGERPRINT_STATE,
+            {"fingerprint": self._catalog_fingerprint, "job_id": harvest_job.id},
+        )
+
+    def _is_skip_unchanged_enabled(self) -> bool:
+        return tk.asbool(self.config.get("skip_unchanged", False))
+
+    def _is_delete_missing_enabled(self) -> bool:
+        return tk.asbool(self.config.get("delete_missing", False))
+
+    def _get_harvested_objects(
+        self, source_id: str
+    ) -> dict[str, tuple[str, Optional[dt]]]:
+        """Loads the current harvest objects of the source in one query
+
+        Args:
+            source_id (str): harvest source ID
+
+        Returns:
+            dict[str, tuple[str, Optional[dt]]]: package ID and remote
+                                                 modification date by guid
+        """
+        query = model.Session.query(
+            HarvestObject.guid,
+            HarvestObject.package_id,
+            HarvestObject.metadata_modified_date,
+        ).filter(
+            HarvestObject.current == True,  # noqa: E712
+            HarvestObject.harvest_source_id == source_id,
+        )
+
+        return {guid: (package_id, modified) for guid, package_id, modified in query}
+
+    def _get_remote_modified(self, pkg_dict: dict[str, Any]) -> Optional[dt]:
+        """Returns the modification date of the remote dataset, if the
+        portal provides it. It's used to skip the unchanged datasets.
+
+        Args:
+            pkg_dict (dict[str, Any]): remote dataset
+
+        Returns:
+            Optional[dt]: naive UTC datetime
+        """
+        return None
+
+    def _parse_remote_modified(self, value: Any) -> Optional[dt]:
+        """Parses ISO string or UNIX timestamp in seconds or milliseconds
+        into a naive UTC datetime"""
+        if not value:
+            return None
+
+        try:
+            if isinstance(value, (int, float)):
+                # timestamps in milliseconds are way bigger
+                if value > 10**11:
+                    value /= 1000
+                return dt.utcfromtimestamp(value)
+
+            date = parser.parse(value)
+        except (ValueError, OverflowError, OSError):
+            return None
+
+        if date.tzinfo:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return date
+
+    def _make_harvest_object(
+        self, guid: str, harvest_job, pkg_dict: dict[str, Any], **kwargs: Any
+    ) -> Optional[HarvestObject]:
+        """Creates a harvest object with the remote dataset as a content.
+        Unused remote fields are pruned beforehand. The object is not
+        created if the dataset wasn't modified since the previous harvest
+        and `skip_unchanged` is enabled, or if the content is bigger than
+        `max_content_size` bytes. The gather error is recorded in the
+        latter case.
+
+        Args:
+            guid (str): remote dataset ID
+            harvest_job (HarvestJob): harvest job
+            pkg_dict (dict[str, Any]): remote dataset
+            **kwargs (Any): extra HarvestObject fields
+
+        Returns:
+            Optional[HarvestObject]: saved harvest object
+        """
+        config = self.config or {}
+        self._seen_guids.add(guid)
+
+        harvested = self._harvested.get(guid)
+        remote_modified = self._get_remote_modified(pkg_dict)
+
+        if (
+            harvested
+            and self._is_skip_unchanged_enabled()
+            and remote_modified
+            and harvested[1]
+            and remote_modified <= harvested[1]
+        ):
+            log.debug("%s: dataset %s is not modified, skipping", self.SRC_ID, guid)
+            self._gather_stats["unchanged"] += 1
+            return None
+
+        status = "change" if harvested else "new"
+        if harvested:
+            kwargs.setdefault("package_id", harvested[0])
+        kwargs.setdefault("metadata_modified_date", remote_modified)
+        kwargs.setdefault("extras", [HarvestObjectExtra(key="status", value=status)])
+
+        for path in tk.aslist(config.get("prune_fields", self.PRUNE_FIELDS), ","):
+            for value in prune_fields(pkg_dict, path):
+                self._pruned_bytes += len(codec.dumps(value))
+
+        content = self._dump_content(pkg_dict)
+
+        max_size = tk.asint(config.get("max_content_size", 0))
+        if max_size and len(content) > max_size:
+            log.warning(
+                "%s: dataset %s is skipped, its content size %d exceeds %d bytes",
+                self.SRC_ID,
+                guid,
+                len(content),
+                max_size,
+            )
+            self._save_gather_error(
+                f"{self.SRC_ID}: dataset {guid} is skipped, its content size "
+                f"{len(content)} exceeds `max_content_size` of {max_size} bytes",
+                harvest_job,
+            )
+            return None
+
+        obj = HarvestObject(guid=guid, job=harvest_job, content=content, **kwargs)
+        obj.save()
+        self._gather_stats[status] += 1
+        self._track_progress(harvest_job.id, "gathered", flush=False)
+        return obj
+
+    def _withdraw_missing(self, harvest_job) -> list[str]:
+        """Creates harvest objects, that delete the local datasets, which
+        are not present at the remote portal anymore
+
+        Args:
+            harvest_job (HarvestJob): harvest job
+
+        Returns:
+            list[str]: IDs of the created harvest objects
+        """
+        objects = [
+            HarvestObject(
+                guid=guid,
+                job=harvest_job,
+                package_id=package_id,
+                extras=[HarvestObjectExtra(key="status", value="delete")],
+            )
+            for guid, (package_id, _modified) in self._harvested.items()
+            if guid not in self._seen_guids
+        ]
+
+        if not objects:
+            return []
+
+        log.info(
+            "%s: %d datasets are missing at the remote portal and will be deleted",
+            self.SRC_ID,
+            len(objects),
+        )
+        model.Session.add_all(objects)
+        model.Session.commit()
+
+        self._gather_stats["delete"] += len(objects)
+        self._track_progress(harvest_job.id, "gathered", len(objects), flush=False)
+        return [obj.id for obj in objects]
+
+    def _get_object_status(self, harvest_object) -> Optional[str]:
+        for extra in harvest_object.extras:
+            if extra.key == "status":
+                return extra.value
+
+        return None
+
+    def _delete_package(self, harvest_object) -> bool:
+        """Deletes the local dataset, removed from the remote portal
+
+        Args:
+            harvest_object (HarvestObject): harvest object with `delete` status
+
+        Returns:
+            bool: import result
+        """
+        context = {
+            "model": model,
+            "session": model.Session,
+            "user": self._get_user_name(),
+            "ignore_auth": True,
+        }
+
+        try:
+            tk.get_action("package_delete")(context, {"id": harvest_object.package_id})
+        except tk.ObjectNotFound:
+            log.info("%s: dataset %s is already deleted", self.SRC_ID, harvest_object.package_id)
+
+        # so the dataset isn't withdrawn once again by the next job
+        model.Session.query(HarvestObject).filter(
+            HarvestObject.package_id == harvest_object.package_id
+        ).update({"current": False})
+        model.Session.commit()
+
+        log.info(
+            "%s: deleted dataset %s with guid %s",
+            self.SRC_ID,
+            harvest_object.package_id,
+            harvest_object.guid,
+        )
+        self._track_progress(harvest_object.harvest_job_id, "imported")
+        return True
+
+    def _get_content_compression(self) -> Optional[str]:
+        config = self.config or {}
+        method = config.get("content_compression")
+
+        if not method:
+            return None
+
+        if not codec.is_compression_available(method):
+            log.warning(
+                "%s: `%s` content compression is not available, "
+                "the content is stored as is",
+                self.SRC_ID,
+                method,
+            )
+            return None
+
+        return method
+
+    def _dump_content(self, data: Any) -> str:
+        """Serializes the harvest object content. It's compressed if
+        `content_compression` option is set.
+
+        Args:
+            data (Any): JSON-serializable content
+
+        Returns:
+            str: harvest object content
+        """
+        return codec.compress(codec.dumps(data), self._get_content_compression())
+
+    def _load_content(self, content: str) -> Any:
+        """Parses the harvest object content, either compressed or plain
+
+        Args:
+            content (str): harvest object content
+
+        Returns:
+            Any: parsed content
+        """
+        return codec.loads(codec.decompress(content))
+
+    @contextlib.contextmanager
+    def _host_slot(self, url: str):
+        """Limits the number of simultaneous requests to the same remote host
+        within the process. The limit could be adjusted with
+        `max_host_connections` config option
+
+        Raises:
+            CircuitOpenError: if the circuit breaker of the host is open
+        """
+        host = urlparse(url).netloc
+
+        breaker = self._get_circuit_breaker(url)
+        if breaker and not breaker.allow():
+            raise CircuitOpenError(
+                f"{host} is unavailable after {breaker.threshold} consecutive "
+                f"failures, next attempt in {breaker.get_retry_in():.0f} seconds"
+            )
+
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                config = self.config or {}
+                limit = tk.asint(config.get("max_host_connections", 4))
+                self._host_slots[host] = threading.BoundedSemaphore(max(limit, 1))
+            slot = self._host_slots[host]
+
+        limiter = self._get_rate_limiter(url)
+        if limiter:
+            limiter.acquire()
+
+        bucket = self._get_shared_bucket(url)
+        if bucket:
+            try:
+                bucket.acquire()
+            except Exception as e:
+                # the harvest goes on without the cross-worker limit
+                log.warning(
+                    "%s: shared rate limit is not available: %s", self.SRC_ID, e
+                )
+
+        with slot:
+            try:
+                yield
+            except requests.exceptions.RequestException:
+                if breaker:
+                    breaker.record_failure()
+                raise
+
+    def _get_circuit_breaker(self, url: str) -> Optional[CircuitBreaker]:
+        """Returns the circuit breaker of the remote host, shared by all the
+        requests to it within the process. It's enabled by
+        `circuit_breaker_failures` config option, number of consecutive
+        connection errors, timeouts or server errors within
+        `circuit_breaker_window` seconds, that open the circuit. The probe
+        request is sent after `circuit_breaker_cooldown` seconds.
+
+        Args:
+            url (str): request URL
+
+        Returns:
+            Optional[CircuitBreaker]: circuit breaker or None if it's disabled
+        """
+        config = self.config or {}
+        threshold = tk.asint(config.get("circuit_breaker_failures", 0))
+        if threshold <= 0:
+            return None
+
+        window = float(config.get("circuit_breaker_window", 60))
+        cooldown = float(config.get("circuit_breaker_cooldown", 30))
+        host = urlparse(url).netloc
+
+        with self._host_slots_lock:
+            breaker = self._circuit_breakers.get(host)
+            if not breaker:
+                breaker = self._circuit_breakers[host] = CircuitBreaker(
+                    threshold,
+                    window,
+                    cooldown,
+                    on_change=functools.partial(_log_circuit_change, host),
+                )
+            elif (breaker.threshold, breaker.window, breaker.cooldown) != (
+                threshold,
+                window,
+                cooldown,
+            ):
+                # the source config is changed, the state of the host is kept
+                breaker.threshold = threshold
+                breaker.window = window
+                breaker.cooldown = cooldown
+
+        return breaker
+
+    def _get_rate_limiter(self, url: str) -> Optional[RateLimiter]:
+        """Returns the rate limiter of the remote host, shared by all the
+        requests to it within the process. It's enabled by `rate_limit`
+        config option, number of requests per second.
+
+        Args:
+            url (str): request URL
+
+        Returns:
+            Optional[RateLimiter]: rate limiter or None if it's disabled
+        """
+        config = self.config or {}
+        rate = float(config.get("rate_limit", 0))
+        if rate <= 0:
+            return None
+
+        host = urlparse(url).netloc
+
+        with self._host_slots_lock:
+            limiter = self._rate_limiters.get(host)
+            if not limiter:
+                limiter = self._rate_limiters[host] = RateLimiter(rate)
+            elif limiter.max_rate != rate:
+                # the source config is changed
+                limiter.max_rate = rate
+                limiter.rate = min(limiter.rate, rate)
+
+        return limiter
+
+    def _get_shared_bucket(self, url: str) -> Optional[SharedTokenBucket]:
+        """Returns the token bucket of the remote host, shared by all the
+        harvest workers via Redis. It's enabled by `shared_rate_limit` config
+        option, number of requests per second, and `shared_burst`, number of
+        requests that could be made at once.
+
+        Args:
+            url (str): request URL
+
+        Returns:
+            Optional[SharedTokenBucket]: token bucket or None if it's disabled
+        """
+        config = self.config or {}
+        rate = float(config.get("shared_rate_limit", 0))
+        if rate <= 0:
+            return None
+
+        burst = float(config.get("shared_burst", rate))
+        host = urlparse(url).netloc
+
+        with self._host_slots_lock:
+            bucket = self._shared_buckets.get(host)
+            if not bucket or (bucket.rate, bucket.burst) != (rate, max(burst, 1.0)):
+                site_id = tk.config.get("ckan.site_id")
+                bucket = self._shared_buckets[host] = SharedTokenBucket(
+                    connect_to_redis(),
+                    f"{site_id}:harvest_basket:rate_limit:{host}",
+                    rate,
+                    burst,
+                )
+
+        return bucket
+
+    def _report_response(
+        self, url: str, resp: requests.Response, stream: bool = False
+    ):
+        """Counts the request and adjusts the rate limiter and the circuit
+        breaker of the remote host to its response"""
+        if self._progress_job_id:
+            # the streamed body is not read yet, only the declared size is known
+            if stream:
+                size = int(resp.headers.get("Content-Length") or 0)
+            else:
+                size = len(resp.content)
+
+            with self._progress_lock:
+                self._metrics["requests"] += 1
+                self._metrics["bytes"] += size
+
+        breaker = self._get_circuit_breaker(url)
+        if breaker:
+            if resp.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+        limiter = self._get_rate_limiter(url)
+        if not limiter:
+            return
+
+        if resp.status_code not in THROTTLE_STATUSES:
+            limiter.on_success()
+            return
+
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        if retry_after is not None:
+            retry_after = min(retry_after, self.MAX_RETRY_DELAY)
+
+        limiter.on_throttle(retry_after)
+        log.warning(
+            "%s: %s responded with %s, slowing down to %.2f requests per second",
+            self.SRC_ID,
+            urlparse(url).netloc,
+            resp.status_code,
+            limiter.rate,
+        )
+
+    def _get_fields(self, *required: str) -> list[str]:
+        """Returns the list of remote fields to request. It's the `fields`
+        config option or harvester's `DEFAULT_FIELDS`.
+
+        Args:
+            *required (str): fields the harvester can't work without, they
+                             are always requested
+
+        Returns:
+            list[str]: field names, empty list means all the fields
+        """
+        config = self.config or {}
+        fields = list(tk.aslist(config.get("fields", self.DEFAULT_FIELDS), ","))
+
+        if fields:
+            fields.extend(field for field in required if field not in fields)
+
+        return fields
+
+    def _get_concurrency(self) -> int:
+        config = self.config or {}
+        return max(tk.asint(config.get("concurrency", 1)), 1)
+
+    def _run_concurrently(
+        self, func: Callable[[Any], Any], items: Iterable[Any]
+    ) -> Iterator[Any]:
+        """Applies the function to each item using a pool of `concurrency`
+        threads. Results are yielded in the order of items. Only a couple of
+        items per thread are submitted ahead, so the items could be a lazy
+        iterable and the results, that are not consumed yet, don't pile up.
+
+        Args:
+            func (Callable[[Any], Any]): function making remote requests
+            items (Iterable[Any]): function arguments
+
+        Returns:
+            Iterator[Any]: function results
+        """
+        workers = self._get_concurrency()
+
+        if workers == 1:
+            yield from map(func, items)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending: collections.deque = collections.deque()
+
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
     def make_checkup(self, source_url: str, source_name: str, config: dict):
         """Makes a test fetch of 1 dataset from the remote source
 
@@ -122,6 +1335,11 @@ class BasketBasicHarvester(HarvesterBase):
 
         try:
             pkg_dicts = self._search_datasets(source_url)
+
+            if not pkg_dicts:
+                return f"No datasets found on remote portal: {source_url}"
+
+            self._pre_map_stage(pkg_dicts[0], source_url)
         except Exception as e:
             raise tk.ValidationError(
                 "Checkup failed. Check your source URL \n"
@@ -129,18 +1347,18 @@ class BasketBasicHarvester(HarvesterBase):
                 f"Error: {e}"
             )
 
-        if not pkg_dicts:
-            return f"No datasets found on remote portal: {source_url}"
-
-        self._pre_map_stage(pkg_dicts[0], source_url)
         return pkg_dicts[0]
 
     def _set_config(self, config_str):
-        if config_str:
-            self.config = json.loads(config_str)
-        else:
-            self.config = {}
+        # harvesters are singletons, so the parsed config is reused by all
+        # the objects of the source instead of parsing it for each of them
+        cached_str, cached_config = self._config_cache
+
+        if config_str != cached_str:
+            cached_config = json.loads(config_str) if config_str else {}
+            self._config_cache = (config_str, cached_config)
 
+        self.config = dict(cached_config)
         return self.config
 
     def _fetch_tags(self, tag_list: list[str]) -> list[dict[str, str]]:
@@ -177,17 +1395,35 @@ class BasketBasicHarvester(HarvesterBase):
             "user": self._get_user_name(),
         }
 
-        config = self._set_config(harvest_object.source.config)
+        self._set_config(harvest_object.source.config)
 
         if not harvest_object:
             log.error("No harvest object received")
             return False
 
+        if self._get_object_status(harvest_object) == "delete":
+            return self._delete_package(harvest_object)
+
         if harvest_object.content is None:
             log.error(f"Empty content for object {harvest_object.id}: {harvest_object}")
             return False
 
-        package_dict = json.loads(harvest_object.content)
+        package_dict = self._load_content(harvest_object.content)
+        return self._import_package_dict(package_dict, harvest_object)
+
+    def _import_package_dict(self, package_dict: dict[str, Any], harvest_object):
+        """Creates or updates the local dataset. Harvesters, that have the
+        package dict in hand, call it directly instead of serializing the
+        dict into the object content for the `import_stage`.
+
+        Args:
+            package_dict (dict[str, Any]): mapped remote dataset
+            harvest_object (HarvestObject): harvest object
+
+        Returns:
+            bool | str: import result
+        """
+        config = self.config
 
         self._transmute_content(package_dict)
 
@@ -246,14 +1482,80 @@ class BasketBasicHarvester(HarvesterBase):
 
             return result
         except tk.ValidationError as e:
-            log.error(
-                "Invalid package with GUID {}: {}".format(
-                    (harvest_object.guid, e.error_dict), harvest_object
-                )
-            )
+            err_msg = f"Invalid package with GUID {harvest_object.guid}: {e.error_dict}"
+            log.error(err_msg)
+            self._save_object_error(err_msg, harvest_object, "Import")
         except Exception as e:
             self._save_object_error(str(e), harvest_object, "Import")
 
+    def _create_or_update_package(
+        self, package_dict, harvest_object, package_dict_form="rest"
+    ):
+        """Creates or updates the dataset, as the HarvesterBase does. If
+        `index_commit_batch` is set, the search index commit is deferred
+        and made once per batch of datasets, instead of committing every
+        dataset. The rest of datasets are committed, when the job is
+        finished by `harvest_jobs_run`. Successfully imported datasets are
+        counted by the job progress."""
+        if not is_index_commit_deferred(self.config or {}):
+            result = super()._create_or_update_package(
+                package_dict, harvest_object, package_dict_form
+            )
+        else:
+            try:
+                with self._defer_search_commit():
+                    result = super()._create_or_update_package(
+                        package_dict, harvest_object, package_dict_form
+                    )
+            finally:
+                self._uncommitted += 1
+
+                if self._uncommitted >= tk.asint(self.config["index_commit_batch"]):
+                    self._commit_search_index()
+
+        if result:
+            self._track_progress(harvest_object.harvest_job_id, "imported")
+        return result
+
+    @contextlib.contextmanager
+    def _defer_search_commit(self):
+        """Disables `ckan.search.solr_commit`, that the search index reads
+        on every indexed dataset. The original value is restored, when the
+        last of the concurrent imports is done."""
+        cls = BasketBasicHarvester
+
+        with cls._solr_commit_lock:
+            if not cls._deferred_imports:
+                cls._solr_commit = tk.config.get("ckan.search.solr_commit", _MISSING)
+                tk.config["ckan.search.solr_commit"] = False
+            cls._deferred_imports += 1
+
+        try:
+            yield
+        finally:
+            with cls._solr_commit_lock:
+                cls._deferred_imports -= 1
+
+                if not cls._deferred_imports:
+                    if cls._solr_commit is _MISSING:
+                        tk.config.pop("ckan.search.solr_commit", None)
+                    else:
+                        tk.config["ckan.search.solr_commit"] = cls._solr_commit
+
+    def _commit_search_index(self):
+        log.info(
+            "%s: committing %d datasets to the search index",
+            self.SRC_ID,
+            self._uncommitted,
+        )
+        try:
+            search.commit()
+        except search.SearchIndexError as e:
+            # datasets will be visible after the next commit
+            log.error("%s: search index commit failed: %s", self.SRC_ID, e)
+        else:
+            self._uncommitted = 0
+
     def transmute_data(self, data, schema):
         if schema:
             tk.get_action("tsm_transmute")(
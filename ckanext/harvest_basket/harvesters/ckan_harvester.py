@@ -1,5 +1,11 @@
-import json
+from __future__ import annotations
+
 import logging
+from functools import partial
+from typing import Any
+from urllib.parse import urlencode
+
+from dateutil import parser
 
 import ckan.plugins.toolkit as tk
 from ckan import model
@@ -7,6 +13,7 @@ from ckan import model
 from ckanext.harvest.harvesters import CKANHarvester
 from ckanext.harvest.harvesters.ckanharvester import SearchError
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
 from ckanext.transmute.utils import get_schema
 
@@ -17,14 +24,63 @@ log = logging.getLogger(__name__)
 class CustomCKANHarvester(CKANHarvester, BasketBasicHarvester):
     SRC_ID = "CKAN"
 
+    def gather_stage(self, harvest_job):
+        self._start_gather(harvest_job)
+        source_url = harvest_job.source.url.rstrip("/")
+
+        if self._is_catalog_unchanged(harvest_job, source_url):
+            return []
+
+        object_ids = super().gather_stage(harvest_job)
+
+        if object_ids is not None:
+            # the catalog, gathered partially, must not be skipped next time
+            if not self._deadline_exceeded:
+                self._save_catalog_fingerprint(harvest_job)
+            self._track_progress(harvest_job.id, "gathered", len(object_ids))
+        return object_ids
+
+    def _get_catalog_fingerprint(self, source_url):
+        # the number of datasets and the latest modification date
+        params = {
+            "rows": 1,
+            "sort": "metadata_modified desc",
+            "fl": "id,metadata_modified",
+        }
+        if fq := self.config.get("fq"):
+            params["fq"] = fq
+
+        search_url = source_url + self._get_search_api_offset()
+        pkg_dicts, count = self._get_search_page(search_url, params, 0)
+
+        if not pkg_dicts:
+            return None
+
+        return f"{count}:{pkg_dicts[0]['id']}:{pkg_dicts[0]['metadata_modified']}"
+
+    def fetch_stage(self, harvest_object):
+        self._set_config(harvest_object.source.config)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        return super().fetch_stage(harvest_object)
+
     def import_stage(self, harvest_object):
-        package_dict = json.loads(harvest_object.content)
         self._set_config(harvest_object.source.config)
 
-        self._transmute_content(package_dict)
+        # transmute schemas are applied to the remote dataset before the
+        # upstream defaults and organization handling
+        if harvest_object.content:
+            package_dict = codec.loads(harvest_object.content)
+            self._transmute_content(package_dict)
+            harvest_object.content = codec.dumps(package_dict)
 
-        harvest_object.content = json.dumps(package_dict)
-        super().import_stage(harvest_object)
+        # the imported datasets are counted by `_create_or_update_package`,
+        # the deleted ones don't pass it
+        result = super().import_stage(harvest_object)
+        if result and self._get_object_status(harvest_object) == "delete":
+            self._track_progress(harvest_object.harvest_job_id, "imported")
+        return result
 
     def _search_for_datasets(self, remote_ckan_base_url, fq_terms=None):
         if fq_terms is None:
@@ -32,10 +88,171 @@ class CustomCKANHarvester(CKANHarvester, BasketBasicHarvester):
         if fq := self.config.get("fq" ,""):
             fq_terms.append(fq)
 
-        pkg_dicts = super()._search_for_datasets(remote_ckan_base_url, fq_terms)
         max_datasets = int(self.config.get("max_datasets", 0))
+        rows = min(max_datasets, 100) if max_datasets else 100
+
+        # sorting by ID, see the reasons in the CKANHarvester
+        params = {"rows": rows, "sort": "id asc"}
+        if fq_terms:
+            params["fq"] = " ".join(fq_terms)
+
+        # fields required for pagination and deduplication
+        if fields := self._get_fields("id", "metadata_modified"):
+            params["fl"] = ",".join(fields)
+
+        search_url = remote_ckan_base_url + self._get_search_api_offset()
+
+        if self.config.get("pagination") == "keyset":
+            return self._search_for_datasets_by_keyset(search_url, params, max_datasets)
+
+        get_page = partial(self._get_search_page, search_url, params)
+
+        pkg_dicts = []
+        pkg_ids = set()
+        count = None
+        start = 0
+        # the first page is fetched alone to get the total number of datasets,
+        # the next ones - by windows of `concurrency` pages
+        window = 1
+
+        while not self._is_gather_deadline_passed():
+            starts = [
+                page_start
+                for page_start in range(start, start + window * rows, rows)
+                if (count is None or page_start < count)
+                and (not max_datasets or page_start < max_datasets)
+            ]
+            if not starts:
+                break
+
+            exhausted = False
+
+            for pkg_dicts_page, page_count in self._run_concurrently(get_page, starts):
+                count = page_count
+
+                if not pkg_dicts_page:
+                    exhausted = True
+                    break
+
+                # Weed out any datasets found on previous pages (should
+                # datasets be changing while we page)
+                for pkg_dict in pkg_dicts_page:
+                    if pkg_dict["id"] in pkg_ids:
+                        continue
+                    pkg_ids.add(pkg_dict["id"])
+                    pkg_dicts.append(pkg_dict)
+
+                # the count could be outdated, a short page is the last one
+                if len(pkg_dicts_page) < rows:
+                    exhausted = True
+                    break
+
+            if exhausted or (max_datasets and len(pkg_dicts) >= max_datasets):
+                break
+
+            start = starts[-1] + rows
+            window = self._get_concurrency()
+
         return pkg_dicts[:max_datasets] if max_datasets else pkg_dicts
 
+    def _search_for_datasets_by_keyset(
+        self, search_url: str, params: dict[str, Any], max_datasets: int
+    ) -> list[dict[str, Any]]:
+        """Pages through the remote catalog sorted by modification date and ID.
+        Instead of the offset, every next page is filtered to start right
+        after the last dataset of the previous page. Page cost doesn't grow
+        with the depth of the pagination and datasets, changed in process of
+        harvesting, are neither missed nor duplicated."""
+        params = dict(params, sort="metadata_modified asc, id asc")
+        fq = params.pop("fq", "")
+
+        pkg_dicts = []
+        pkg_ids = set()
+        last_pkg = None
+
+        while not self._is_gather_deadline_passed():
+            fq_terms = [fq] if fq else []
+            if last_pkg:
+                fq_terms.append(self._get_keyset_filter(last_pkg))
+
+            page_params = dict(params)
+            if fq_terms:
+                page_params["fq"] = " ".join(fq_terms)
+
+            pkg_dicts_page, _count = self._get_search_page(search_url, page_params, 0)
+
+            if not pkg_dicts_page:
+                break
+
+            for pkg_dict in pkg_dicts_page:
+                if pkg_dict["id"] in pkg_ids:
+                    continue
+                pkg_ids.add(pkg_dict["id"])
+                pkg_dicts.append(pkg_dict)
+
+            if max_datasets and len(pkg_dicts) >= max_datasets:
+                break
+
+            if len(pkg_dicts_page) < params["rows"]:
+                break
+
+            last_pkg = pkg_dicts_page[-1]
+
+        return pkg_dicts[:max_datasets] if max_datasets else pkg_dicts
+
+    def _get_keyset_filter(self, pkg_dict: dict[str, Any]) -> str:
+        """Builds Solr filter for datasets, that are following the given one
+        in `metadata_modified asc, id asc` order"""
+        modified = parser.parse(pkg_dict["metadata_modified"], ignoretz=True)
+        # Solr keeps dates with milliseconds precision
+        modified = modified.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(
+            modified.microsecond // 1000
+        )
+
+        return (
+            f"(metadata_modified:{{{modified} TO *] OR "
+            f"(metadata_modified:[{modified} TO {modified}] AND id:{{{pkg_dict['id']} TO *]))"
+        )
+
+    def _get_search_page(
+        self, search_url: str, params: dict[str, Any], start: int
+    ) -> tuple[list[dict[str, Any]], int]:
+        """Fetches a page of package_search results
+
+        Args:
+            search_url (str): remote package_search URL
+            params (dict[str, Any]): search params
+            start (int): page offset
+
+        Raises:
+            SearchError: if the page couldn't be fetched
+
+        Returns:
+            tuple[list[dict[str, Any]], int]: datasets and total number of them
+        """
+        url = search_url + "?" + urlencode(dict(params, start=start))
+        log.debug("Searching for CKAN datasets: %s", url)
+
+        # the pages are requested within the host limits, so the circuit
+        # breaker and the rate limiter learn from the remote responses
+        headers = {}
+        if api_key := self.config.get("api_key"):
+            headers["Authorization"] = api_key
+
+        content = self._make_page_request(url, headers=headers).content
+
+        try:
+            result = codec.loads(content)["result"]
+        except (ValueError, KeyError, TypeError):
+            raise SearchError(f"Response from remote CKAN was not valid: {content!r:.200}")
+
+        pkg_dicts = result.get("results", [])
+        # remote datasets of custom types are harvested as local `dataset`
+        for pkg_dict in pkg_dicts:
+            pkg_dict["type"] = "dataset"
+
+        return pkg_dicts, result.get("count", 0)
+
     def _search_datasets(self, remote_url: str):
         url = remote_url.rstrip("/") + "/api/action/package_search?rows=1"
         resp = self._make_request(url)
@@ -44,7 +261,7 @@ class CustomCKANHarvester(CKANHarvester, BasketBasicHarvester):
             return
 
         try:
-            package_dict = json.loads(resp.text)["result"]["results"]
+            package_dict = codec.loads(resp.content)["result"]["results"]
         except (ValueError, KeyError) as e:
             err_msg: str = f"{self.SRC_ID}: response JSON doesn't contain result: {e}"
             log.error(err_msg)
@@ -52,12 +269,6 @@ class CustomCKANHarvester(CKANHarvester, BasketBasicHarvester):
 
         return package_dict
 
-    def fetch_stage(self, harvest_object):
-        data_dict = json.loads(harvest_object.content)
-        data_dict["type"] = "dataset"
-        harvest_object.content = json.dumps(data_dict)
-        return super().fetch_stage(harvest_object)
-
     def _pre_map_stage(self, data_dict, source_url):
         data_dict["type initial"] = data_dict["type"]
         data_dict["type"] = "dataset"
@@ -1,21 +1,22 @@
 from __future__ import annotations
 
-import contextlib
+import itertools
 import logging
-import json
 import uuid
-from typing import Any, Iterable
+from functools import partial
+from typing import Any, Iterable, Optional
 
 from ckan.lib.munge import munge_name, munge_tag
 from ckan.logic import ValidationError
 import ckan.plugins.toolkit as tk
 
 from ckan import model
-from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.harvesters.ckanharvester import SearchError
 from ckanext.spatial import harvesters
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
+from ckanext.harvest_basket.throttle import CircuitOpenError
 
 
 log = logging.getLogger(__name__)
@@ -29,6 +30,10 @@ log = logging.getLogger(__name__)
 
 class CsiroHarvester(BasketBasicHarvester):
     SRC_ID = "CSIRO"
+    PAGE_SIZE = 100
+    PAGE_SIZE_BOUNDS = (20, 500)
+    PREFETCHED_KEY = "_prefetched"
+    TRUNCATED_KEY = "_files_truncated"
 
     def info(self):
         return {
@@ -39,78 +44,160 @@ class CsiroHarvester(BasketBasicHarvester):
 
     def gather_stage(self, harvest_job):
         source_url: str = harvest_job.source.url.strip("/")
-        self._set_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
         log.info(f"{self.SRC_ID}: gather stage started: {source_url}")
 
         object_ids = []
+        complete = True
         try:
-            for record in self._search_datasets(source_url):
+            records = self._search_datasets(source_url)
+
+            if self._get_concurrency() > 1:
+                records = self._prefetch_collections(source_url, records)
+
+            for record in records:
                 identifier = munge_name(
                     "_".join(
                         [record["id"]["identifierType"], record["id"]["identifier"]]
                     )
                 )
-                log.info(
+                log.debug(
                     "%s: Creating HARVEST object for %s",
                     self.SRC_ID,
                     identifier,
                 )
 
                 guid = uuid.uuid5(uuid.NAMESPACE_DNS, identifier)
-                obj = HarvestObject(
-                    guid=identifier, job=harvest_job, content=json.dumps(record)
-                )
-                obj.save()
-                object_ids.append(obj.id)
+                obj = self._make_harvest_object(identifier, harvest_job, record)
+                if obj:
+                    object_ids.append(obj.id)
 
         except SearchError:
+            complete = False
             log.exception("%s: search for datasets failed", self.SRC_ID)
             self._save_gather_error(
                 f"{self.SRC_ID}: unable to search the remote portal for datasets: {source_url}",
                 harvest_job,
             )
 
-        if not object_ids:
+        if not self._seen_guids:
             log.error("%s: search returns empty result.", self.SRC_ID)
             self._save_gather_error(
                 f"{self.SRC_ID}: no datasets found at ODS remote portal: {source_url}",
                 harvest_job,
             )
 
-        return object_ids
+        return self._finish_gather(harvest_job, object_ids, complete)
 
     def _search_datasets(self, url: str) -> Iterable[dict[str, Any]]:
-        next_url = url + "/collections.json?rpp=100"
-        while True:
-            if not (resp := self._make_request(next_url)):
-                break
-
-            data = resp.json()
+        next_url = url + f"/collections.json?rpp={self._get_page_size()}"
+        for data in self._paginate(next_url, self._get_next_url, self._page_sizer):
             yield from data["dataCollections"]
 
-            if next_info := data["next"]:
-                next_url = next_info["href"]
-            else:
-                break
+    def _get_next_url(self, data: dict[str, Any]) -> Optional[str]:
+        return (data.get("next") or {}).get("href")
+
+    def _prefetch_collections(
+        self, source_url: str, records: Iterable[dict[str, Any]]
+    ) -> Iterable[dict[str, Any]]:
+        """Fetches the collection metadata and file listings for a batch of
+        records concurrently. The fetched payload is attached to the record,
+        so the fetch stage doesn't need to make any requests. If prefetch
+        failed, the fetch stage will try it once again on its own."""
+        records = iter(records)
+        batch_size = self._get_concurrency() * 10
+        fetch = partial(self._prefetch_collection, source_url)
+
+        while batch := list(itertools.islice(records, batch_size)):
+            for record, metadata in zip(batch, self._run_concurrently(fetch, batch)):
+                if metadata:
+                    record[self.PREFETCHED_KEY] = metadata
+                yield record
+
+    def _prefetch_collection(
+        self, source_url: str, record: dict[str, Any]
+    ) -> Optional[dict[str, Any]]:
+        try:
+            return self._fetch_collection(source_url, record)
+        except (tk.ValidationError, ValueError, CircuitOpenError) as e:
+            log.warning("%s: prefetch failed: %s", self.SRC_ID, e)
+
+    def _fetch_collection(
+        self, source_url: str, record: dict[str, Any]
+    ) -> Optional[dict[str, Any]]:
+        url = f"{source_url}/collections/{record['id']['identifier']}.json"
+        log.debug("Fetch %s", url)
+
+        if not (resp := self._make_request(url)):
+            return None
+        metadata = codec.loads(resp.content)
+
+        if "data" in metadata and not self._is_manifest_mode():
+            files, truncated = self._fetch_files(metadata["data"] + ".json")
+            metadata["files"] = files
+            metadata[self.TRUNCATED_KEY] = truncated
+
+        return metadata
+
+    def _fetch_files(self, url: str) -> tuple[list[dict[str, Any]], bool]:
+        """Pages through the collection file listing lazily and stops as soon
+        as `max_resources` files are collected. If a page couldn't be fetched,
+        the files collected so far are returned as the truncated listing.
+
+        Args:
+            url (str): file listing URL
+
+        Returns:
+            tuple[list[dict[str, Any]], bool]: files and a flag, whether the
+                                               listing was truncated
+        """
+        max_resources = tk.asint(self.config.get("max_resources", 0))
+        files = []
+        next_url = url
+
+        try:
+            for data in self._paginate(url, self._get_next_url):
+                files.extend(data["file"])
+                next_url = self._get_next_url(data)
+
+                if max_resources and len(files) > max_resources:
+                    return files[:max_resources], True
+        except SearchError as e:
+            log.warning("%s: file listing %s is incomplete: %s", self.SRC_ID, url, e)
+            return files, True
+
+        # the pagination is interrupted before the last page, when the job
+        # deadline has passed
+        return files, next_url is not None
+
+    def _is_manifest_mode(self) -> bool:
+        return self.config.get("file_resources", "files") == "manifest"
 
     def fetch_stage(self, harvest_object):
+        if self._get_object_status(harvest_object) == "delete":
+            return True
+
         self._set_config(harvest_object.source.config)
         source_url = self._get_src_url(harvest_object)
-        package_dict = json.loads(harvest_object.content)
-        url = f"{source_url}/collections/{package_dict['id']['identifier']}.json"
-        log.debug("Fetch %s", url)
 
-        if not (resp := self._make_request(url)):
+        if not self._start_fetch(harvest_object):
             return False
-        metadata = resp.json()
+        package_dict = self._load_content(harvest_object.content)
+
+        metadata = package_dict.get(self.PREFETCHED_KEY)
+        if not metadata:
+            try:
+                metadata = self._fetch_collection(source_url, package_dict)
+            except CircuitOpenError as e:
+                self._save_object_error(
+                    f"{self.SRC_ID}: {e}", harvest_object, "Fetch"
+                )
+                return False
 
-        if "data" in metadata:
-            with contextlib.suppress(tk.ValidationError):
-                if resp := self._make_request(metadata["data"] + ".json"):
-                    data = resp.json()
-                    metadata["files"] = data["file"]
+        if not metadata:
+            return False
 
-        harvest_object.content = json.dumps(metadata)
+        harvest_object.content = self._dump_content(metadata)
         return True
 
     def import_stage(self, harvest_object):
@@ -122,9 +209,12 @@ class CsiroHarvester(BasketBasicHarvester):
 
         self._set_config(harvest_object.source.config)
 
+        if self._get_object_status(harvest_object) == "delete":
+            return self._delete_package(harvest_object)
+
         package_dict = {}
 
-        data = json.loads(harvest_object.content)
+        data = self._load_content(harvest_object.content)
 
         log.debug("Import %s", data["id"])
 
@@ -141,19 +231,53 @@ class CsiroHarvester(BasketBasicHarvester):
 
         package_dict["author"] = data.pop("leadResearcher")
 
-        package_dict["resources"] = [
+        package_dict["resources"] = self._get_resources(data)
+
+        package_dict["extras"] = [
+            {"key": key, "value": value} for key, value in data.items()
+        ]
+        return self._import_package_dict(package_dict, harvest_object)
+
+    def _get_resources(self, data: dict[str, Any]) -> list[dict[str, Any]]:
+        """Turns collection files into resources. If files weren't fetched
+        because of `file_resources: manifest` or the listing was truncated
+        by `max_resources`, the link to the full file listing is added as a
+        separate manifest resource."""
+        truncated = data.pop(self.TRUNCATED_KEY, False)
+
+        resources = [
             {
                 "name": item["filename"],
                 "size": item["fileSize"],
                 "url": item["link"]["href"],
                 "format": item["link"]["mediaType"],
-                "extras": [{"key": k, "value": v} for k, v in item.items()],
+                "extras": self._get_file_extras(item),
             }
             for item in data.pop("files", [])
         ]
 
-        package_dict["extras"] = [
-            {"key": key, "value": value} for key, value in data.items()
-        ]
-        harvest_object.content = json.dumps(package_dict)
-        super().import_stage(harvest_object)
+        if data.get("data") and (truncated or self._is_manifest_mode()):
+            resources.append(
+                {
+                    "name": tk._("File listing"),
+                    "url": data["data"] + ".json",
+                    "format": "JSON",
+                }
+            )
+
+        return resources
+
+    def _get_file_extras(self, item: dict[str, Any]) -> list[dict[str, Any]]:
+        """Collects resource extras from the file dict. The `file_extras`
+        option allows to keep all the fields (default), drop them or keep
+        only the listed ones."""
+        file_extras = self.config.get("file_extras", True)
+
+        if isinstance(file_extras, list):
+            keys = set(file_extras)
+        elif tk.asbool(file_extras):
+            keys = set(item)
+        else:
+            return []
+
+        return [{"key": k, "value": v} for k, v in item.items() if k in keys]
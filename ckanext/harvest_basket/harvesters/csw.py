@@ -1,10 +1,21 @@
 from __future__ import annotations
 
 import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dateutil import parser
 from lxml import etree
+from owslib.fes import PropertyIsGreaterThanOrEqualTo, SortBy, SortProperty
+
+import ckan.plugins.toolkit as tk
+from ckan import model
+
+from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
 from ckanext.spatial.harvesters import CSWHarvester
 from ckanext.spatial.lib.csw_client import CswService, CswError, PropertyIsEqualTo
 from ckanext.transmute.utils import get_schema
+from ckanext.harvest_basket.utils import get_source_state, set_source_state
 from .base_harvester import BasketBasicHarvester
 
 from requests import utils as request_utils
@@ -92,6 +103,145 @@ ows_util.http_post.__code__ = http_post.__code__
 
 class BasketCswHarvester(CSWHarvester, BasketBasicHarvester):
     SRC_ID = "CSW"
+    FULL_HARVEST_STATE = "csw_last_full_harvest"
+
+    def gather_stage(self, harvest_job):
+        self._set_source_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
+
+        if self._is_catalog_unchanged(harvest_job, harvest_job.source.url):
+            return []
+
+        modified_since = self._get_modified_since(harvest_job)
+
+        if not modified_since:
+            started = datetime.utcnow()
+            ids = super().gather_stage(harvest_job)
+
+            if ids is not None:
+                set_source_state(
+                    harvest_job.source.id, self.FULL_HARVEST_STATE, started.isoformat()
+                )
+        else:
+            ids = self._gather_modified(harvest_job, modified_since)
+
+        if ids is not None:
+            self._save_catalog_fingerprint(harvest_job)
+            self._track_progress(harvest_job.id, "gathered", len(ids))
+        return ids
+
+    def fetch_stage(self, harvest_object):
+        self._set_config(harvest_object.source.config)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        return super().fetch_stage(harvest_object)
+
+    def _get_catalog_fingerprint(self, source_url):
+        self._setup_csw_client(source_url)
+        return self.csw.getfingerprint(
+            outputschema=self.output_schema(), cql=self.source_config.get("cql")
+        )
+
+    def _get_modified_since(self, harvest_job) -> Optional[datetime]:
+        """Decides if the job could harvest only records modified since the
+        last successful job. Falls back to a full sweep, if the incremental
+        mode is disabled or if the last full sweep is older than
+        `full_harvest_interval` days, to catch the deleted records.
+
+        Returns:
+            Optional[datetime]: the lower bound of records modification date
+                                or None for a full sweep
+        """
+        if not tk.asbool(self.source_config.get("incremental", False)):
+            return None
+
+        last_job = self.last_error_free_job(harvest_job)
+        if not last_job:
+            return None
+
+        last_full_harvest = get_source_state(
+            harvest_job.source.id, self.FULL_HARVEST_STATE
+        )
+        if not last_full_harvest:
+            return None
+
+        interval = timedelta(
+            days=tk.asint(self.source_config.get("full_harvest_interval", 7))
+        )
+        if parser.parse(last_full_harvest) + interval <= datetime.utcnow():
+            log.info("%s: full harvest interval has passed, full sweep", self.SRC_ID)
+            return None
+
+        return last_job.gather_started
+
+    def _gather_modified(self, harvest_job, modified_since: datetime):
+        """Gathers only records modified since the given date. Unlike the full
+        sweep, it doesn't create objects for deletion, because the absense of
+        the record in the delta doesn't mean it was removed."""
+        url = harvest_job.source.url
+
+        try:
+            self._setup_csw_client(url)
+        except Exception as e:
+            self._save_gather_error(f"Error contacting the CSW server: {e}", harvest_job)
+            return None
+
+        query = (
+            model.Session.query(HarvestObject.guid, HarvestObject.package_id)
+            .filter(HarvestObject.current == True)
+            .filter(HarvestObject.harvest_source_id == harvest_job.source.id)
+        )
+        guid_to_package_id = dict(query)
+
+        log.info(
+            "%s: incremental gathering for %s, records modified since %s",
+            self.SRC_ID,
+            url,
+            modified_since,
+        )
+
+        guids_in_harvest = set()
+        try:
+            for identifier in self.csw.getidentifiers(
+                page=10,
+                outputschema=self.output_schema(),
+                cql=self.source_config.get("cql"),
+                modified_since=modified_since,
+            ):
+                if identifier is None:
+                    log.error("CSW returned identifier %r, skipping...", identifier)
+                    continue
+
+                guids_in_harvest.add(identifier)
+        except Exception as e:
+            log.exception("%s: incremental gathering failed", self.SRC_ID)
+            self._save_gather_error(
+                f"Error gathering the identifiers from the CSW server [{e}]",
+                harvest_job,
+            )
+            return None
+
+        ids = []
+        for guid in guids_in_harvest:
+            status = "change" if guid in guid_to_package_id else "new"
+            obj = HarvestObject(
+                guid=guid,
+                job=harvest_job,
+                package_id=guid_to_package_id.get(guid),
+                extras=[HarvestObjectExtra(key="status", value=status)],
+            )
+            obj.save()
+            ids.append(obj.id)
+
+        log.info("%s: %s modified record(s) found", self.SRC_ID, len(ids))
+        return ids
+
+    def import_stage(self, harvest_object):
+        result = super().import_stage(harvest_object)
+        if result:
+            self._track_progress(harvest_object.harvest_job_id, "imported")
+        return result
 
     def get_package_dict(self, iso_values, harvest_object):
         package_dict = super().get_package_dict(iso_values, harvest_object)
@@ -114,6 +264,42 @@ class BasketCswHarvester(CSWHarvester, BasketBasicHarvester):
 
 
 class BasketCswService(CswService):
+    def getfingerprint(
+        self, qtype=None, typenames="csw:Record", outputschema="gmd", cql=None, **kw
+    ):
+        """Returns the number of records along with the identifier and the
+        modification date of the most recently modified one"""
+        from owslib.catalogue.csw2 import namespaces
+
+        csw = self._ows(**kw)
+        constraints = []
+
+        if qtype is not None:
+            constraints.append(PropertyIsEqualTo("dc:type", qtype))
+
+        csw.getrecords2(
+            constraints=constraints,
+            typenames=typenames,
+            esn="brief",
+            maxrecords=1,
+            outputschema=namespaces[outputschema],
+            cql=cql,
+            sortby=SortBy([SortProperty("apiso:Modified", "DESC")]),
+        )
+        if csw.exceptionreport:
+            raise CswError(
+                "Error getting fingerprint: %r" % csw.exceptionreport.exceptions
+            )
+
+        if not csw.records:
+            return None
+
+        identifier, record = next(iter(csw.records.items()))
+        modified = getattr(record, "datestamp", None) or getattr(
+            record, "modified", None
+        )
+        return f"{csw.results['matches']}:{identifier}:{modified}"
+
     def getidentifiers(
         self,
         qtype=None,
@@ -125,6 +311,7 @@ class BasketCswService(CswService):
         outputschema="gmd",
         startposition=0,
         cql=None,
+        modified_since=None,
         **kw,
     ):
         from owslib.catalogue.csw2 import namespaces
@@ -135,6 +322,21 @@ class BasketCswService(CswService):
         if qtype is not None:
             constraints.append(PropertyIsEqualTo("dc:type", qtype))
 
+        if modified_since is not None:
+            modified = modified_since.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+            # CQL is ignored by OWSLib when there are other constraints
+            if cql and not constraints:
+                cql = f"({cql}) AND Modified >= '{modified}'"
+            else:
+                constraints.append(
+                    PropertyIsGreaterThanOrEqualTo("apiso:Modified", modified)
+                )
+
+        # a nested list is interpreted by OWSLib as AND of its items
+        if len(constraints) > 1:
+            constraints = [constraints]
+
         kwa = {
             "constraints": constraints,
             "typenames": typenames,
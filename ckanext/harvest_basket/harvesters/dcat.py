@@ -1,12 +1,46 @@
 from __future__ import annotations
 
-import json
+import logging
+from hashlib import sha1
+from typing import IO
+
+import requests
+
+import ckan.plugins.toolkit as tk
 
 from ckanext.dcat.harvesters import DCATJSONHarvester
 from ckanext.transmute.utils import get_schema
+from ckanext.harvest_basket.utils import (
+    is_streaming_available,
+    iter_json_items,
+    open_json_stream,
+)
+from ckanext.harvest_basket import codec
+from ckanext.harvest_basket.throttle import CircuitOpenError
 from .base_harvester import BasketBasicHarvester
 
 
+log = logging.getLogger(__name__)
+
+
+class CatalogStream:
+    """A streamed `data.json` response. It's passed through the DCAT gather
+    stage instead of the content string, so the catalog is never loaded into
+    memory as a whole."""
+
+    def __init__(self, resp: requests.Response):
+        self.resp = resp
+        self.stream: IO[bytes] = open_json_stream(resp)
+
+    def get_datasets_prefix(self) -> str:
+        # catalog could be either a list of datasets or a DCAT catalog object
+        head = self.stream.peek(1024).lstrip()
+        return "item" if head.startswith(b"[") else "dataset.item"
+
+    def close(self):
+        self.resp.close()
+
+
 class BasketDcatJsonHarvester(DCATJSONHarvester, BasketBasicHarvester):
     SRC_ID = "DCAT"
 
@@ -18,11 +52,122 @@ class BasketDcatJsonHarvester(DCATJSONHarvester, BasketBasicHarvester):
             + "for DCAT dataset descriptions serialized as JSON",
         }
 
+    def gather_stage(self, harvest_job):
+        self._start_gather(harvest_job)
+
+        if self._is_catalog_unchanged(harvest_job, harvest_job.source.url):
+            return []
+
+        object_ids = super().gather_stage(harvest_job)
+
+        if object_ids is not None:
+            self._save_catalog_fingerprint(harvest_job)
+            self._track_progress(harvest_job.id, "gathered", len(object_ids))
+        return object_ids
+
+    def fetch_stage(self, harvest_object):
+        self._set_config(harvest_object.source.config)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        return super().fetch_stage(harvest_object)
+
+    def _get_catalog_fingerprint(self, source_url):
+        # the validators of the first page are enough, the paginated catalogs
+        # are rare and they usually change the first page as well
+        resp = self._make_request(source_url, method="HEAD")
+        if resp is None:
+            return None
+
+        validator = resp.headers.get("etag") or resp.headers.get("last-modified")
+        if not validator:
+            return None
+
+        return f"{validator}:{resp.headers.get('content-length')}"
+
+    def _is_stream_enabled(self) -> bool:
+        if not tk.asbool(self.config.get("stream_catalog", False)):
+            return False
+
+        if not is_streaming_available():
+            log.warning(
+                "%s: `stream_catalog` requires `ijson` package. "
+                "Loading the whole catalog into memory",
+                self.SRC_ID,
+            )
+            return False
+
+        return True
+
+    def _get_content_and_type(self, url, harvest_job, page=1, content_type=None):
+        if not url.lower().startswith("http") or not self._is_stream_enabled():
+            return super()._get_content_and_type(url, harvest_job, page, content_type)
+
+        if page > 1:
+            url = url + "&" if "?" in url else url + "?"
+            url = url + f"page={page}"
+
+        log.debug("%s: streaming the catalog %s", self.SRC_ID, url)
+
+        try:
+            resp = self._make_request(url, stream=True, raise_for_status=True)
+        except requests.exceptions.HTTPError as e:
+            if page > 1 and e.response.status_code == 404:
+                # the gather stage treats it as the end of pagination
+                raise
+
+            self._save_gather_error(
+                f"Could not get content from {url}. Server responded with "
+                f"{e.response.status_code} {e.response.reason}",
+                harvest_job,
+            )
+            return None, None
+        except CircuitOpenError as e:
+            self._save_gather_error(
+                f"Could not get content from {url}: {e}", harvest_job
+            )
+            return None, None
+
+        if resp is None:
+            self._save_gather_error(f"Could not get content from {url}", harvest_job)
+            return None, None
+
+        if content_type is None and resp.headers.get("content-type"):
+            content_type = resp.headers["content-type"].split(";", 1)[0]
+
+        return CatalogStream(resp), content_type
+
+    def _get_guids_and_datasets(self, content):
+        if not isinstance(content, CatalogStream):
+            yield from super()._get_guids_and_datasets(content)
+            return
+
+        try:
+            prefix = content.get_datasets_prefix()
+
+            for dataset in iter_json_items(content.stream, prefix):
+                as_string = codec.dumps(dataset)
+
+                guid = dataset.get("identifier")
+                if not guid:
+                    guid = sha1(as_string.encode("utf8")).hexdigest()
+
+                yield guid, as_string
+        finally:
+            content.close()
+
+    def import_stage(self, harvest_object):
+        result = super().import_stage(harvest_object)
+        if result:
+            self._track_progress(harvest_object.harvest_job_id, "imported")
+        return result
+
     def modify_package_dict(self, package_dict, dcat_dict, harvest_object):
         self.base_context = {"user": self._get_user_name()}
-
-        package_dict = json.loads(harvest_object.content)
         self._set_config(harvest_object.source.config)
 
-        self._transmute_content(package_dict)
-        return package_dict
+        # transmute schemas are written for the original DCAT dataset. It's
+        # already parsed by the import stage, so we are transmuting it in place
+        # instead of parsing the object content once again
+        self._transmute_content(dcat_dict)
+        return dcat_dict
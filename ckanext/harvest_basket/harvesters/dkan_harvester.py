@@ -1,16 +1,16 @@
 import logging
-import requests
-import json
 from urllib import parse
 from urllib.parse import urljoin
 from time import sleep
 
 from ckan.lib.munge import munge_tag
+from ckan.plugins import toolkit as tk
 
-from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.harvesters.ckanharvester import ContentFetchError, SearchError
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
+from ckanext.harvest_basket.throttle import CircuitOpenError
 
 
 log = logging.getLogger(__name__)
@@ -32,7 +32,7 @@ class DKANHarvester(BasketBasicHarvester):
         source_url = harvest_job.source.url.strip("/")
         log.info(f"{self.SRC_ID}: Starting gather_stage {source_url}")
 
-        self._set_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
         log.info(f"{self.SRC_ID}: Using config: {self.config}")
 
         try:
@@ -45,6 +45,13 @@ class DKANHarvester(BasketBasicHarvester):
             )
             return []
 
+        if self._gather_stats["failed"]:
+            self._save_gather_error(
+                f"{self.SRC_ID}: {self._gather_stats['failed']} datasets could not "
+                f"be fetched from remote portal: {source_url}",
+                harvest_job,
+            )
+
         if not pkg_dicts:
             self._save_gather_error(
                 f"{self.SRC_ID}: No datasets found at remote portal: {source_url}",
@@ -66,16 +73,14 @@ class DKANHarvester(BasketBasicHarvester):
 
             package_ids.add(pkg_dict["id"])
 
-            log.info(
+            log.debug(
                 f"{self.SRC_ID}: Creating harvest_object for {pkg_dict.get('name', '')} {pkg_dict['id']}"
             )
 
             try:
-                obj = HarvestObject(
-                    guid=pkg_dict["id"], job=harvest_job, content=json.dumps(pkg_dict)
-                )
-                obj.save()
-                object_ids.append(obj.id)
+                obj = self._make_harvest_object(pkg_dict["id"], harvest_job, pkg_dict)
+                if obj:
+                    object_ids.append(obj.id)
             except TypeError as e:
                 log.debug(
                     f"{self.SRC_ID}: The error occured during the gather stage: {str(e)}"
@@ -83,7 +88,13 @@ class DKANHarvester(BasketBasicHarvester):
                 self._save_gather_error(str(e), harvest_job)
                 continue
 
-        return object_ids
+        # the datasets, that failed to be fetched, are not deleted
+        return self._finish_gather(
+            harvest_job, object_ids, complete=not self._gather_stats["failed"]
+        )
+
+    def _get_remote_modified(self, pkg_dict):
+        return self._parse_remote_modified(pkg_dict.get("metadata_modified"))
 
     def _search_datasets(self, remote_url):
         self.url = urljoin(remote_url, self.PACKAGE_LIST)
@@ -95,7 +106,7 @@ class DKANHarvester(BasketBasicHarvester):
             raise SearchError(e)
 
         try:
-            package_names = json.loads(package_names)["result"]
+            package_names = codec.loads(package_names)["result"]
         except ValueError as e:
             raise SearchError(
                 f"{self.SRC_ID}: response from remote portal was not a JSON: {e}"
@@ -105,18 +116,33 @@ class DKANHarvester(BasketBasicHarvester):
         delay = int(self.config.get("delay", 0))
 
         for package_name in set(package_names):
+            if self._is_gather_deadline_passed():
+                break
+
             url = f"{remote_url}{self.PACKAGE_SHOW}?{parse.urlencode({'id': package_name})}"
             log.debug(f"{self.SRC_ID}: Searching for dataset: {url}")
 
-            resp = self._make_request(url)
+            try:
+                resp = self._make_request(url)
+            except tk.ValidationError as e:
+                log.error(f"{self.SRC_ID}: Failed to fetch dataset {package_name}: {e}")
+                self._gather_stats["failed"] += 1
+                continue
+            except CircuitOpenError as e:
+                # the rest of requests would fail instantly as well
+                log.error(f"{self.SRC_ID}: Stop searching for datasets: {e}")
+                self._gather_stats["failed"] += 1
+                break
 
             if not resp:
+                self._gather_stats["failed"] += 1
                 continue
 
             try:
-                package_dict_page = json.loads(resp.text)["result"]
-            except ValueError as e:
+                package_dict_page = codec.loads(resp.content)["result"]
+            except (ValueError, KeyError, TypeError) as e:
                 log.error(f"{self.SRC_ID}: Response JSON doesn't contain result: {e}")
+                self._gather_stats["failed"] += 1
                 continue
 
             # some portals return a dict as result, not a list
@@ -139,22 +165,28 @@ class DKANHarvester(BasketBasicHarvester):
         return pkg_dicts
 
     def _get_package_names(self, url):
-        resp = requests.get(url)
+        try:
+            resp = self._make_request(url)
+        except (tk.ValidationError, CircuitOpenError) as e:
+            raise ContentFetchError(e)
 
-        if resp.status_code == 200:
-            return resp.text
+        if not resp:
+            raise ContentFetchError(f"Could not get the package list from {url}")
 
-        log.error("Bad response from remote portal")
-        raise ContentFetchError(
-            f"Request status_code: {resp.status_code}, reason: {resp.reason}"
-        )
+        return resp.text
 
     def fetch_stage(self, harvest_object):
+        if self._get_object_status(harvest_object) == "delete":
+            return True
+
         self.source_url = harvest_object.source.url.strip("/")
         self._set_config(harvest_object.source.config)
-        package_dict = json.loads(harvest_object.content)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        package_dict = self._load_content(harvest_object.content)
         self._pre_map_stage(package_dict, self.source_url)
-        harvest_object.content = json.dumps(package_dict)
+        harvest_object.content = self._dump_content(package_dict)
         return True
 
     def _pre_map_stage(self, content: dict, source_url: str):
@@ -1,12 +1,14 @@
+from __future__ import annotations
+
 import logging
-import json
+from typing import Optional
 from urllib.parse import urljoin
 
 from ckan.lib.munge import munge_name
 
-from ckanext.harvest.model import HarvestObject
 from ckanext.harvest.harvesters.ckanharvester import SearchError
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
 
 
@@ -15,6 +17,8 @@ log = logging.getLogger(__name__)
 
 class JunarHarvester(BasketBasicHarvester):
     SRC_ID = "Junar"
+    PAGE_SIZE = 100
+    PAGE_SIZE_BOUNDS = (20, 500)
 
     def info(self):
         return {
@@ -32,7 +36,7 @@ class JunarHarvester(BasketBasicHarvester):
 
         log.info(f"{self.SRC_ID}: gather stage in progress: {source_url}")
 
-        self._set_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
 
         try:
             pkg_dicts = self._search_datasets(source_url)
@@ -56,23 +60,24 @@ class JunarHarvester(BasketBasicHarvester):
             object_ids = []
 
             for pkg_dict in pkg_dicts:
-                log.info(
+                log.debug(
                     f"{self.SRC_ID}: Creating HARVEST object "
                     f"for {pkg_dict['title']} | guid: {pkg_dict['guid']}"
                 )
 
-                obj = HarvestObject(
-                    guid=pkg_dict["guid"], job=harvest_job, content=json.dumps(pkg_dict)
-                )
-                obj.save()
-                object_ids.append(obj.id)
+                obj = self._make_harvest_object(pkg_dict["guid"], harvest_job, pkg_dict)
+                if obj:
+                    object_ids.append(obj.id)
 
-            return object_ids
+            return self._finish_gather(harvest_job, object_ids, complete=True)
         except Exception as e:
             log.debug(f"{self.SRC_ID}: The error occured during the gather stage: {e}")
             self._save_gather_error(str(e), harvest_job)
             return []
 
+    def _get_remote_modified(self, pkg_dict):
+        return self._parse_remote_modified(pkg_dict.get("modified_at"))
+
     def _search_datasets(self, source_url):
         auth_key = self.config.get("auth_key")
 
@@ -82,58 +87,103 @@ class JunarHarvester(BasketBasicHarvester):
                 "Please, provide it via the config"
             )
 
-        pkg_dicts = []
-        offset = 0
         max_datasets = int(self.config.get("max_datasets", 0))
-        limit = max_datasets or 100 if max_datasets <= 100 else 100
+        limit = self._get_page_size()
+        if max_datasets:
+            limit = min(max_datasets, limit)
         self.url = urljoin(
             source_url, f"/api/v2/datastreams/?auth_key={auth_key}&limit={limit}"
         )
 
+        pkg_dicts = []
+        package_ids = set()
+        total = None
+        offset = 0
+        # the first page is fetched alone to discover the total number
+        # of datasets, the next ones - by windows of `concurrency` pages
+        window = 1
+
         while True:
-            log.info(f"{self.SRC_ID}: gathering remote dataset: {self.url}")
+            offsets = [
+                page_offset
+                for page_offset in range(offset, offset + window * limit, limit)
+                if (total is None or page_offset < total)
+                and (not max_datasets or page_offset < max_datasets)
+            ]
+            if not offsets:
+                break
 
-            resp = self._make_request(f"{self.url}&offset={offset}")
+            exhausted = False
+            pages = self._run_concurrently(self._get_datastreams_page, offsets)
 
-            if resp:
-                try:
-                    pkgs_data = resp.json()
-                except ValueError as e:
-                    raise SearchError(
-                        f"{self.SRC_ID}: invalid response type, not a JSON"
-                    )
-            else:
-                raise SearchError(f"{self.SRC_ID}: error accessing remote portal")
+            for package_list, count in pages:
+                if count is not None:
+                    total = count
 
-            package_ids = set()
+                if not package_list:
+                    exhausted = True
+                    break
 
-            package_list = (
-                pkgs_data.get("results") if isinstance(pkgs_data, dict) else pkgs_data
-            )
-            if not package_list:
+                for pkg in package_list:
+                    if pkg["guid"] in package_ids:
+                        log.debug(
+                            f"{self.SRC_ID}: discarding duplicate dataset {pkg['guid']}."
+                        )
+                        continue
+                    package_ids.add(pkg["guid"])
+                    pkg_dicts.append(pkg)
+
+            if exhausted or (max_datasets and len(pkg_dicts) >= max_datasets):
                 break
 
-            for pkg in package_list:
-                if pkg["guid"] in package_ids:
-                    log.debug(
-                        f"{self.SRC_ID}: discarding duplicate dataset {pkg['guid']}."
-                    )
-                    continue
-                package_ids.add(pkg["guid"])
-                pkg_dicts.append(pkg)
-
-            offset += 100
-            if max_datasets and len(pkg_dicts) >= max_datasets:
+            offset = offsets[-1] + limit
+            window = self._get_concurrency()
+
+            if self._is_gather_deadline_passed():
                 break
 
-        return pkg_dicts
+        return pkg_dicts[:max_datasets] if max_datasets else pkg_dicts
+
+    def _get_datastreams_page(self, offset: int) -> tuple[list[dict], Optional[int]]:
+        """Fetches a page of datastreams
+
+        Args:
+            offset (int): page offset
+
+        Raises:
+            SearchError: if the page couldn't be fetched
+
+        Returns:
+            tuple[list[dict], Optional[int]]: datastreams and total number of
+                                              them, if portal reports it
+        """
+        url = f"{self.url}&offset={offset}"
+        log.info(f"{self.SRC_ID}: gathering remote dataset: {url}")
+
+        resp = self._make_page_request(url, self._page_sizer)
+
+        try:
+            pkgs_data = codec.loads(resp.content)
+        except ValueError:
+            raise SearchError(f"{self.SRC_ID}: invalid response type, not a JSON")
+
+        if isinstance(pkgs_data, dict):
+            return pkgs_data.get("results") or [], pkgs_data.get("count")
+
+        return pkgs_data or [], None
 
     def fetch_stage(self, harvest_object):
+        if self._get_object_status(harvest_object) == "delete":
+            return True
+
         self._set_config(harvest_object.source.config)
         source_url = self._get_src_url(harvest_object)
-        package_dict = json.loads(harvest_object.content)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        package_dict = self._load_content(harvest_object.content)
         self._pre_map_stage(package_dict, source_url)
-        harvest_object.content = json.dumps(package_dict)
+        harvest_object.content = self._dump_content(package_dict)
         return True
 
     def _pre_map_stage(self, package_dict: dict, source_url: str):
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
+import itertools
 import mimetypes
 import logging
-import json
-from typing import Any
+from typing import Any, Iterator, Optional
 from urllib.parse import urljoin, urlencode
 
 import ckan.plugins.toolkit as tk
 from ckan.lib.navl.validators import unicode_safe
 
-from ckanext.harvest.model import HarvestObject
-from ckanext.harvest.harvesters.ckanharvester import SearchError
+from ckanext.harvest.harvesters.ckanharvester import ContentFetchError, SearchError
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
+from ckanext.harvest_basket.throttle import CircuitOpenError
+from ckanext.harvest_basket.utils import (
+    is_streaming_available,
+    iter_json_items,
+    open_json_stream,
+)
 
 
 log = logging.getLogger(__name__)
@@ -20,6 +26,14 @@ log = logging.getLogger(__name__)
 
 class ODSHarvester(BasketBasicHarvester):
     SRC_ID = "ODS"
+    EXPORT_LINKS_KEY = "_export_links"
+    GATHER_BATCH_SIZE = 500
+    # everything `_pre_map_stage` reads, the rest is dropped anyway
+    DEFAULT_FIELDS = ("dataset_id", "metas", "attachments")
+    PRUNE_FIELDS = ("dataset.fields",)
+    # the catalog search returns at most 100 datasets per page
+    PAGE_SIZE_BOUNDS = (10, 100)
+    MODIFIED_FIELDS = ("modified", "data_processed", "metadata_processed")
 
     def info(self):
         return {
@@ -30,108 +44,272 @@ class ODSHarvester(BasketBasicHarvester):
 
     def gather_stage(self, harvest_job):
         source_url = harvest_job.source.url.strip("/")
-        self._set_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
         log.info(f"{self.SRC_ID}: gather stage started: {source_url}")
 
+        if self._is_catalog_unchanged(harvest_job, source_url):
+            return []
+
+        pkg_dicts = self._iter_datasets(source_url)
+
         try:
-            pkg_dicts = self._search_datasets(source_url)
+            package_ids = set()
+            object_ids = []
+
+            # datasets are processed in batches, so the streamed catalog
+            # export is never kept in memory as a whole
+            while batch := list(itertools.islice(pkg_dicts, self.GATHER_BATCH_SIZE)):
+                unique_pkg_dicts = []
+
+                for pkg_dict in batch:
+                    pkg_id = unicode_safe(pkg_dict["dataset"]["dataset_id"])
+                    if pkg_id in package_ids:
+                        log.debug(
+                            f"{self.SRC_ID}: Discarding duplicate dataset {pkg_id}. "
+                            "Probably, due to datasets being changed in process of harvesting"
+                        )
+                        continue
+
+                    package_ids.add(pkg_id)
+                    unique_pkg_dicts.append(pkg_dict)
+
+                self._prefetch_export_links(source_url, unique_pkg_dicts)
+
+                for pkg_dict in unique_pkg_dicts:
+                    pkg_id = unicode_safe(pkg_dict["dataset"]["dataset_id"])
+                    pkg_name: str = pkg_dict["dataset"]["metas"]["default"]["title"]
+                    log.debug(
+                        f"{self.SRC_ID}: Creating HARVEST object for {pkg_name} | id: {pkg_id}"
+                    )
+
+                    obj = self._make_harvest_object(pkg_id, harvest_job, pkg_dict)
+                    if obj:
+                        object_ids.append(obj.id)
         except SearchError as e:
             log.error(f"{self.SRC_ID}: search for datasets failed: {e}")
             self._save_gather_error(
                 f"{self.SRC_ID}: unable to search the remote portal for datasets: {source_url}",
                 harvest_job,
             )
-            return []
+            # objects of the previous batches are already saved, they must
+            # be queued, otherwise the job is never finished
+            return self._finish_gather(harvest_job, object_ids, complete=False)
+        except Exception as e:
+            log.debug("The error occured during the gather stage: {}".format(e))
+            self._save_gather_error(str(e), harvest_job)
+            return self._finish_gather(harvest_job, object_ids, complete=False)
 
-        if not pkg_dicts:
+        if not self._seen_guids:
             log.error(f"{self.SRC_ID}: search returns empty result.")
             self._save_gather_error(
                 f"{self.SRC_ID}: no datasets found at ODS remote portal: {source_url}",
                 harvest_job,
             )
-            return []
-
-        try:
-            package_ids = set()
-            object_ids = []
 
-            for pkg_dict in pkg_dicts:
-                pkg_id = unicode_safe(pkg_dict["dataset"]["dataset_id"])
-                if pkg_id in package_ids:
-                    log.debug(
-                        f"{self.SRC_ID}: Discarding duplicate dataset {pkg_id}. ",
-                        "Probably, due to datasets being changed in process of harvesting",
-                    )
-                    continue
+        # an empty export is more likely a broken portal, than a removal of
+        # all its datasets
+        return self._finish_gather(
+            harvest_job, object_ids, complete=bool(self._seen_guids)
+        )
 
-                package_ids.add(pkg_id)
-                pkg_name: str = pkg_dict["dataset"]["metas"]["default"]["title"]
-                log.info(
-                    f"{self.SRC_ID}: Creating HARVEST object for {pkg_name} | id: {pkg_id}"
-                )
+    def _get_remote_modified(self, pkg_dict):
+        metas = pkg_dict["dataset"]["metas"]["default"]
+        dates = [
+            self._parse_remote_modified(metas.get(field))
+            for field in self.MODIFIED_FIELDS
+        ]
+        return max(filter(None, dates), default=None)
+
+    def _get_catalog_fingerprint(self, source_url):
+        # the latest date of each of the modification fields in one
+        # aggregation, because the data could be reprocessed without
+        # changing the metadata
+        url = urljoin(source_url, "/api/v2/catalog/aggregates")
+        aggregates = ["count(*) as count"] + [
+            f"max({field}) as {field}" for field in self.MODIFIED_FIELDS
+        ]
+        params = dict(self._get_catalog_params(), select=",".join(aggregates))
+        data = codec.loads(
+            self._make_page_request(f"{url}?{urlencode(params)}").content
+        )
 
-                obj = HarvestObject(
-                    guid=pkg_id, job=harvest_job, content=json.dumps(pkg_dict)
-                )
-                obj.save()
-                object_ids.append(obj.id)
+        aggregation = (data.get("aggregations") or [{}])[0]
+        if not aggregation.get("count"):
+            return None
 
-            return object_ids
-        except Exception as e:
-            log.debug("The error occured during the gather stage: {}".format(e))
-            self._save_gather_error(str(e), harvest_job)
-            return []
+        return ":".join(
+            str(aggregation.get(field))
+            for field in ("count",) + self.MODIFIED_FIELDS
+        )
 
     def _search_datasets(self, source_url):
         """
         gathering ODS datasets
         returns a list with dicts of datasets metadata
         """
+        return list(self._iter_datasets(source_url))
 
-        pkg_dicts = []
-
+    def _iter_datasets(self, source_url: str) -> Iterator[dict[str, Any]]:
+        """Yields ODS datasets either from the whole catalog export or
+        page by page from the catalog search API"""
         max_datasets = tk.asint(self.config.get("max_datasets", 0))
 
-        params = {"rows": 50, "include_app_metas": True}
+        if self._is_catalog_export_enabled():
+            pkg_dicts = self._export_catalog(source_url)
+        else:
+            pkg_dicts = self._page_catalog(source_url)
+
+        return itertools.islice(pkg_dicts, max_datasets or None)
+
+    def _is_catalog_export_enabled(self) -> bool:
+        if not tk.asbool(self.config.get("catalog_export", False)):
+            return False
+
+        if not is_streaming_available():
+            log.warning(
+                "%s: `catalog_export` requires `ijson` package. "
+                "Using the paged catalog search",
+                self.SRC_ID,
+            )
+            return False
+
+        return True
+
+    def _get_catalog_params(self) -> dict[str, Any]:
+        params: dict[str, Any] = {
+            "include_app_metas": tk.asbool(
+                self.config.get("include_app_metas", False)
+            )
+        }
 
         where = self.config.get("where")
 
         if where:
             params["where"] = where
 
-        if 1 <= max_datasets <= 100:
-            params["rows"] = max_datasets
+        if fields := self._get_fields("dataset_id", "metas"):
+            params["select"] = ",".join(fields)
+
+        return params
+
+    def _export_catalog(self, source_url: str) -> Iterator[dict[str, Any]]:
+        """Streams the whole catalog metadata in one response and parses it
+        incrementally. If the export is not available, falls back to the paged
+        catalog search. The datasets that were already exported are skipped
+        in this case, so they don't count towards `max_datasets` twice."""
+        max_datasets = tk.asint(self.config.get("max_datasets", 0))
 
+        params = self._get_catalog_params()
+        if max_datasets:
+            params["limit"] = max_datasets
+
+        url = urljoin(source_url, "/api/v2/catalog/exports/json")
+        url = url + "?" + urlencode(params)
         search_url = urljoin(source_url, "/api/v2/catalog/datasets")
-        url = search_url + "?" + urlencode(params)
 
-        while True:
-            log.info(f"{self.SRC_ID}: gathering ODS remote dataset: {url}")
+        log.info(f"{self.SRC_ID}: exporting ODS remote catalog: {url}")
 
-            resp = self._make_request(url)
-            if not resp:
-                continue
+        exported = set()
+        try:
+            resp = self._make_request(url, stream=True)
+        except tk.ValidationError as e:
+            log.error(f"{self.SRC_ID}: catalog export is not available: {e}")
+            resp = None
 
+        if resp:
             try:
-                pkgs_data = json.loads(resp.text)
-            except ValueError as e:
-                log.debug(
-                    f"{self.SRC_ID}: can't fetch the metadata. \
-					Access denied or JSON object is corrupted"
-                )
-                return []
+                for pkg in iter_json_items(open_json_stream(resp), "item"):
+                    pkg = self._wrap_exported_dataset(pkg, search_url)
+                    exported.add(pkg["dataset"]["dataset_id"])
+                    yield pkg
+
+                log.info(f"{self.SRC_ID}: {len(exported)} datasets exported")
+                return
+            except Exception as e:
+                log.error(f"{self.SRC_ID}: catalog export failed: {e}")
+            finally:
+                resp.close()
+
+        log.warning(
+            f"{self.SRC_ID}: catalog export failed after {len(exported)} datasets. "
+            "Using the paged catalog search"
+        )
+        yield from self._page_catalog(source_url, exclude=exported)
+
+    def _wrap_exported_dataset(
+        self, pkg: dict[str, Any], search_url: str
+    ) -> dict[str, Any]:
+        """The catalog export contains bare dataset objects, while the catalog
+        search wraps them along with the links. Make it look like the search
+        result, so the rest of the harvester doesn't care about the source"""
+        if "dataset" in pkg:
+            return pkg
+
+        return {
+            "links": [
+                {"rel": "self", "href": f"{search_url}/{pkg['dataset_id']}"}
+            ],
+            "dataset": pkg,
+        }
+
+    def _page_catalog(
+        self, source_url: str, exclude: Optional[set[str]] = None
+    ) -> Iterator[dict[str, Any]]:
+        """Yields ODS datasets page by page from the catalog search API
+
+        Args:
+            source_url (str): remote portal URL
+            exclude (Optional[set[str]], optional): IDs of the datasets,
+                that are already gathered. Defaults to None.
+        """
+        max_datasets = tk.asint(self.config.get("max_datasets", 0))
 
+        params = self._get_catalog_params()
+        params["rows"] = self._get_page_size()
+
+        if 1 <= max_datasets <= 100:
+            params["rows"] = max_datasets
+
+        search_url = urljoin(source_url, "/api/v2/catalog/datasets")
+        url = search_url + "?" + urlencode(params)
+        gathered = 0
+
+        log.info(f"{self.SRC_ID}: gathering ODS remote datasets: {url}")
+
+        for pkgs_data in self._paginate(
+            url, self._get_next_page_datasets_url, self._page_sizer
+        ):
             for pkg in pkgs_data["datasets"]:
-                pkg_dicts.append(pkg)
+                if exclude and pkg["dataset"]["dataset_id"] in exclude:
+                    continue
+                gathered += 1
+                yield pkg
 
-            url = self._get_next_page_datasets_url(pkgs_data)
-            if not url:
+            if max_datasets and gathered > max_datasets:
                 break
 
-            if max_datasets and len(pkg_dicts) > max_datasets:
-                break
+    def _prefetch_export_links(self, source_url: str, pkg_dicts: list[dict]):
+        """Fetches export links for all the datasets concurrently, so the
+        fetch stage doesn't need to make a request per dataset. If the
+        request failed, the fetch stage will try it once again on its own."""
+        urls = [
+            self._get_export_resource_url(
+                source_url, unicode_safe(pkg_dict["dataset"]["dataset_id"])
+            )
+            for pkg_dict in pkg_dicts
+        ]
 
-        return pkg_dicts[:max_datasets] if max_datasets else pkg_dicts
+        for pkg_dict, links in zip(
+            pkg_dicts, self._run_concurrently(self._prefetch_resource_urls, urls)
+        ):
+            if links is not None:
+                pkg_dict[self.EXPORT_LINKS_KEY] = links
+
+    def _prefetch_resource_urls(self, res_link: str) -> Optional[list[dict]]:
+        try:
+            return self._get_all_resource_urls(res_link)
+        except (tk.ValidationError, CircuitOpenError) as e:
+            log.warning(f"{self.SRC_ID}: export links prefetch failed: {e}")
 
     def _get_next_page_datasets_url(self, pkg_dict):
         for link in pkg_dict["links"]:
@@ -195,11 +373,23 @@ class ODSHarvester(BasketBasicHarvester):
         return (attachment["url"].split(".")[-1]).upper()
 
     def fetch_stage(self, harvest_object):
+        if self._get_object_status(harvest_object) == "delete":
+            return True
+
         self._set_config(harvest_object.source.config)
         source_url = self._get_src_url(harvest_object)
-        package_dict = json.loads(harvest_object.content)
-        self._pre_map_stage(package_dict, source_url)
-        harvest_object.content = json.dumps(package_dict)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        package_dict = self._load_content(harvest_object.content)
+
+        try:
+            self._pre_map_stage(package_dict, source_url)
+        except (CircuitOpenError, ContentFetchError) as e:
+            self._save_object_error(f"{self.SRC_ID}: {e}", harvest_object, "Fetch")
+            return False
+
+        harvest_object.content = self._dump_content(package_dict)
         return True
 
     def _pre_map_stage(self, package_dict: dict, source_url: str):
@@ -211,8 +401,18 @@ class ODSHarvester(BasketBasicHarvester):
             package_dict.get("description")
         )
 
-        res_export_url: str = self._get_export_resource_url(source_url, origin_id)
-        res_links = self._get_all_resource_urls(res_export_url)
+        res_links = package_dict.pop(self.EXPORT_LINKS_KEY, None)
+        if res_links is None:
+            res_export_url: str = self._get_export_resource_url(source_url, origin_id)
+            res_links = self._get_all_resource_urls(res_export_url)
+
+        # the dataset without resources is worse than the failed one, that
+        # would be harvested by the next job
+        if res_links is None:
+            raise ContentFetchError(
+                f"{self.SRC_ID}: export links of the dataset {origin_id} "
+                "are not available"
+            )
         package_dict["resources"] = self._fetch_resources(
             source_url, res_links, package_dict
         )
@@ -261,30 +461,31 @@ class ODSHarvester(BasketBasicHarvester):
         offset = "/api/v2/catalog/datasets/{}/exports".format(pkg_id)
         return source_url + offset
 
-    def _get_all_resource_urls(self, res_link: str) -> list[str]:
+    def _get_all_resource_urls(self, res_link: str) -> Optional[list[dict]]:
         """Fetches a resource URLs
 
         Args:
                 res_link (str): resource API endpoint
 
         Returns:
-                list[str]: list of url strings
+                Optional[list[dict]]: list of export links or None if they
+                                      couldn't be fetched
         """
         if not res_link:
             return []
 
         resp = self._make_request(res_link)
         if not resp:
-            return []
+            return None
 
         try:
-            content = json.loads(resp.text)
+            content = codec.loads(resp.content)
         except ValueError as e:
-            log.debug(
-                f"{self.SRC_ID}: Can't fetch the metadata. \
-				Access denied or JSON object is corrupted"
+            log.warning(
+                f"{self.SRC_ID}: Can't fetch the metadata. "
+                f"Access denied or JSON object is corrupted: {e}"
             )
-            return []
+            return None
 
         res_links = []
         formats = ("csv", "json", "xls", "geojson", "shp", "kml")
@@ -1,20 +1,20 @@
 from __future__ import annotations
 
 import logging
-from typing import Any
+from typing import Any, Optional
 from io import BytesIO
 from urllib import parse
 
 import geojson
 
-from ckan.lib.helpers import json
 from ckan.plugins import toolkit as tk
 from ckan.lib.munge import munge_tag
 
-from ckanext.harvest.model import HarvestObject
-from ckanext.harvest.harvesters.ckanharvester import ContentFetchError, SearchError
+from ckanext.harvest.harvesters.ckanharvester import SearchError
 
+from ckanext.harvest_basket import codec
 from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
+from ckanext.harvest_basket.throttle import BudgetExceededError, CircuitOpenError
 
 
 log = logging.getLogger(__name__)
@@ -22,8 +22,11 @@ log = logging.getLogger(__name__)
 
 class SocrataHarvester(BasketBasicHarvester):
     ALL_PUBLIC_ASSETS: str = "/api/views/"
+    CATALOG_API: str = "/api/catalog/v1"
     SOLR_MAX_STRING_SIZE: int = 32000
     SRC_ID = "Socrata"
+    # column statistics, could be megabytes for a big dataset
+    PRUNE_FIELDS = ("columns.*.cachedContents",)
 
     def info(self):
         return {
@@ -37,7 +40,10 @@ class SocrataHarvester(BasketBasicHarvester):
 
         log.info(f"{self.SRC_ID}: gather stage in progress: {source_url}")
 
-        self._set_config(harvest_job.source.config)
+        self._start_gather(harvest_job)
+
+        if self._is_catalog_unchanged(harvest_job, source_url):
+            return []
 
         try:
             pkg_dicts = self._search_datasets(source_url)
@@ -75,18 +81,16 @@ class SocrataHarvester(BasketBasicHarvester):
                     continue
                 package_ids.add(pkg_dict["id"])
 
-                log.info(
+                log.debug(
                     "Creating HARVEST object for {} | id: {}".format(
                         pkg_dict.get("name", "").encode("utf-8"), pkg_dict["id"]
                     )
                 )
-                obj = HarvestObject(
-                    guid=pkg_dict["id"], job=harvest_job, content=json.dumps(pkg_dict)
-                )
-                obj.save()
-                object_ids.append(obj.id)
+                obj = self._make_harvest_object(pkg_dict["id"], harvest_job, pkg_dict)
+                if obj:
+                    object_ids.append(obj.id)
 
-            return object_ids
+            return self._finish_gather(harvest_job, object_ids, complete=True)
 
         except Exception as e:
             log.debug(f"The error occured during the gather stage: {e}")
@@ -110,44 +114,57 @@ class SocrataHarvester(BasketBasicHarvester):
 
         pkg_dicts = []
 
-        limit = self.config.get("limit", 50)
+        limit = self._get_page_size("limit")
         max_datasets = tk.asint(self.config.get("max_datasets", 0))
 
         params = {"page": 1, "limit": limit}
 
-        while True:
-            url = f"{package_list_url}?{parse.urlencode(params)}"
-            log.debug("Searching for datasets: {}".format(url))
+        def get_next_url(pkg_dicts_page: list[dict[str, Any]]) -> Optional[str]:
+            if not pkg_dicts_page:
+                return None
 
-            try:
-                resp = self._make_request(url)
-            except ContentFetchError as e:
-                raise SearchError(
-                    "Error sending request to search remote "
-                    f"Socrata instance {remote_url} using URL {url}. Error: {e}"
-                )
-
-            try:
-                pkg_dicts_page = json.loads(resp.text)
-            except ValueError as e:
-                raise SearchError(f"Response from remote portal was not a JSON: {e}")
+            if max_datasets and len(pkg_dicts) > max_datasets:
+                return None
 
-            pkg_dicts_page = [p for p in pkg_dicts_page]
+            params["page"] += 1
+            return f"{package_list_url}?{parse.urlencode(params)}"
 
-            if len(pkg_dicts_page) == 0:
-                break
+        url = f"{package_list_url}?{parse.urlencode(params)}"
+        log.debug("Searching for datasets: {}".format(url))
 
+        for pkg_dicts_page in self._paginate(url, get_next_url, self._page_sizer):
             pkg_dicts.extend(pkg_dicts_page)
 
-            if max_datasets and len(pkg_dicts) > max_datasets:
-                break
-
-            params["page"] += 1
-
         if max_datasets:
             return pkg_dicts[:max_datasets]
         return pkg_dicts
 
+    def _get_catalog_fingerprint(self, source_url):
+        # the catalog API provides the total number of assets and could sort
+        # them by the last data or metadata update
+        domain = parse.urlparse(source_url).netloc
+        params = {
+            "domains": domain,
+            "search_context": domain,
+            "order": "updatedAt DESC",
+            "limit": 1,
+        }
+        url = f"{parse.urljoin(source_url, self.CATALOG_API)}?{parse.urlencode(params)}"
+        data = codec.loads(self._make_page_request(url).content)
+
+        if not data.get("results"):
+            return None
+
+        return f"{data['resultSetSize']}:{data['results'][0]['resource']['updatedAt']}"
+
+    def _get_remote_modified(self, pkg_dict):
+        # data and metadata modification dates are tracked separately
+        dates = [
+            self._parse_remote_modified(pkg_dict.get(field))
+            for field in ("rowsUpdatedAt", "viewLastModified")
+        ]
+        return max(filter(None, dates), default=None)
+
     def _resources_fetch(self, pkg_data):
         resources = []
 
@@ -254,7 +271,7 @@ class SocrataHarvester(BasketBasicHarvester):
 
         try:
             res = self._make_request(url)
-            content = json.loads(res.text)
+            content = codec.loads(res.content)
         except (ValueError, AttributeError) as e:
             log.error(f"Error fetching package url: {e}")
             return ""
@@ -262,11 +279,23 @@ class SocrataHarvester(BasketBasicHarvester):
         return content.get("dataUri", content.get("webUri", ""))
 
     def fetch_stage(self, harvest_object):
+        if self._get_object_status(harvest_object) == "delete":
+            return True
+
         self._set_config(harvest_object.source.config)
         self.source_url = self._get_src_url(harvest_object)
-        package_dict = json.loads(harvest_object.content)
-        self._pre_map_stage(package_dict, self.source_url)
-        harvest_object.content = json.dumps(package_dict)
+
+        if not self._start_fetch(harvest_object):
+            return False
+        package_dict = self._load_content(harvest_object.content)
+
+        try:
+            self._pre_map_stage(package_dict, self.source_url)
+        except CircuitOpenError as e:
+            self._save_object_error(f"{self.SRC_ID}: {e}", harvest_object, "Fetch")
+            return False
+
+        harvest_object.content = self._dump_content(package_dict)
         return True
 
     def _pre_map_stage(self, content: dict, source_url: str):
@@ -296,13 +325,16 @@ class SocrataHarvester(BasketBasicHarvester):
         content["metadata_modified"] = self._datetime_refine(
             content.get("rowsUpdatedAt", "")
         )
-        content["url"] = self._get_pkg_source_url(content["origin_id"])
+        content["url"] = ""
+        if self._can_enrich("landing page", content["origin_id"]):
+            content["url"] = self._get_pkg_source_url(content["origin_id"])
         content["type"] = "dataset"
 
         # datasets with map displayType or geo viewType contains geojson data
         # that we can harvest as geojson file
         if content.get("displayType") == "map" or content.get("viewType") == "geo":
-            self._fetch_geojson_resource(content)
+            if self._can_enrich("spatial coverage", content["origin_id"]):
+                self._fetch_geojson_resource(content)
 
         # fetching extras from remote portal
         content["extras"] = []
@@ -370,15 +402,20 @@ class SocrataHarvester(BasketBasicHarvester):
         # user can define the maxsize in config
         gjson_data = BytesIO()
 
-        for number, chunk in enumerate(geo.iter_content(chunk_size=1024 * 32)):
-            if chunk:
-                gjson_data.write(chunk)
-                # you can provide maxsize for geojson file to download
-                # if not provided - maxsize is 64 mb
-                if number > self.config.get("geojson_maxsize", 2000):
-                    log.error("The GeoJSON file is too big for SOLR, skipping...")
-                    gjson_data.close()
-                    return "", ""
+        try:
+            for number, chunk in enumerate(self._iter_content(geo, 1024 * 32)):
+                if chunk:
+                    gjson_data.write(chunk)
+                    # you can provide maxsize for geojson file to download
+                    # if not provided - maxsize is 64 mb
+                    if number > self.config.get("geojson_maxsize", 2000):
+                        log.error("The GeoJSON file is too big for SOLR, skipping...")
+                        gjson_data.close()
+                        return "", ""
+        except BudgetExceededError as e:
+            log.warning(f"{self.SRC_ID}: skipping spatial coverage, {e}")
+            gjson_data.close()
+            return "", ""
 
         try:
             gjson = geojson.loads(gjson_data.getvalue())["features"]
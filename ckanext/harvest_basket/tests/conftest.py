@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def harvest_job():
+    source = SimpleNamespace(
+        id="source", url="https://example.com", config='{"delete_missing": true}'
+    )
+    return SimpleNamespace(id="job", source=source, gather_started=None, created=None)
+
+
+@pytest.fixture
+def stub_gather(monkeypatch):
+    """Replaces the database access of the gather stage. Returns the
+    recorded gather errors and the flag, whether the missing datasets were
+    withdrawn"""
+
+    def stub(harvester):
+        calls = SimpleNamespace(errors=[], withdrawn=False)
+
+        def withdraw_missing(harvest_job):
+            calls.withdrawn = True
+            return []
+
+        monkeypatch.setattr(harvester, "_get_harvested_objects", lambda source_id: {})
+        monkeypatch.setattr(
+            harvester,
+            "_make_harvest_object",
+            lambda guid, harvest_job, pkg_dict, **kwargs: SimpleNamespace(id=guid),
+        )
+        monkeypatch.setattr(
+            harvester,
+            "_save_gather_error",
+            lambda message, harvest_job: calls.errors.append(message),
+        )
+        monkeypatch.setattr(harvester, "_withdraw_missing", withdraw_missing)
+        return calls
+
+    return stub
@@ -0,0 +1,66 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.harvest_basket.harvesters.arcgis_harvester import ArcGISHarvester
+
+SERVICES_URL = "https://example.com/arcgis/rest/services/"
+
+
+@pytest.fixture
+def harvester():
+    return ArcGISHarvester()
+
+
+def _serve(harvester, monkeypatch, broken=()):
+    """Serves the services of the portal. The `broken` maps service names to
+    the content of their metadata response, None for a failed request"""
+
+    def make_request(url, stream=False):
+        name = url[len(SERVICES_URL) :].split("/")[0]
+        if "/info/" in url and name in broken:
+            return broken[name] and SimpleNamespace(content=broken[name])
+        if "/info/" in url:
+            content = {"id": name, "title": name}
+        else:
+            content = {"layers": [{"id": 0, "name": name}], "tables": []}
+        return SimpleNamespace(content=json.dumps(content).encode())
+
+    monkeypatch.setattr(
+        harvester, "_get_all_services_urls_list", lambda source_url: [SERVICES_URL + name for name in "abc"]
+    )
+    monkeypatch.setattr(harvester, "_make_request", make_request)
+
+
+def test_complete_gather_withdraws_missing(
+    harvester, harvest_job, stub_gather, monkeypatch
+):
+    calls = stub_gather(harvester)
+    _serve(harvester, monkeypatch)
+
+    object_ids = harvester.gather_stage(harvest_job)
+
+    assert object_ids == ["a", "b", "c"]
+    assert calls.withdrawn
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        None,
+        b"<html>",
+        b'{"error": {"code": 499, "message": "Token Required"}}',
+        b'{"title": "no id"}',
+    ],
+)
+def test_failed_service_keeps_missing(
+    harvester, harvest_job, stub_gather, monkeypatch, response
+):
+    calls = stub_gather(harvester)
+    _serve(harvester, monkeypatch, {"b": response})
+
+    object_ids = harvester.gather_stage(harvest_job)
+
+    assert object_ids == ["a", "c"]
+    assert not calls.withdrawn
@@ -0,0 +1,520 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import ckan.plugins.toolkit as tk
+from ckanext.harvest.harvesters.base import HarvesterBase
+from ckanext.harvest.harvesters.ckanharvester import SearchError
+from ckanext.harvest_basket import throttle
+from ckanext.harvest_basket.harvesters import base_harvester
+from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
+from ckanext.harvest_basket.throttle import RetryBudget
+
+
+class Harvester(BasketBasicHarvester):
+    SRC_ID = "TEST"
+
+
+class TestRunConcurrently:
+    def test_order(self):
+        harvester = Harvester()
+        harvester.config = {"concurrency": 4}
+
+        results = harvester._run_concurrently(lambda item: item * 2, range(20))
+
+        assert list(results) == [item * 2 for item in range(20)]
+
+    def test_submitted_items_are_bounded(self):
+        harvester = Harvester()
+        harvester.config = {"concurrency": 2}
+        lock = threading.Lock()
+        submitted = []
+
+        def items():
+            for item in range(100):
+                with lock:
+                    submitted.append(item)
+                yield item
+
+        def slow(item):
+            time.sleep(0.001)
+            return item
+
+        results = harvester._run_concurrently(slow, items())
+        next(results)
+
+        assert len(submitted) <= 4
+        results.close()
+
+
+class TestDeferredSearchCommit:
+    @pytest.fixture
+    def harvester(self, monkeypatch):
+        harvester = Harvester()
+        harvester.config = {"index_commit_batch": 2}
+        commits = []
+        indexed_with = []
+
+        def create_or_update(self, package_dict, harvest_object, package_dict_form):
+            indexed_with.append(tk.config.get("ckan.search.solr_commit"))
+            return True
+
+        monkeypatch.setattr(
+            HarvesterBase, "_create_or_update_package", create_or_update, raising=False
+        )
+        monkeypatch.setattr(base_harvester.search, "commit", lambda: commits.append(1))
+        monkeypatch.setattr(BasketBasicHarvester, "_uncommitted", 0)
+        harvester.commits = commits
+        harvester.indexed_with = indexed_with
+        return harvester
+
+    def _import(self, harvester):
+        return harvester._create_or_update_package(
+            {}, SimpleNamespace(id="obj", harvest_job_id=None)
+        )
+
+    def test_commit_by_batches(self, harvester):
+        for _ in range(5):
+            assert self._import(harvester)
+
+        assert harvester.indexed_with == [False] * 5
+        assert len(harvester.commits) == 2
+
+    def test_unset_option_stays_unset(self, harvester, monkeypatch):
+        monkeypatch.delitem(tk.config, "ckan.search.solr_commit", raising=False)
+
+        self._import(harvester)
+
+        assert "ckan.search.solr_commit" not in tk.config
+
+    def test_option_is_restored(self, harvester, monkeypatch):
+        monkeypatch.setitem(tk.config, "ckan.search.solr_commit", "true")
+
+        self._import(harvester)
+
+        assert tk.config["ckan.search.solr_commit"] == "true"
+
+    def test_concurrent_imports(self, harvester, monkeypatch):
+        monkeypatch.setitem(tk.config, "ckan.search.solr_commit", True)
+
+        with harvester._defer_search_commit():
+            with harvester._defer_search_commit():
+                pass
+            # the outer import is still in progress
+            assert tk.config["ckan.search.solr_commit"] is False
+
+        assert tk.config["ckan.search.solr_commit"] is True
+
+
+class TestImportProgress:
+    @pytest.fixture
+    def tracked(self, monkeypatch):
+        tracked = []
+        monkeypatch.setattr(
+            Harvester,
+            "_track_progress",
+            lambda self, job_id, stage, *args, **kwargs: tracked.append(stage),
+        )
+        return tracked
+
+    @pytest.mark.parametrize("result, stages", [(True, ["imported"]), (None, [])])
+    def test_counted_after_import(self, tracked, monkeypatch, result, stages):
+        monkeypatch.setattr(
+            HarvesterBase,
+            "_create_or_update_package",
+            lambda self, *args: result,
+            raising=False,
+        )
+        harvester = Harvester()
+        harvester.config = {}
+
+        harvester._create_or_update_package(
+            {}, SimpleNamespace(id="obj", harvest_job_id="job")
+        )
+
+        assert tracked == stages
+
+
+class TestCircuitBreakerConfig:
+    URL = "https://example.com/api"
+
+    @pytest.fixture(autouse=True)
+    def breakers(self, monkeypatch):
+        monkeypatch.setattr(BasketBasicHarvester, "_circuit_breakers", {})
+
+    def _get_breaker(self, **config):
+        harvester = Harvester()
+        harvester.config = config
+        return harvester._get_circuit_breaker(self.URL)
+
+    def test_disabled(self):
+        assert self._get_breaker() is None
+
+    def test_shared_by_host(self):
+        breaker = self._get_breaker(circuit_breaker_failures=3)
+
+        assert self._get_breaker(circuit_breaker_failures=3) is breaker
+
+    def test_config_change(self):
+        breaker = self._get_breaker(circuit_breaker_failures=3)
+        breaker.record_failure()
+
+        updated = self._get_breaker(
+            circuit_breaker_failures=2,
+            circuit_breaker_window=10,
+            circuit_breaker_cooldown=5,
+        )
+
+        assert updated is breaker
+        assert (breaker.threshold, breaker.window, breaker.cooldown) == (2, 10, 5)
+        # the failures of the host are kept
+        breaker.record_failure()
+        assert not breaker.allow()
+
+    def test_change_is_logged_without_harvester(self, caplog):
+        breaker = self._get_breaker(circuit_breaker_failures=1)
+
+        with caplog.at_level("WARNING"):
+            breaker.record_failure()
+
+        assert caplog.messages == [
+            "circuit breaker of example.com changed from closed to open"
+        ]
+
+
+class TestDeadline:
+    def _harvester(self, elapsed, **config):
+        """Harvester of the job, that has started `elapsed` seconds ago"""
+        harvester = Harvester()
+        harvester.config = config
+        started = datetime.utcnow() - timedelta(seconds=elapsed)
+        harvester._set_deadline(SimpleNamespace(gather_started=started, created=None))
+        return harvester
+
+    def test_no_request_timeout(self):
+        assert self._harvester(0)._get_request_timeout() is None
+
+    def test_request_budget(self):
+        harvester = self._harvester(0, request_budget=60)
+
+        assert harvester._get_request_timeout() == 60
+
+    def test_request_timeout_is_capped_by_deadline(self):
+        harvester = self._harvester(90, request_budget=60, job_deadline=100)
+
+        assert 9 < harvester._get_request_timeout() <= 10
+
+    def test_request_timeout_after_deadline(self):
+        harvester = self._harvester(200, job_deadline=100)
+
+        assert harvester._get_request_timeout() == 1.0
+
+    @pytest.mark.parametrize("elapsed, allowed", [(0, True), (89, True), (95, False)])
+    def test_can_enrich(self, elapsed, allowed):
+        harvester = self._harvester(elapsed, job_deadline=100)
+
+        assert harvester._can_enrich("spatial coverage", "a") is allowed
+
+    def test_can_enrich_without_deadline(self):
+        assert self._harvester(10**6)._can_enrich("spatial coverage", "a")
+
+
+class TestStartFetch:
+    @pytest.fixture
+    def harvester(self, monkeypatch):
+        harvester = Harvester()
+        harvester.errors = []
+        harvester.tracked = []
+        monkeypatch.setattr(
+            harvester,
+            "_save_object_error",
+            lambda message, obj, stage: harvester.errors.append(message),
+        )
+        monkeypatch.setattr(
+            harvester,
+            "_track_progress",
+            lambda job_id, stage: harvester.tracked.append(stage),
+        )
+        return harvester
+
+    def _object(self, elapsed):
+        started = datetime.utcnow() - timedelta(seconds=elapsed)
+        job = SimpleNamespace(gather_started=started, created=None)
+        return SimpleNamespace(job=job, harvest_job_id="job")
+
+    def test_before_deadline(self, harvester):
+        harvester.config = {"job_deadline": 100}
+
+        assert harvester._start_fetch(self._object(50))
+        assert harvester.tracked == ["fetched"]
+        assert not harvester.errors
+
+    def test_after_deadline(self, harvester):
+        harvester.config = {"job_deadline": 100}
+
+        assert not harvester._start_fetch(self._object(150))
+        assert harvester.errors
+
+    def test_without_deadline(self, harvester):
+        harvester.config = {}
+
+        assert harvester._start_fetch(self._object(10**6))
+
+
+class TestUnchangedCatalog:
+    @pytest.fixture
+    def job(self):
+        source = SimpleNamespace(id="source", config='{"skip_unchanged_catalog": 1}')
+        return SimpleNamespace(id="job", source=source, gather_errors=[])
+
+    @pytest.fixture
+    def state(self, monkeypatch):
+        """Source state of the previous job `previous`, that had no errors"""
+        state = {}
+        monkeypatch.setattr(
+            base_harvester, "get_source_state", lambda source_id, key: state.get(key)
+        )
+        monkeypatch.setattr(
+            base_harvester,
+            "set_source_state",
+            lambda source_id, key, value: state.__setitem__(key, value),
+        )
+        monkeypatch.setattr(
+            Harvester,
+            "last_error_free_job",
+            staticmethod(lambda harvest_job: SimpleNamespace(id="previous")),
+            raising=False,
+        )
+        return state
+
+    def _harvester(self, fingerprint, **config):
+        harvester = Harvester()
+        harvester.config = dict({"skip_unchanged_catalog": True}, **config)
+        harvester._get_catalog_fingerprint = lambda source_url: fingerprint
+        return harvester
+
+    def _remember(self, state, job, fingerprint, job_id="previous"):
+        harvester = self._harvester(fingerprint)
+        assert not harvester._is_catalog_unchanged(job, "https://example.com")
+        state[Harvester.CATALOG_FINGERPRINT_STATE] = {
+            "fingerprint": harvester._catalog_fingerprint,
+            "job_id": job_id,
+        }
+
+    def test_unchanged(self, state, job):
+        self._remember(state, job, "10:2024-01-01")
+
+        harvester = self._harvester("10:2024-01-01")
+
+        assert harvester._is_catalog_unchanged(job, "https://example.com")
+        # the skipped job becomes the reference for the next one
+        assert state[Harvester.CATALOG_FINGERPRINT_STATE]["job_id"] == "job"
+
+    def test_changed(self, state, job):
+        self._remember(state, job, "10:2024-01-01")
+
+        harvester = self._harvester("11:2024-01-02")
+
+        assert not harvester._is_catalog_unchanged(job, "https://example.com")
+
+    def test_missing_fingerprint(self, state, job):
+        self._remember(state, job, "10:2024-01-01")
+
+        assert not self._harvester(None)._is_catalog_unchanged(
+            job, "https://example.com"
+        )
+
+    def test_failed_fingerprint(self, state, job):
+        self._remember(state, job, "10:2024-01-01")
+        harvester = self._harvester(None)
+
+        def fail(source_url):
+            raise ValueError("bad response")
+
+        harvester._get_catalog_fingerprint = fail
+
+        assert not harvester._is_catalog_unchanged(job, "https://example.com")
+
+    def test_previous_job_with_errors(self, state, job):
+        self._remember(state, job, "10:2024-01-01", job_id="failed")
+
+        harvester = self._harvester("10:2024-01-01")
+
+        assert not harvester._is_catalog_unchanged(job, "https://example.com")
+
+    def test_disabled(self, state, job):
+        self._remember(state, job, "10:2024-01-01")
+
+        harvester = self._harvester("10:2024-01-01", skip_unchanged_catalog=False)
+
+        assert not harvester._is_catalog_unchanged(job, "https://example.com")
+
+
+class TestRetries:
+    URL = "https://example.com/api"
+
+    @pytest.fixture
+    def remote(self, monkeypatch):
+        """Serves the queued responses, given as status code and headers.
+        The clock of the harvester and the throttling advances only on
+        sleep"""
+        remote = SimpleNamespace(queue=[], requested=0, slept=[], now=1000.0)
+
+        def respond(*args, **kwargs):
+            status_code, headers = remote.queue.pop(0)
+            remote.requested += 1
+            resp = requests.Response()
+            resp.status_code = status_code
+            resp.reason = "Error"
+            resp.headers.update(headers)
+            resp._content = b"{}"
+            resp._content_consumed = True
+            return resp
+
+        def sleep(seconds):
+            remote.slept.append(seconds)
+            remote.now += seconds
+
+        clock = SimpleNamespace(
+            monotonic=lambda: remote.now, time=lambda: remote.now, sleep=sleep
+        )
+        monkeypatch.setattr(base_harvester.requests, "request", respond)
+        monkeypatch.setattr(base_harvester.requests, "get", respond)
+        monkeypatch.setattr(base_harvester, "time", clock)
+        monkeypatch.setattr(throttle, "time", clock)
+        monkeypatch.setattr(BasketBasicHarvester, "_rate_limiters", {})
+        return remote
+
+    def _harvester(self, **config):
+        harvester = Harvester()
+        harvester.config = config
+        return harvester
+
+    @pytest.mark.parametrize("status_code", [429, 503])
+    def test_throttled_request_is_retried(self, remote, status_code):
+        remote.queue = [(status_code, {}), (200, {})]
+        harvester = self._harvester(rate_limit=10)
+
+        assert harvester._make_request(self.URL).status_code == 200
+        assert remote.requested == 2
+
+    def test_no_retries_without_rate_limit(self, remote):
+        remote.queue = [(429, {}), (200, {})]
+        harvester = self._harvester()
+
+        with pytest.raises(tk.ValidationError):
+            harvester._make_request(self.URL)
+        assert remote.requested == 1
+
+    def test_server_error_is_not_retried(self, remote):
+        remote.queue = [(500, {}), (200, {})]
+        harvester = self._harvester(rate_limit=10)
+
+        with pytest.raises(tk.ValidationError):
+            harvester._make_request(self.URL)
+        assert remote.requested == 1
+
+    def test_retries_are_limited(self, remote):
+        remote.queue = [(429, {})] * 3
+        harvester = self._harvester(rate_limit=10, max_retries=2)
+
+        with pytest.raises(tk.ValidationError):
+            harvester._make_request(self.URL)
+        assert remote.requested == 3
+
+    def test_retry_after(self, remote):
+        remote.queue = [(429, {"Retry-After": "5"}), (200, {})]
+        harvester = self._harvester(rate_limit=10)
+
+        harvester._make_request(self.URL)
+
+        # the rate limiter pauses the requests to the host
+        assert remote.slept == [5.0]
+
+    def test_raise_for_status(self, remote):
+        remote.queue = [(404, {})]
+        harvester = self._harvester()
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            harvester._make_request(self.URL, raise_for_status=True)
+
+    def test_page_retry_after(self, remote):
+        remote.queue = [(503, {"Retry-After": "7"}), (200, {})]
+        harvester = self._harvester(retry_backoff=1)
+
+        assert harvester._make_page_request(self.URL).status_code == 200
+        assert remote.slept == [7.0]
+
+    def test_page_retry_after_is_capped(self, remote):
+        remote.queue = [(503, {"Retry-After": "100000"}), (200, {})]
+        harvester = self._harvester(retry_backoff=1)
+
+        harvester._make_page_request(self.URL)
+
+        assert remote.slept == [harvester.MAX_RETRY_DELAY]
+
+    def test_page_retry_budget(self, remote):
+        remote.queue = [(500, {})] * 3
+        harvester = self._harvester(max_retries=5)
+        harvester._retry_budget = RetryBudget(1)
+
+        with pytest.raises(SearchError, match="after 2 attempts"):
+            harvester._make_page_request(self.URL)
+        assert remote.requested == 2
+
+
+class TestPeakMemory:
+    @pytest.fixture
+    def tracked(self, monkeypatch):
+        tracked = []
+        monkeypatch.setattr(
+            base_harvester,
+            "track_job_progress",
+            lambda job_id, counts, metrics, maxima: tracked.append(maxima) or counts,
+        )
+        return tracked
+
+    def _harvester(self, monkeypatch, baseline, memory):
+        harvester = Harvester()
+        harvester.config = {}
+        harvester._progress = harvester._progress.copy()
+        harvester._metrics = harvester._metrics.copy()
+        monkeypatch.setattr(base_harvester, "get_memory_usage", lambda: memory)
+        harvester._progress_job_id = "job"
+        harvester._memory_baseline = baseline
+        return harvester
+
+    def test_growth_since_baseline(self, tracked, monkeypatch):
+        harvester = self._harvester(monkeypatch, 1000, 1500)
+
+        harvester._track_progress("job", "fetched")
+
+        assert tracked == [{"peak_memory": 500}]
+
+    def test_released_memory(self, tracked, monkeypatch):
+        harvester = self._harvester(monkeypatch, 1000, 800)
+
+        harvester._track_progress("job", "fetched")
+
+        assert tracked == [{"peak_memory": 0}]
+
+    def test_not_measured(self, tracked, monkeypatch):
+        harvester = self._harvester(monkeypatch, None, None)
+
+        harvester._track_progress("job", "fetched")
+
+        assert tracked == [{}]
+
+    def test_baseline_of_fetch(self, tracked, monkeypatch):
+        harvester = self._harvester(monkeypatch, None, 1000)
+        harvester._set_deadline = lambda job: None
+        harvester._is_deadline_passed = lambda: False
+
+        harvester._start_fetch(SimpleNamespace(job=None, harvest_job_id="job"))
+
+        assert harvester._memory_baseline == 1000
+        assert tracked == [{"peak_memory": 0}]
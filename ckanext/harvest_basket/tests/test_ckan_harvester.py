@@ -0,0 +1,230 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from ckanext.harvest.harvesters import CKANHarvester
+from ckanext.harvest.harvesters.ckanharvester import SearchError
+from ckanext.harvest_basket import codec
+from ckanext.harvest_basket.harvesters import base_harvester
+from ckanext.harvest_basket.harvesters.base_harvester import BasketBasicHarvester
+from ckanext.harvest_basket.harvesters.ckan_harvester import CustomCKANHarvester
+
+SEARCH_URL = "https://example.com/api/3/action/package_search"
+
+
+@pytest.fixture
+def harvester():
+    harvester = CustomCKANHarvester()
+    harvester.config = {"pagination": "keyset"}
+    return harvester
+
+
+class TestKeysetFilter:
+    def test_filter(self, harvester):
+        pkg_dict = {"id": "abc", "metadata_modified": "2024-01-02T03:04:05.123456"}
+
+        assert harvester._get_keyset_filter(pkg_dict) == (
+            "(metadata_modified:{2024-01-02T03:04:05.123Z TO *] OR "
+            "(metadata_modified:[2024-01-02T03:04:05.123Z TO "
+            "2024-01-02T03:04:05.123Z] AND id:{abc TO *]))"
+        )
+
+    def test_timezone_is_dropped(self, harvester):
+        pkg_dict = {"id": "abc", "metadata_modified": "2024-01-02T03:04:05+00:00"}
+
+        assert "{2024-01-02T03:04:05.000Z TO *]" in harvester._get_keyset_filter(
+            pkg_dict
+        )
+
+
+class TestKeysetPagination:
+    @pytest.fixture
+    def pages(self, harvester, monkeypatch):
+        datasets = [
+            {
+                "id": f"id-{idx:03d}",
+                "metadata_modified": f"2024-01-01T00:{idx // 60:02d}:{idx % 60:02d}",
+            }
+            for idx in range(250)
+        ]
+        requests = []
+
+        def get_search_page(search_url, params, start):
+            requests.append(params)
+            fq = params.get("fq", "")
+            offset = 0
+            if " AND id:{" in fq:
+                last_id = fq.split(" AND id:{")[1].split(" ")[0]
+                offset = int(last_id.split("-")[1]) + 1
+
+            return datasets[offset : offset + params["rows"]], len(datasets)
+
+        monkeypatch.setattr(harvester, "_get_search_page", get_search_page)
+        return requests
+
+    def test_all_pages(self, harvester, pages):
+        pkg_dicts = harvester._search_for_datasets("https://example.com")
+
+        assert len(pkg_dicts) == 250
+        assert len({pkg["id"] for pkg in pkg_dicts}) == 250
+        assert len(pages) == 3
+        assert all(params["sort"] == "metadata_modified asc, id asc" for params in pages)
+        assert "fq" not in pages[0]
+        assert pages[1]["fq"].startswith(
+            "(metadata_modified:{2024-01-01T00:01:39.000Z TO *]"
+        )
+
+    def test_max_datasets(self, harvester, pages):
+        harvester.config["max_datasets"] = 150
+
+        pkg_dicts = harvester._search_for_datasets("https://example.com")
+
+        assert len(pkg_dicts) == 150
+        assert len(pages) == 2
+
+    def test_fq_is_kept(self, harvester, pages):
+        harvester.config["fq"] = "organization:test"
+
+        harvester._search_for_datasets("https://example.com")
+
+        assert pages[0]["fq"] == "organization:test"
+        assert pages[1]["fq"].startswith("organization:test (metadata_modified:")
+
+
+class TestOffsetPagination:
+    @pytest.fixture
+    def pages(self, harvester, monkeypatch):
+        """Serves 350 datasets, but reports 1000 of them. The later pages of
+        a window are answered first"""
+        harvester.config = {"concurrency": 3}
+        datasets = [{"id": f"id-{idx:03d}"} for idx in range(350)]
+        pages = SimpleNamespace(requested=[], failed=None)
+
+        def get_search_page(search_url, params, start):
+            pages.requested.append(start)
+            time.sleep((1000 - start) / 100000)
+            if start == pages.failed:
+                raise SearchError(f"page {start} is not available")
+            return datasets[start : start + params["rows"]], 1000
+
+        monkeypatch.setattr(harvester, "_get_search_page", get_search_page)
+        return pages
+
+    def test_stops_on_short_page(self, harvester, pages):
+        pkg_dicts = harvester._search_for_datasets("https://example.com")
+
+        assert len(pkg_dicts) == 350
+        assert sorted(pages.requested) == [0, 100, 200, 300]
+
+    def test_order_across_windows(self, harvester, pages):
+        pkg_dicts = harvester._search_for_datasets("https://example.com")
+
+        assert [pkg["id"] for pkg in pkg_dicts] == [
+            f"id-{idx:03d}" for idx in range(350)
+        ]
+
+    def test_failed_page(self, harvester, pages):
+        pages.failed = 200
+
+        with pytest.raises(SearchError, match="page 200"):
+            harvester._search_for_datasets("https://example.com")
+
+
+def test_transmute_before_upstream_import(harvester, monkeypatch):
+    imported = []
+    source = SimpleNamespace(config='{"tsm_schema": {"root": "Dataset"}}')
+    harvest_object = SimpleNamespace(
+        content='{"title": "dataset"}', source=source, harvest_job_id=None, extras=[]
+    )
+
+    def transmute_data(data, schema):
+        data["title"] = data["title"].upper()
+
+    monkeypatch.setattr(harvester, "transmute_data", transmute_data)
+    monkeypatch.setattr(
+        CKANHarvester,
+        "import_stage",
+        lambda self, obj: imported.append(codec.loads(obj.content)) or True,
+        raising=False,
+    )
+
+    assert harvester.import_stage(harvest_object)
+    assert imported == [{"title": "DATASET"}]
+
+
+class TestSearchPage:
+    @pytest.fixture
+    def responses(self, harvester, monkeypatch):
+        """Serves the queued responses or exceptions of `requests.get`"""
+        harvester.config = {"circuit_breaker_failures": 2, "max_retries": 0}
+        monkeypatch.setattr(BasketBasicHarvester, "_circuit_breakers", {})
+        responses = SimpleNamespace(queue=[], requested=[])
+
+        def get(url, **kwargs):
+            responses.requested.append(kwargs)
+            result = responses.queue.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            resp = requests.Response()
+            resp.status_code, resp._content = result
+            return resp
+
+        monkeypatch.setattr(base_harvester.requests, "get", get)
+        return responses
+
+    def test_page(self, harvester, responses):
+        harvester.config["api_key"] = "secret"
+        result = {"count": 1, "results": [{"id": "a", "type": "custom"}]}
+        responses.queue.append((200, json.dumps({"result": result}).encode()))
+
+        pkg_dicts, count = harvester._get_search_page(SEARCH_URL, {"rows": 1}, 0)
+
+        assert pkg_dicts == [{"id": "a", "type": "dataset"}]
+        assert count == 1
+        assert responses.requested[0]["headers"] == {"Authorization": "secret"}
+
+    def test_failures_open_circuit(self, harvester, responses):
+        responses.queue.extend(
+            [(503, b""), requests.exceptions.ConnectionError("refused")]
+        )
+
+        for _ in range(2):
+            with pytest.raises(SearchError):
+                harvester._get_search_page(SEARCH_URL, {"rows": 1}, 0)
+
+        # the circuit is open, the request is not sent
+        with pytest.raises(SearchError, match="is not sent"):
+            harvester._get_search_page(SEARCH_URL, {"rows": 1}, 0)
+        assert len(responses.requested) == 2
+
+    def test_open_circuit_fails_search(self, harvester, responses, monkeypatch):
+        breaker = SimpleNamespace(
+            allow=lambda: False, threshold=2, get_retry_in=lambda: 30
+        )
+        monkeypatch.setattr(harvester, "_get_circuit_breaker", lambda url: breaker)
+
+        with pytest.raises(SearchError, match="example.com is unavailable"):
+            harvester._search_for_datasets("https://example.com")
+        assert not responses.requested
+
+
+def test_deadline_stops_pagination(harvester, monkeypatch):
+    harvester.config = {}
+    pages = []
+
+    def get_search_page(search_url, params, start):
+        pages.append(start)
+        # the deadline passes during the first page
+        monkeypatch.setattr(harvester, "_is_gather_deadline_passed", lambda: True)
+        return [{"id": f"id-{start + idx}"} for idx in range(params["rows"])], 1000
+
+    monkeypatch.setattr(harvester, "_is_gather_deadline_passed", lambda: False)
+    monkeypatch.setattr(harvester, "_get_search_page", get_search_page)
+
+    pkg_dicts = harvester._search_for_datasets("https://example.com")
+
+    assert pages == [0]
+    assert len(pkg_dicts) == 100
@@ -0,0 +1,63 @@
+import math
+
+import pytest
+
+from ckanext.harvest_basket import codec
+
+CONTENT = '{"title": "Dataset", "notes": "' + "lorem ipsum " * 100 + '"}'
+
+
+class TestCompression:
+    @pytest.mark.parametrize("method", codec.COMPRESSION_METHODS)
+    def test_round_trip(self, method):
+        if not codec.is_compression_available(method):
+            pytest.skip(f"{method} is not available")
+
+        compressed = codec.compress(CONTENT, method)
+
+        assert compressed.startswith(f"{method}:")
+        assert len(compressed) < len(CONTENT)
+        assert codec.decompress(compressed) == CONTENT
+
+    @pytest.mark.parametrize("method", [None, ""])
+    def test_disabled(self, method):
+        assert codec.compress(CONTENT, method) == CONTENT
+
+    def test_plain_content_is_readable(self):
+        assert codec.decompress(CONTENT) == CONTENT
+
+    def test_corrupted_content(self):
+        with pytest.raises(ValueError):
+            codec.decompress("zlib:bm90IGNvbXByZXNzZWQ=")
+
+    def test_unknown_method(self):
+        assert not codec.is_compression_available("lzma")
+
+
+class TestJson:
+    def test_round_trip(self):
+        data = {"title": "Dataset", "tags": ["a", "b"], "count": 1, "ratio": 0.5}
+        assert codec.loads(codec.dumps(data)) == data
+
+    @pytest.mark.parametrize("content", ['{"id": 1}', b'{"id": 1}'])
+    def test_str_and_bytes(self, content):
+        assert codec.loads(content) == {"id": 1}
+
+    def test_nan_and_infinity(self):
+        data = codec.loads('{"min": NaN, "max": Infinity}')
+
+        assert math.isnan(data["min"])
+        assert data["max"] == math.inf
+
+    @pytest.mark.parametrize(
+        "content", ["123456789012345678901234567890", b"-18446744073709551617"]
+    )
+    def test_big_integers_are_precise(self, content):
+        assert codec.loads(content) == int(content)
+
+    def test_invalid_document(self):
+        with pytest.raises(ValueError):
+            codec.loads(b'{"id": ')
+
+    def test_dumps_big_integer(self):
+        assert codec.loads(codec.dumps({"id": 2**70})) == {"id": 2**70}
@@ -0,0 +1,179 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from ckanext.harvest.harvesters.ckanharvester import SearchError
+from ckanext.harvest_basket.harvesters.csiro import CsiroHarvester
+
+
+def _file(name):
+    return {
+        "filename": name,
+        "fileSize": 1,
+        "link": {"href": f"https://example.com/{name}", "mediaType": "text/csv"},
+    }
+
+
+@pytest.fixture
+def harvester():
+    harvester = CsiroHarvester()
+    harvester.config = {}
+    return harvester
+
+
+def _pages(*pages, error=None, stop=None):
+    """Fakes the pagination of the file listing. The pagination could fail
+    with the `error` or stop after the `stop` pages, as on the deadline"""
+
+    def paginate(url, get_next_url):
+        for idx, files in enumerate(pages[:stop]):
+            page = {"file": files}
+            if idx < len(pages) - 1:
+                page["next"] = {"href": f"https://example.com/files.json?page={idx}"}
+            yield page
+
+        if error:
+            raise error
+
+    return paginate
+
+
+class TestFetchFiles:
+    def test_complete_listing(self, harvester):
+        harvester._paginate = _pages([_file("a")], [_file("b")])
+
+        files, truncated = harvester._fetch_files("https://example.com/files.json")
+
+        assert [f["filename"] for f in files] == ["a", "b"]
+        assert not truncated
+
+    def test_max_resources(self, harvester):
+        harvester.config = {"max_resources": 1}
+        harvester._paginate = _pages([_file("a"), _file("b")])
+
+        files, truncated = harvester._fetch_files("https://example.com/files.json")
+
+        assert [f["filename"] for f in files] == ["a"]
+        assert truncated
+
+    def test_failed_page(self, harvester):
+        harvester._paginate = _pages([_file("a")], error=SearchError("timeout"))
+
+        files, truncated = harvester._fetch_files("https://example.com/files.json")
+
+        assert [f["filename"] for f in files] == ["a"]
+        assert truncated
+
+    def test_deadline(self, harvester):
+        harvester._paginate = _pages([_file("a")], [_file("b")], stop=1)
+
+        files, truncated = harvester._fetch_files("https://example.com/files.json")
+
+        assert [f["filename"] for f in files] == ["a"]
+        assert truncated
+
+    def test_deadline_before_first_page(self, harvester):
+        harvester._paginate = _pages([_file("a")], stop=0)
+
+        files, truncated = harvester._fetch_files("https://example.com/files.json")
+
+        assert files == []
+        assert truncated
+
+    def test_deadline_after_last_page(self, harvester, monkeypatch):
+        harvester._paginate = _pages([_file("a")], [_file("b")])
+        monkeypatch.setattr(harvester, "_is_gather_deadline_passed", lambda: True)
+
+        _files, truncated = harvester._fetch_files("https://example.com/files.json")
+
+        assert not truncated
+
+
+def test_truncated_listing_adds_manifest(harvester):
+    data = {
+        "data": "https://example.com/files",
+        "files": [_file("a")],
+        CsiroHarvester.TRUNCATED_KEY: True,
+    }
+
+    resources = harvester._get_resources(data)
+
+    assert [r["url"] for r in resources] == [
+        "https://example.com/a",
+        "https://example.com/files.json",
+    ]
+
+
+class TestPrefetch:
+    RECORDS = [
+        {"id": {"identifierType": "url", "identifier": str(idx)}} for idx in range(3)
+    ]
+
+    @pytest.fixture
+    def remote(self, harvester, harvest_job, stub_gather, monkeypatch):
+        """Serves the collections and their file listings. The gathered
+        records are collected as the content of the harvest objects"""
+        remote = SimpleNamespace(requested=[], objects=[])
+        stub_gather(harvester)
+
+        def make_request(url, stream=False):
+            remote.requested.append(url)
+            identifier = url.rsplit("/", 1)[1].split(".")[0]
+            content = {"id": identifier, "data": f"https://example.com/{identifier}"}
+            return SimpleNamespace(content=json.dumps(content).encode())
+
+        def paginate(url, get_next_url, sizer=None):
+            remote.requested.append(url)
+            yield {"file": [_file(url.rsplit("/", 1)[1])]}
+
+        def make_harvest_object(guid, harvest_job, pkg_dict, **kwargs):
+            remote.objects.append(json.loads(json.dumps(pkg_dict)))
+            return SimpleNamespace(id=guid)
+
+        monkeypatch.setattr(
+            harvester, "_search_datasets", lambda url: [dict(r) for r in self.RECORDS]
+        )
+        monkeypatch.setattr(harvester, "_make_request", make_request)
+        monkeypatch.setattr(harvester, "_paginate", paginate)
+        monkeypatch.setattr(harvester, "_make_harvest_object", make_harvest_object)
+        monkeypatch.setattr(harvester, "_track_progress", lambda *args, **kwargs: None)
+        return remote
+
+    def _fetch(self, harvester, harvest_job, content):
+        harvest_object = SimpleNamespace(
+            content=json.dumps(content),
+            source=harvest_job.source,
+            job=harvest_job,
+            harvest_job_id=harvest_job.id,
+            extras=[],
+        )
+        assert harvester.fetch_stage(harvest_object)
+        return json.loads(harvest_object.content)
+
+    def test_prefetched_files_are_used(self, harvester, harvest_job, remote):
+        harvest_job.source.config = '{"concurrency": 3}'
+        harvester.gather_stage(harvest_job)
+        gathered = len(remote.requested)
+
+        metadata = self._fetch(harvester, harvest_job, remote.objects[0])
+
+        assert gathered == 6
+        # the fetch stage makes no requests
+        assert len(remote.requested) == gathered
+        assert [f["filename"] for f in metadata["files"]] == ["0.json"]
+
+    def test_fetch_without_concurrency(self, harvester, harvest_job, remote):
+        harvest_job.source.config = '{"concurrency": 1}'
+        harvester.gather_stage(harvest_job)
+
+        assert remote.requested == []
+        assert all(CsiroHarvester.PREFETCHED_KEY not in obj for obj in remote.objects)
+
+        metadata = self._fetch(harvester, harvest_job, remote.objects[0])
+
+        assert remote.requested == [
+            "https://example.com/collections/0.json",
+            "https://example.com/0.json",
+        ]
+        assert [f["filename"] for f in metadata["files"]] == ["0.json"]
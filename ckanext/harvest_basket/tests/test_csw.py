@@ -0,0 +1,67 @@
+from datetime import datetime
+
+import pytest
+from owslib.fes import PropertyIsGreaterThanOrEqualTo
+
+from ckanext.spatial.lib.csw_client import PropertyIsEqualTo
+from ckanext.harvest_basket.harvesters.csw import BasketCswService
+
+
+class FakeCsw:
+    def __init__(self):
+        self.requests = []
+        self.exceptionreport = None
+        self.records = {}
+        self.results = {"matches": 0}
+
+    def getrecords2(self, **kwargs):
+        self.requests.append(kwargs)
+
+
+@pytest.fixture
+def csw(monkeypatch):
+    csw = FakeCsw()
+    monkeypatch.setattr(BasketCswService, "_ows", lambda self, **kw: csw, raising=False)
+    return csw
+
+
+def _get_identifiers(**kwargs):
+    service = BasketCswService.__new__(BasketCswService)
+    return list(service.getidentifiers(**kwargs))
+
+
+class TestGetIdentifiers:
+    modified_since = datetime(2024, 1, 2, 3, 4, 5)
+
+    def test_full_sweep(self, csw):
+        _get_identifiers()
+
+        assert csw.requests[0]["constraints"] == []
+        assert csw.requests[0]["cql"] is None
+
+    def test_modified_since_constraint(self, csw):
+        _get_identifiers(modified_since=self.modified_since)
+
+        assert csw.requests[0]["constraints"] == [
+            PropertyIsGreaterThanOrEqualTo("apiso:Modified", "2024-01-02T03:04:05Z")
+        ]
+
+    def test_modified_since_is_added_to_cql(self, csw):
+        _get_identifiers(cql="AnyText like '%water%'", modified_since=self.modified_since)
+
+        assert csw.requests[0]["constraints"] == []
+        assert csw.requests[0]["cql"] == (
+            "(AnyText like '%water%') AND Modified >= '2024-01-02T03:04:05Z'"
+        )
+
+    def test_modified_since_is_combined_with_type(self, csw):
+        _get_identifiers(qtype="dataset", modified_since=self.modified_since)
+
+        assert csw.requests[0]["constraints"] == [
+            [
+                PropertyIsEqualTo("dc:type", "dataset"),
+                PropertyIsGreaterThanOrEqualTo(
+                    "apiso:Modified", "2024-01-02T03:04:05Z"
+                ),
+            ]
+        ]
@@ -0,0 +1,115 @@
+import pytest
+import requests
+
+from ckanext.harvest_basket.harvesters import base_harvester
+from ckanext.harvest_basket.harvesters.dcat import BasketDcatJsonHarvester
+from ckanext.harvest_basket.throttle import CircuitOpenError
+
+CATALOG_URL = "https://example.com/data.json"
+
+
+@pytest.fixture
+def harvester(monkeypatch):
+    harvester = BasketDcatJsonHarvester()
+    harvester.config = {"stream_catalog": True, "request_budget": 30}
+    monkeypatch.setattr(harvester, "_is_stream_enabled", lambda: True)
+    return harvester
+
+
+@pytest.fixture
+def errors(harvester, monkeypatch):
+    errors = []
+    monkeypatch.setattr(
+        harvester,
+        "_save_gather_error",
+        lambda message, harvest_job: errors.append(message),
+    )
+    return errors
+
+
+def _respond(monkeypatch, status_code):
+    requested = []
+
+    def request(method, url, **kwargs):
+        requested.append(kwargs)
+        resp = requests.Response()
+        resp.status_code = status_code
+        resp.reason = "Not Found"
+        resp.url = url
+        return resp
+
+    monkeypatch.setattr(base_harvester.requests, "request", request)
+    return requested
+
+
+class TestStreamedCatalog:
+    def test_request_timeout(self, harvester, errors, monkeypatch):
+        requested = _respond(monkeypatch, 200)
+        monkeypatch.setattr(
+            "ckanext.harvest_basket.harvesters.dcat.CatalogStream",
+            lambda resp: resp,
+        )
+
+        content, _ = harvester._get_content_and_type(CATALOG_URL, None)
+
+        assert content is not None
+        assert requested == [{"stream": True, "timeout": 30.0}]
+
+    def test_end_of_pagination(self, harvester, errors, monkeypatch):
+        _respond(monkeypatch, 404)
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            harvester._get_content_and_type(CATALOG_URL, None, page=2)
+        assert not errors
+
+    def test_missing_catalog(self, harvester, errors, monkeypatch):
+        _respond(monkeypatch, 404)
+
+        assert harvester._get_content_and_type(CATALOG_URL, None) == (None, None)
+        assert errors
+
+    def test_connection_error(self, harvester, errors, monkeypatch):
+        def request(method, url, **kwargs):
+            raise requests.exceptions.ConnectionError("refused")
+
+        monkeypatch.setattr(base_harvester.requests, "request", request)
+
+        assert harvester._get_content_and_type(CATALOG_URL, None) == (None, None)
+        assert errors
+
+    def test_open_circuit(self, harvester, errors, monkeypatch):
+        def make_request(url, **kwargs):
+            raise CircuitOpenError("example.com is unavailable")
+
+        monkeypatch.setattr(harvester, "_make_request", make_request)
+
+        assert harvester._get_content_and_type(CATALOG_URL, None) == (None, None)
+        assert errors
+
+
+class TestCatalogFingerprint:
+    def _respond(self, monkeypatch, headers):
+        requested = []
+
+        def request(method, url, **kwargs):
+            requested.append(method)
+            resp = requests.Response()
+            resp.status_code = 200
+            resp.headers.update(headers)
+            return resp
+
+        monkeypatch.setattr(base_harvester.requests, "request", request)
+        return requested
+
+    def test_validators(self, harvester, monkeypatch):
+        requested = self._respond(
+            monkeypatch, {"ETag": '"abc"', "Content-Length": "120"}
+        )
+
+        assert harvester._get_catalog_fingerprint(CATALOG_URL) == '"abc":120'
+        assert requested == ["HEAD"]
+
+    def test_no_validators(self, harvester, monkeypatch):
+        self._respond(monkeypatch, {"Content-Length": "120"})
+
+        assert harvester._get_catalog_fingerprint(CATALOG_URL) is None
@@ -0,0 +1,110 @@
+import json
+from types import SimpleNamespace
+from urllib import parse
+
+import pytest
+
+import ckan.plugins.toolkit as tk
+
+from ckanext.harvest_basket.harvesters.dkan_harvester import DKANHarvester
+from ckanext.harvest_basket.throttle import CircuitOpenError
+
+PACKAGE_NAMES = ["a", "b", "c", "d"]
+
+
+@pytest.fixture
+def harvester():
+    return DKANHarvester()
+
+
+def _serve(harvester, monkeypatch, broken=()):
+    """Serves the package list and the datasets. The `broken` maps dataset
+    names to the content of their response, None for a failed request"""
+
+    def make_request(url, stream=False):
+        name = parse.parse_qs(parse.urlparse(url).query)["id"][0]
+        if name not in broken:
+            content = json.dumps({"result": {"id": name, "name": name}})
+            return SimpleNamespace(content=content.encode())
+        if isinstance(broken[name], Exception):
+            raise broken[name]
+        return broken[name] and SimpleNamespace(content=broken[name])
+
+    monkeypatch.setattr(
+        harvester,
+        "_get_package_names",
+        lambda url: json.dumps({"result": PACKAGE_NAMES}),
+    )
+    monkeypatch.setattr(harvester, "_make_request", make_request)
+
+
+def test_complete_gather_withdraws_missing(
+    harvester, harvest_job, stub_gather, monkeypatch
+):
+    calls = stub_gather(harvester)
+    _serve(harvester, monkeypatch)
+
+    object_ids = harvester.gather_stage(harvest_job)
+
+    assert sorted(object_ids) == PACKAGE_NAMES
+    assert calls.withdrawn
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        None,
+        b"<html>",
+        b'{"success": false, "error": {"message": "Not found"}}',
+        tk.ValidationError({"DKAN": "Bad response from remote portal: 500"}),
+    ],
+)
+def test_failed_dataset_keeps_missing(
+    harvester, harvest_job, stub_gather, monkeypatch, response
+):
+    calls = stub_gather(harvester)
+    _serve(harvester, monkeypatch, {"b": response})
+
+    object_ids = harvester.gather_stage(harvest_job)
+
+    assert sorted(object_ids) == ["a", "c", "d"]
+    assert calls.errors
+    assert not calls.withdrawn
+
+
+def test_open_circuit_stops_search(harvester, harvest_job, stub_gather, monkeypatch):
+    requested = []
+
+    def make_request(url, stream=False):
+        requested.append(url)
+        if len(requested) > 1:
+            raise CircuitOpenError("example.com is unavailable")
+        name = parse.parse_qs(parse.urlparse(url).query)["id"][0]
+        content = json.dumps({"result": {"id": name, "name": name}})
+        return SimpleNamespace(content=content.encode())
+
+    calls = stub_gather(harvester)
+    _serve(harvester, monkeypatch)
+    monkeypatch.setattr(harvester, "_make_request", make_request)
+
+    object_ids = harvester.gather_stage(harvest_job)
+
+    # the dataset fetched before the circuit was opened is kept
+    assert len(object_ids) == 1
+    assert len(requested) == 2
+    assert calls.errors
+    assert not calls.withdrawn
+
+
+def test_open_circuit_fails_package_list(
+    harvester, harvest_job, stub_gather, monkeypatch
+):
+    def make_request(url, stream=False):
+        raise CircuitOpenError("example.com is unavailable")
+
+    calls = stub_gather(harvester)
+    monkeypatch.setattr(harvester, "_make_request", make_request)
+
+    assert harvester.gather_stage(harvest_job) == []
+    assert calls.errors
+    assert not calls.withdrawn
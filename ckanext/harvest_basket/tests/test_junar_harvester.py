@@ -0,0 +1,92 @@
+import json
+from types import SimpleNamespace
+from urllib import parse
+
+import pytest
+
+from ckanext.harvest.harvesters.ckanharvester import SearchError
+from ckanext.harvest_basket.harvesters.junar_harvester import JunarHarvester
+
+SOURCE_URL = "https://example.com"
+
+
+@pytest.fixture
+def harvester():
+    harvester = JunarHarvester()
+    harvester.config = {"auth_key": "key", "concurrency": 3}
+    harvester.PAGE_SIZE = 20
+    return harvester
+
+
+def _serve(harvester, monkeypatch, guids, shifted_offset=None):
+    """Serves the datastreams by `limit` and `offset` of the request. The
+    catalog is shifted by one dataset for the pages starting from the
+    `shifted_offset`, as if a new dataset was published during the gather"""
+    requested = []
+
+    def make_page_request(url, sizer=None):
+        query = parse.parse_qs(parse.urlparse(url).query)
+        limit = int(query["limit"][0])
+        offset = int(query["offset"][0])
+        requested.append((offset, limit))
+
+        items = guids
+        if shifted_offset is not None and offset >= shifted_offset:
+            items = ["new"] + guids
+
+        results = [
+            {"guid": guid, "title": guid} for guid in items[offset : offset + limit]
+        ]
+        content = json.dumps({"results": results, "count": len(items)})
+        return SimpleNamespace(content=content.encode())
+
+    monkeypatch.setattr(harvester, "_make_page_request", make_page_request)
+    return requested
+
+
+def _guids(pkg_dicts):
+    return [pkg["guid"] for pkg in pkg_dicts]
+
+
+def test_windows_are_stitched_in_order(harvester, monkeypatch):
+    guids = [f"id-{idx:03}" for idx in range(95)]
+    requested = _serve(harvester, monkeypatch, guids)
+
+    pkg_dicts = harvester._search_datasets(SOURCE_URL)
+
+    assert _guids(pkg_dicts) == guids
+    # the first page alone, then the windows of 3 pages up to the total
+    assert sorted(requested) == [(offset, 20) for offset in range(0, 100, 20)]
+
+
+def test_duplicates_across_windows(harvester, monkeypatch):
+    guids = [f"id-{idx:03}" for idx in range(60)]
+    _serve(harvester, monkeypatch, guids, shifted_offset=40)
+
+    pkg_dicts = harvester._search_datasets(SOURCE_URL)
+
+    # the last dataset of the second page is served again on the third one
+    assert _guids(pkg_dicts) == guids
+    assert len(set(_guids(pkg_dicts))) == len(pkg_dicts)
+
+
+@pytest.mark.parametrize(
+    "max_datasets, pages",
+    [(5, [(0, 5)]), (30, [(0, 20), (20, 20)])],
+)
+def test_max_datasets(harvester, monkeypatch, max_datasets, pages):
+    harvester.config["max_datasets"] = max_datasets
+    guids = [f"id-{idx:03}" for idx in range(100)]
+    requested = _serve(harvester, monkeypatch, guids)
+
+    pkg_dicts = harvester._search_datasets(SOURCE_URL)
+
+    assert _guids(pkg_dicts) == guids[:max_datasets]
+    assert sorted(requested) == pages
+
+
+def test_missing_auth_key(harvester):
+    harvester.config = {}
+
+    with pytest.raises(SearchError):
+        harvester._search_datasets(SOURCE_URL)
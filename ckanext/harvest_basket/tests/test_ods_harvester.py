@@ -0,0 +1,213 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import ckan.plugins.toolkit as tk
+
+from ckanext.harvest.harvesters.ckanharvester import ContentFetchError, SearchError
+from ckanext.harvest_basket.harvesters import ods_harvester
+from ckanext.harvest_basket.harvesters.ods_harvester import ODSHarvester
+
+EXPORT_LINKS = b"""{"links": [
+    {"rel": "self", "href": "https://example.com/exports"},
+    {"rel": "csv", "href": "https://example.com/exports/csv"}
+]}"""
+
+
+@pytest.fixture
+def harvester():
+    harvester = ODSHarvester()
+    harvester.config = {}
+    return harvester
+
+
+def _respond(harvester, content):
+    response = SimpleNamespace(content=content) if content is not None else None
+    harvester._make_request = lambda url, stream=False: response
+
+
+class TestCatalogParams:
+    def test_defaults(self, harvester):
+        assert harvester._get_catalog_params() == {
+            "include_app_metas": False,
+            "select": "dataset_id,metas,attachments",
+        }
+
+    def test_include_app_metas(self, harvester):
+        harvester.config = {"include_app_metas": "true"}
+
+        params = harvester._get_catalog_params()
+
+        assert params["include_app_metas"] is True
+        assert params["select"] == "dataset_id,metas,attachments"
+
+    def test_required_fields_are_selected(self, harvester):
+        harvester.config = {"fields": "features", "include_app_metas": True}
+
+        assert harvester._get_catalog_params() == {
+            "include_app_metas": True,
+            "select": "features,dataset_id,metas",
+        }
+
+    def test_all_fields(self, harvester):
+        harvester.config = {"fields": []}
+
+        assert "select" not in harvester._get_catalog_params()
+
+
+class TestExportLinks:
+    def test_links(self, harvester):
+        _respond(harvester, EXPORT_LINKS)
+
+        links = harvester._get_all_resource_urls("https://example.com/exports")
+
+        assert links == [{"rel": "csv", "href": "https://example.com/exports/csv"}]
+
+    def test_failed_request(self, harvester):
+        _respond(harvester, None)
+
+        assert harvester._get_all_resource_urls("https://example.com/exports") is None
+
+    def test_corrupted_response(self, harvester):
+        _respond(harvester, b"<html>")
+
+        assert harvester._get_all_resource_urls("https://example.com/exports") is None
+
+    def test_failed_prefetch_is_not_stored(self, harvester):
+        _respond(harvester, None)
+        pkg_dicts = [{"dataset": {"dataset_id": "a"}}]
+
+        harvester._prefetch_export_links("https://example.com", pkg_dicts)
+
+        assert ODSHarvester.EXPORT_LINKS_KEY not in pkg_dicts[0]
+
+    def test_fetch_fails_without_links(self, harvester):
+        _respond(harvester, None)
+        package_dict = {
+            "dataset": {"dataset_id": "a", "metas": {"default": {}}},
+            "links": [{"rel": "self", "href": "https://example.com/a"}],
+        }
+
+        with pytest.raises(ContentFetchError):
+            harvester._pre_map_stage(package_dict, "https://example.com")
+
+
+def test_failed_search_keeps_saved_objects(
+    harvester, harvest_job, stub_gather, monkeypatch
+):
+    def iter_datasets(source_url):
+        for idx in range(3):
+            metas = {"default": {"title": f"Dataset {idx}"}}
+            yield {"dataset": {"dataset_id": f"id-{idx}", "metas": metas}}
+        raise SearchError("timeout")
+
+    calls = stub_gather(harvester)
+    monkeypatch.setattr(harvester, "GATHER_BATCH_SIZE", 2)
+    monkeypatch.setattr(harvester, "_iter_datasets", iter_datasets)
+    monkeypatch.setattr(harvester, "_prefetch_export_links", lambda *args: None)
+
+    object_ids = harvester.gather_stage(harvest_job)
+
+    # the first batch is saved before the search failed
+    assert object_ids == ["id-0", "id-1"]
+    assert calls.errors
+    assert not calls.withdrawn
+
+
+def test_checkup_fails_without_export_links(harvester, monkeypatch):
+    metas = {"default": {"title": "Dataset"}}
+    pkg_dict = {
+        "dataset": {"dataset_id": "a", "metas": metas},
+        "links": [{"rel": "self", "href": "https://example.com/a"}],
+    }
+    monkeypatch.setattr(harvester, "_search_datasets", lambda source_url: [pkg_dict])
+    _respond(harvester, None)
+
+    with pytest.raises(tk.ValidationError, match="Checkup failed"):
+        harvester.make_checkup("https://example.com", "ods", {})
+
+
+class TestExportFallback:
+    @pytest.fixture
+    def catalog(self, harvester, monkeypatch):
+        """The export fails after 3 datasets, the paged search returns all
+        of them by pages of 4"""
+        datasets = [{"dataset_id": f"id-{idx}", "metas": {}} for idx in range(10)]
+
+        def export(stream, prefix):
+            yield from datasets[:3]
+            raise ValueError("connection reset")
+
+        def paginate(url, get_next_url, sizer=None):
+            for start in range(0, len(datasets), 4):
+                page = datasets[start : start + 4]
+                yield {"datasets": [{"dataset": pkg} for pkg in page]}
+
+        harvester.config = {"catalog_export": True}
+        monkeypatch.setattr(harvester, "_is_catalog_export_enabled", lambda: True)
+        monkeypatch.setattr(
+            harvester,
+            "_make_request",
+            lambda url, stream=False: SimpleNamespace(close=lambda: None),
+        )
+        monkeypatch.setattr(ods_harvester, "open_json_stream", lambda resp: resp)
+        monkeypatch.setattr(ods_harvester, "iter_json_items", export)
+        monkeypatch.setattr(harvester, "_paginate", paginate)
+
+    def _ids(self, harvester):
+        return [
+            pkg["dataset"]["dataset_id"]
+            for pkg in harvester._iter_datasets("https://example.com")
+        ]
+
+    def test_exported_datasets_are_skipped(self, harvester, catalog):
+        ids = self._ids(harvester)
+
+        assert ids == [f"id-{idx}" for idx in range(10)]
+
+    def test_max_datasets(self, harvester, catalog):
+        harvester.config["max_datasets"] = 5
+
+        ids = self._ids(harvester)
+
+        assert ids == [f"id-{idx}" for idx in range(5)]
+
+
+class TestCatalogFingerprint:
+    def _respond(self, harvester, monkeypatch, data):
+        requested = []
+
+        def make_page_request(url):
+            requested.append(url)
+            return SimpleNamespace(content=json.dumps(data).encode())
+
+        monkeypatch.setattr(harvester, "_make_page_request", make_page_request)
+        return requested
+
+    def test_single_request(self, harvester, monkeypatch):
+        requested = self._respond(
+            harvester,
+            monkeypatch,
+            {
+                "aggregations": [
+                    {
+                        "count": 3,
+                        "modified": "2024-01-01",
+                        "data_processed": "2024-01-02",
+                        "metadata_processed": "2024-01-03",
+                    }
+                ]
+            },
+        )
+
+        fingerprint = harvester._get_catalog_fingerprint("https://example.com")
+
+        assert fingerprint == "3:2024-01-01:2024-01-02:2024-01-03"
+        assert len(requested) == 1
+        assert requested[0].startswith("https://example.com/api/v2/catalog/aggregates?")
+
+    def test_empty_catalog(self, harvester, monkeypatch):
+        self._respond(harvester, monkeypatch, {"aggregations": [{"count": 0}]})
+
+        assert harvester._get_catalog_fingerprint("https://example.com") is None
@@ -0,0 +1,299 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import fakeredis
+import pytest
+
+from ckanext.harvest_basket import throttle
+from ckanext.harvest_basket.throttle import (
+    CircuitBreaker,
+    PageSizer,
+    RateLimiter,
+    RetryBudget,
+    SharedTokenBucket,
+    get_backoff_delay,
+    parse_retry_after,
+)
+
+
+class FakeTime:
+    """Clock of the throttling primitives, that advances only on sleep"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(throttle, "time", clock)
+    return clock
+
+
+class TestParseRetryAfter:
+    @pytest.mark.parametrize("value", [None, "", "soon", "-1"])
+    def test_invalid(self, value):
+        assert parse_retry_after(value) is None
+
+    def test_seconds(self):
+        assert parse_retry_after(" 120 ") == 120.0
+
+    def test_date(self):
+        date = datetime.now(timezone.utc) + timedelta(seconds=60)
+        assert 55 < parse_retry_after(format_datetime(date, usegmt=True)) <= 60
+
+    def test_past_date(self):
+        date = datetime.now(timezone.utc) - timedelta(seconds=60)
+        assert parse_retry_after(format_datetime(date, usegmt=True)) == 0
+
+
+class TestBackoffDelay:
+    @pytest.mark.parametrize("attempt", range(5))
+    def test_exponential_with_jitter(self, attempt):
+        delay = 2**attempt
+        assert delay / 2 <= get_backoff_delay(attempt) <= delay
+
+    def test_cap(self):
+        assert get_backoff_delay(20, cap=10) <= 10
+
+
+class TestRetryBudget:
+    def test_limited(self):
+        budget = RetryBudget(2)
+
+        assert budget.spend()
+        assert budget.spend()
+        assert not budget.spend()
+
+    def test_unlimited(self):
+        budget = RetryBudget(0)
+        assert all(budget.spend() for _ in range(100))
+
+
+class TestPageSizer:
+    def _observe(self, sizer, elapsed, size=1024, pages=3):
+        for _ in range(pages):
+            sizer.observe(elapsed, size)
+
+    def test_grows_without_history(self):
+        sizer = PageSizer(10, 1000, 100)
+        self._observe(sizer, 1.0)
+
+        assert sizer.adjust() == 150
+        assert sizer.per_record == 0.01
+
+    def test_grows_while_per_record_time_is_the_same(self):
+        sizer = PageSizer(10, 1000, 150, per_record=0.01)
+        self._observe(sizer, 1.5)
+
+        assert sizer.adjust() == 225
+
+    def test_steps_back_when_per_record_time_is_worse(self):
+        sizer = PageSizer(10, 1000, 150, per_record=0.01)
+        self._observe(sizer, 3.0)
+
+        assert sizer.adjust() == 100
+
+    def test_shrinks_slow_pages(self):
+        sizer = PageSizer(10, 1000, 100)
+        self._observe(sizer, PageSizer.MAX_PAGE_SECONDS + 1)
+
+        assert sizer.adjust() == 67
+
+    def test_shrinks_big_pages(self):
+        sizer = PageSizer(10, 1000, 100)
+        self._observe(sizer, 1.0, PageSizer.MAX_PAGE_BYTES + 1)
+
+        assert sizer.adjust() == 67
+
+    def test_halved_after_failure(self):
+        sizer = PageSizer(10, 1000, 100, per_record=0.01)
+        self._observe(sizer, 1.0)
+        sizer.fail()
+
+        assert sizer.adjust() == 50
+        assert sizer.per_record is None
+
+    def test_kept_without_enough_observations(self):
+        sizer = PageSizer(10, 1000, 100)
+        self._observe(sizer, 1.0, pages=PageSizer.MIN_OBSERVATIONS - 1)
+
+        assert sizer.adjust() == 100
+
+    def test_clamped(self):
+        sizer = PageSizer(10, 120, 100)
+        self._observe(sizer, 1.0)
+
+        assert sizer.adjust() == 120
+        assert PageSizer(10, 120, 5).size == 10
+
+    def test_state(self):
+        sizer = PageSizer(10, 1000, 100, per_record=0.01)
+        restored = PageSizer.from_state(sizer.get_state(), 10, 1000, 50)
+
+        assert restored.get_state() == {"size": 100, "per_record": 0.01}
+        assert PageSizer.from_state(None, 10, 1000, 50).size == 50
+
+
+class TestRateLimiter:
+    def test_spaces_requests(self, clock):
+        limiter = RateLimiter(2)
+
+        assert [limiter.acquire() for _ in range(3)] == [0, 0.5, 0.5]
+        assert clock.now == 1001.0
+
+    def test_idle_time_is_not_accumulated(self, clock):
+        limiter = RateLimiter(2)
+        limiter.acquire()
+        clock.now += 10
+
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == 0.5
+
+    def test_throttle_halves_rate(self, clock):
+        limiter = RateLimiter(4, min_rate=1)
+
+        limiter.on_throttle()
+        assert limiter.rate == 2
+        limiter.on_throttle()
+        limiter.on_throttle()
+        assert limiter.rate == 1
+
+    def test_retry_after_pauses_requests(self, clock):
+        limiter = RateLimiter(4)
+        limiter.on_throttle(retry_after=30)
+
+        assert limiter.acquire() == 30
+
+    def test_success_recovers_rate(self, clock):
+        limiter = RateLimiter(4, min_rate=2)
+        limiter.on_throttle()
+
+        for _ in range(RateLimiter.RECOVERY_STEPS - 1):
+            limiter.on_success()
+        assert 2 < limiter.rate < 4
+
+        limiter.on_success()
+        limiter.on_success()
+        assert limiter.rate == 4
+
+
+class TestSharedTokenBucket:
+    @pytest.fixture
+    def redis(self):
+        return fakeredis.FakeRedis()
+
+    def test_burst(self, clock, redis):
+        bucket = SharedTokenBucket(redis, "bucket", rate=2, burst=2)
+
+        assert [bucket.acquire() for _ in range(4)] == [0, 0, 0.5, 0.5]
+        assert clock.now == 1001.0
+
+    def test_refill(self, clock, redis):
+        bucket = SharedTokenBucket(redis, "bucket", rate=2, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        clock.now += 10
+
+        # the refill is limited by the burst
+        assert [bucket.acquire() for _ in range(3)] == [0, 0, 0.5]
+
+    def test_shared_between_workers(self, clock, redis):
+        first = SharedTokenBucket(redis, "bucket", rate=1, burst=1)
+        second = SharedTokenBucket(redis, "bucket", rate=1, burst=1)
+
+        assert first.acquire() == 0
+        assert second.acquire() == 1.0
+
+    def test_clock_skew_does_not_refill(self, clock, redis):
+        bucket = SharedTokenBucket(redis, "bucket", rate=1, burst=1)
+        bucket.acquire()
+        # a worker, that is a minute behind
+        clock.now -= 60
+
+        assert bucket.acquire() == 1.0
+
+    def test_expires(self, clock, redis):
+        bucket = SharedTokenBucket(redis, "bucket", rate=1, burst=2)
+        bucket.acquire()
+
+        assert 0 < redis.pttl("bucket") <= 2000
+
+
+class TestCircuitBreaker:
+    @pytest.fixture
+    def changes(self):
+        return []
+
+    @pytest.fixture
+    def breaker(self, clock, changes):
+        return CircuitBreaker(
+            3, window=60, cooldown=30, on_change=lambda *change: changes.append(change)
+        )
+
+    def _fail(self, breaker, times):
+        for _ in range(times):
+            breaker.record_failure()
+
+    def test_opens_after_threshold(self, breaker, changes):
+        self._fail(breaker, 2)
+        assert breaker.allow()
+
+        breaker.record_failure()
+        assert not breaker.allow()
+        assert changes == [("closed", "open")]
+        assert breaker.get_retry_in() == 30
+
+    def test_success_resets_failures(self, breaker):
+        self._fail(breaker, 2)
+        breaker.record_success()
+        self._fail(breaker, 2)
+
+        assert breaker.allow()
+
+    def test_failures_out_of_window(self, breaker, clock):
+        self._fail(breaker, 2)
+        clock.now += 61
+        breaker.record_failure()
+
+        assert breaker.allow()
+
+    def test_probe_closes_circuit(self, breaker, clock, changes):
+        self._fail(breaker, 3)
+        clock.now += 30
+
+        assert breaker.allow()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        breaker.record_success()
+
+        assert breaker.allow()
+        assert changes[-1] == ("half-open", "closed")
+
+    def test_failed_probe_opens_circuit(self, breaker, clock):
+        self._fail(breaker, 3)
+        clock.now += 30
+        breaker.allow()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+
+    def test_lost_probe_is_repeated(self, breaker, clock):
+        self._fail(breaker, 3)
+        clock.now += 30
+        assert breaker.allow()
+        assert not breaker.allow()
+
+        clock.now += 30
+        assert breaker.allow()
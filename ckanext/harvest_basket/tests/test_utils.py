@@ -0,0 +1,175 @@
+import codecs
+import io
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+from ckanext.harvest_basket import utils
+from ckanext.harvest_basket.utils import (
+    find_regressions,
+    get_job_progress,
+    get_memory_usage,
+    is_streaming_available,
+    iter_json_items,
+    open_json_stream,
+    prune_fields,
+    track_job_progress,
+)
+
+
+def _response(body: bytes):
+    return SimpleNamespace(raw=io.BytesIO(body))
+
+
+@pytest.mark.skipif(not is_streaming_available(), reason="requires ijson")
+class TestIterJsonItems:
+    def test_top_level_array(self):
+        stream = io.BytesIO(b'[{"id": 1}, {"id": 2}]')
+        assert list(iter_json_items(stream, "item")) == [{"id": 1}, {"id": 2}]
+
+    def test_nested_array(self):
+        stream = io.BytesIO(b'{"@type": "dcat:Catalog", "dataset": [{"id": 1}]}')
+        assert list(iter_json_items(stream, "dataset.item")) == [{"id": 1}]
+
+    def test_numbers_are_floats(self):
+        # not Decimals, that can't be serialized into the object content
+        item = next(iter_json_items(io.BytesIO(b"[1.5]"), "item"))
+        assert type(item) is float
+
+    def test_corrupted_document(self):
+        stream = io.BytesIO(b'[{"id": 1}, {"id"')
+        items = iter_json_items(stream, "item")
+
+        assert next(items) == {"id": 1}
+        with pytest.raises(ValueError):
+            next(items)
+
+
+class TestOpenJsonStream:
+    def test_bom_is_skipped(self):
+        resp = _response(codecs.BOM_UTF8 + b"[]")
+        assert open_json_stream(resp).read() == b"[]"
+
+    def test_plain_body(self):
+        resp = _response(b'{"dataset": []}')
+        assert open_json_stream(resp).read() == b'{"dataset": []}'
+
+
+class TestPruneFields:
+    def test_top_level_field(self):
+        data = {"id": 1, "bulky": "x"}
+
+        assert prune_fields(data, "bulky") == ["x"]
+        assert data == {"id": 1}
+
+    def test_list_items(self):
+        data = {"columns": [{"name": "a", "cache": 1}, {"name": "b"}, "c"]}
+
+        assert prune_fields(data, "columns.*.cache") == [1]
+        assert data == {"columns": [{"name": "a"}, {"name": "b"}, "c"]}
+
+    def test_dict_values(self):
+        data = {"metas": {"default": {"x": 1}, "dcat": {"x": 2, "y": 3}}}
+
+        assert prune_fields(data, "metas.*.x") == [1, 2]
+        assert data == {"metas": {"default": {}, "dcat": {"y": 3}}}
+
+    def test_missing_path(self):
+        data = {"dataset": {"fields": []}}
+
+        assert prune_fields(data, "metadata.renderTypeConfig") == []
+        assert prune_fields(data, "dataset.fields.*.x") == []
+        assert data == {"dataset": {"fields": []}}
+
+
+class TestFindRegressions:
+    def _job(self, **summary):
+        return {"objects": 100, "duration": 600, "error_rate": 0.0, **summary}
+
+    @pytest.fixture
+    def baseline(self):
+        return [self._job(duration=duration) for duration in (500, 600, 700)]
+
+    def test_slower_job(self, baseline):
+        regressions = find_regressions(self._job(duration=1000), baseline, 0.5)
+
+        assert regressions == {
+            "duration": {"value": 1000, "baseline": 600, "change": 0.67}
+        }
+
+    def test_change_below_threshold(self, baseline):
+        assert find_regressions(self._job(duration=800), baseline, 0.5) == {}
+
+    def test_faster_job(self, baseline):
+        assert find_regressions(self._job(duration=100), baseline, 0.5) == {}
+
+    def test_change_within_noise(self):
+        baseline = [self._job(duration=10)] * 3
+
+        assert find_regressions(self._job(duration=60), baseline, 0.5) == {}
+
+    def test_lower_rate(self, baseline):
+        for job in baseline:
+            job["objects_per_second"] = 10
+
+        regressions = find_regressions(
+            self._job(objects_per_second=2), baseline, 0.5
+        )
+
+        assert regressions["objects_per_second"]["change"] == 0.8
+
+    def test_errors_of_error_free_source(self, baseline):
+        regressions = find_regressions(self._job(error_rate=0.2), baseline, 0.5)
+
+        assert regressions["error_rate"] == {
+            "value": 0.2,
+            "baseline": 0.0,
+            "change": None,
+        }
+
+    def test_short_baseline(self, baseline):
+        assert find_regressions(self._job(duration=1000), baseline[:2], 0.5) == {}
+
+    def test_empty_jobs_are_ignored(self, baseline):
+        empty = self._job(objects=0, duration=1)
+
+        assert find_regressions(empty, baseline, 0.5) == {}
+        assert find_regressions(
+            self._job(duration=1000), baseline[:2] + [empty] * 3, 0.5
+        ) == {}
+
+
+class TestJobProgress:
+    @pytest.fixture(autouse=True)
+    def redis(self, monkeypatch):
+        redis = fakeredis.FakeRedis()
+        monkeypatch.setattr(utils, "connect_to_redis", lambda: redis)
+        return redis
+
+    def test_counts(self):
+        assert track_job_progress("job", {"fetched": 2}, {"requests": 3}) == {
+            "fetched": 2
+        }
+        assert track_job_progress("job", {"fetched": 1}) == {"fetched": 3}
+
+        progress = get_job_progress("job")
+        assert progress["fetched"] == 3
+        assert progress["requests"] == 3
+        assert "fetched_started" in progress
+
+    def test_maxima(self):
+        track_job_progress("job", {"fetched": 1}, maxima={"peak_memory": 200})
+        track_job_progress("job", {"fetched": 1}, maxima={"peak_memory": 100})
+
+        assert get_job_progress("job")["peak_memory"] == 200
+
+        track_job_progress("job", {"fetched": 1}, maxima={"peak_memory": 300})
+
+        assert get_job_progress("job")["peak_memory"] == 300
+
+
+def test_memory_usage():
+    memory = get_memory_usage()
+
+    assert memory is None or memory > 0
@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Optional
+
+
+# responses worth to retry, the rest of errors won't go away on their own
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# responses of the overloaded remote host, that slow down the rate limiter
+THROTTLE_STATUSES = frozenset({429, 503})
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses the `Retry-After` header, that could be either a number of
+    seconds or an HTTP date
+
+    Args:
+        value (Optional[str]): header value
+
+    Returns:
+        Optional[float]: number of seconds to wait or None if the header is
+                         missing or malformed
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def get_backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with jitter. The jitter prevents the concurrent
+    requests, failed at the same moment, from retrying at the same moment too.
+
+    Args:
+        attempt (int): zero-based number of the failed attempt
+        base (float, optional): delay after the first failure. Defaults to 1.0.
+        cap (float, optional): maximum delay. Defaults to 60.0.
+
+    Returns:
+        float: number of seconds to wait
+    """
+    delay = min(cap, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RetryBudget:
+    """Limits the total number of retries, so a dead remote portal fails the
+    harvest job quickly, instead of retrying every page of it. Shared between
+    the threads of the job.
+
+    Args:
+        max_failures (int): number of allowed retries, 0 means unlimited
+    """
+
+    def __init__(self, max_failures: int):
+        self.max_failures = max_failures
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def spend(self) -> bool:
+        """Takes a retry from the budget
+
+        Returns:
+            bool: False if the budget is exhausted
+        """
+        with self._lock:
+            if self.max_failures and self.failures >= self.max_failures:
+                return False
+
+            self.failures += 1
+            return True
+
+
+class PageSizer:
+    """Learns the page size of the remote search API between the harvest
+    jobs. The size is fixed during the job, because most of the portals
+    paginate by the page number, and it's adjusted at the end of the job
+    using the observed response time and payload size of the pages:
+
+    - it's halved, if any page request failed with timeout or server error
+    - it's reduced, if the pages are too slow or too big
+    - it grows while the response time per record doesn't get worse
+    - it steps back, if the response time per record became worse
+
+    The observations are thread-safe, pages could be fetched concurrently.
+
+    Args:
+        min_size (int): lower bound of the page size
+        max_size (int): upper bound of the page size
+        size (int): current page size
+        per_record (Optional[float], optional): response time per record,
+            observed with the previous size. Defaults to None.
+    """
+
+    GROWTH = 1.5
+    # tolerance to the noise of response time between the jobs
+    TOLERANCE = 1.1
+    MAX_PAGE_SECONDS = 30.0
+    MAX_PAGE_BYTES = 16 * 1024 * 1024
+    # a single page tells nothing about the pagination
+    MIN_OBSERVATIONS = 2
+
+    def __init__(
+        self,
+        min_size: int,
+        max_size: int,
+        size: int,
+        per_record: Optional[float] = None,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = self._clamp(size)
+        self.per_record = per_record
+        self.failures = 0
+        self._elapsed: list[float] = []
+        self._bytes: list[int] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_state(
+        cls, state: Optional[dict[str, Any]], min_size: int, max_size: int, size: int
+    ) -> PageSizer:
+        """Restores the sizer from the state, stored by the previous job
+
+        Args:
+            state (Optional[dict[str, Any]]): result of `get_state`
+            min_size (int): lower bound of the page size
+            max_size (int): upper bound of the page size
+            size (int): initial page size, if there is no state
+
+        Returns:
+            PageSizer: page sizer
+        """
+        if not state:
+            return cls(min_size, max_size, size)
+
+        return cls(min_size, max_size, state["size"], state.get("per_record"))
+
+    def get_state(self) -> dict[str, Any]:
+        return {"size": self.size, "per_record": self.per_record}
+
+    def observe(self, elapsed: float, size: int):
+        """Records a successful page request
+
+        Args:
+            elapsed (float): response time in seconds
+            size (int): payload size in bytes
+        """
+        with self._lock:
+            self._elapsed.append(elapsed)
+            self._bytes.append(size)
+
+    def fail(self):
+        """Records a page request failed with timeout or server error"""
+        with self._lock:
+            self.failures += 1
+
+    def adjust(self) -> int:
+        """Chooses the page size for the next job
+
+        Returns:
+            int: new page size
+        """
+        with self._lock:
+            if self.failures:
+                self.size = self._clamp(self.size // 2)
+                self.per_record = None
+                return self.size
+
+            if len(self._elapsed) < self.MIN_OBSERVATIONS:
+                return self.size
+
+            elapsed = statistics.median(self._elapsed)
+            payload = statistics.median(self._bytes)
+            per_record = elapsed / self.size
+
+            if elapsed > self.MAX_PAGE_SECONDS or payload > self.MAX_PAGE_BYTES:
+                size = self.size / self.GROWTH
+            elif (
+                self.per_record is None
+                or per_record <= self.per_record * self.TOLERANCE
+            ):
+                size = self.size * self.GROWTH
+            else:
+                size = self.size / self.GROWTH
+
+            self.size = self._clamp(round(size))
+            self.per_record = per_record
+            return self.size
+
+    def _clamp(self, size: int) -> int:
+        return max(self.min_size, min(self.max_size, size))
+
+
+class RateLimiter:
+    """Spaces the requests to a remote host evenly in time. The rate is
+    adjusted by AIMD: it's halved, when the host responds with 429 or 503,
+    and it grows back by a small step after each successful response, up to
+    the configured rate. The `Retry-After` header of such response pauses
+    all the requests to the host. Shared between the threads.
+
+    Args:
+        max_rate (float): requests per second, the limiter starts with
+        min_rate (float, optional): the lowest rate. Defaults to 0.1.
+    """
+
+    # number of successful responses to recover from the rate halving
+    RECOVERY_STEPS = 20
+
+    def __init__(self, max_rate: float, min_rate: float = 0.1):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Waits for the next request slot
+
+        Returns:
+            float: number of seconds spent waiting
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1 / self.rate
+
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def on_success(self):
+        """Additive increase after a successful response"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                step = (self.max_rate - self.min_rate) / self.RECOVERY_STEPS
+                self.rate = min(self.max_rate, self.rate + step)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Multiplicative decrease after 429 or 503 response
+
+        Args:
+            retry_after (Optional[float], optional): seconds to pause all the
+                requests, from the `Retry-After` header. Defaults to None.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+            pause = 1 / self.rate
+            if retry_after is not None:
+                pause = max(pause, retry_after)
+
+            self._next = max(self._next, time.monotonic() + pause)
+
+
+# refills the bucket by the time passed since the last request and reserves
+# a token. The balance could go negative, so concurrent requests are queued
+# instead of racing for the next token. The time is passed by the worker:
+# Redis below 3.2 refuses writes after the non-deterministic TIME command.
+# The stored time never goes back, so a clock skew between the nodes only
+# delays the refill. HMSET is used, because HSET takes a single field
+# before Redis 4
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2])
+local now = math.max(tonumber(ARGV[3]), ts or 0)
+ts = ts or now
+
+tokens = math.min(burst, tokens + (now - ts) * rate) - 1
+redis.call("HMSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+
+if tokens >= 0 then
+    return "0"
+end
+return tostring(-tokens / rate)
+"""
+
+
+class SharedTokenBucket:
+    """Token bucket stored in Redis, that limits the total rate of requests
+    to a remote host made by all the harvest workers. Idle workers don't
+    consume tokens, so the rest of them could use the whole rate.
+
+    Args:
+        redis (Redis): Redis client
+        key (str): key of the bucket
+        rate (float): requests per second
+        burst (float): bucket capacity, number of requests that could be
+                       made at once after the idle period
+    """
+
+    def __init__(self, redis: Any, key: str, rate: float, burst: float):
+        self.key = key
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self) -> float:
+        """Reserves a token and waits for it
+
+        Returns:
+            float: number of seconds spent waiting
+        """
+        delay = float(
+            self._script(keys=[self.key], args=[self.rate, self.burst, time.time()])
+        )
+
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class BudgetExceededError(Exception):
+    """The request took more time than `request_budget` allows"""
+
+
+class CircuitOpenError(Exception):
+    """The remote host is considered unavailable, the request is not sent"""
+
+
+class CircuitBreaker:
+    """Stops the requests to a remote host after a number of consecutive
+    failures within the time window, so the rest of harvest objects fail
+    instantly instead of waiting for timeouts. After the cooldown a single
+    probe request is let through: the circuit is closed if it succeeds and
+    opened once again otherwise. Shared between the threads.
+
+    Args:
+        threshold (int): number of consecutive failures that opens the circuit
+        window (float): seconds, the failures must fit in
+        cooldown (float): seconds before the probe request
+        on_change (Optional[Callable[[str, str], Any]], optional): called
+            with the old and the new state on every transition.
+            Defaults to None.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        threshold: int,
+        window: float,
+        cooldown: float,
+        on_change: Optional[Callable[[str, str], Any]] = None,
+    ):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.on_change = on_change
+        self.state = self.CLOSED
+        self._failures: list[float] = []
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Checks if the request could be sent
+
+        Returns:
+            bool: False if the circuit is open
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            # a probe, that has never been reported, must not block the
+            # host forever, so the probe is repeated after the cooldown too
+            if time.monotonic() - self._changed_at < self.cooldown:
+                return False
+
+            if self.state == self.HALF_OPEN:
+                self._changed_at = time.monotonic()
+            else:
+                self._set_state(self.HALF_OPEN)
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = []
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+
+            if self.state == self.HALF_OPEN:
+                self._set_state(self.OPEN)
+                return
+
+            self._failures = [
+                failed for failed in self._failures if now - failed < self.window
+            ]
+            self._failures.append(now)
+
+            if self.state == self.CLOSED and len(self._failures) >= self.threshold:
+                self._set_state(self.OPEN)
+
+    def get_retry_in(self) -> float:
+        """Number of seconds before the next probe"""
+        with self._lock:
+            return max(self.cooldown - (time.monotonic() - self._changed_at), 0.0)
+
+    def _set_state(self, state: str):
+        old_state, self.state = self.state, state
+        self._changed_at = time.monotonic()
+
+        if state == self.CLOSED:
+            self._failures = []
+
+        if self.on_change:
+            self.on_change(old_state, state)
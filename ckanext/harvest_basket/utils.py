@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import codecs
+import io
+import json
+import os
+import statistics
+import time
+from typing import IO, Any, Iterable, Iterator, Optional
+
+import requests
+
+import ckan.plugins.toolkit as tk
+from ckan.lib.redis import connect_to_redis
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _state_key(source_id: str, name: str) -> str:
+    site_id = tk.config.get("ckan.site_id")
+    return f"{site_id}:harvest_basket:{source_id}:{name}"
+
+
+def get_source_state(source_id: str, name: str, default: Any = None) -> Any:
+    """Returns a value, that was remembered for the harvest source between
+    the harvest jobs.
+
+    Args:
+        source_id (str): harvest source ID
+        name (str): name of the stored value
+        default (Any, optional): returned if nothing is stored. Defaults to None.
+
+    Returns:
+        Any: JSON-serializable value
+    """
+    value = connect_to_redis().get(_state_key(source_id, name))
+
+    if value is None:
+        return default
+
+    return json.loads(value)
+
+
+def set_source_state(source_id: str, name: str, value: Any) -> None:
+    """Remembers a JSON-serializable value for the harvest source
+
+    Args:
+        source_id (str): harvest source ID
+        name (str): name of the stored value
+        value (Any): JSON-serializable value
+    """
+    connect_to_redis().set(_state_key(source_id, name), json.dumps(value))
+
+
+def is_index_commit_deferred(config: dict[str, Any]) -> bool:
+    """Checks if the search index commit is deferred by the
+    `index_commit_batch` option of the source config"""
+    return tk.asint(config.get("index_commit_batch", 0)) > 1
+
+
+# progress of the finished jobs is not interesting for long
+JOB_PROGRESS_TTL = 7 * 24 * 60 * 60
+
+
+def _job_progress_key(job_id: str) -> str:
+    site_id = tk.config.get("ckan.site_id")
+    return f"{site_id}:harvest_basket:job:{job_id}:progress"
+
+
+# sets the hash field only if the new value is bigger
+HSET_MAX_SCRIPT = """
+local current = tonumber(redis.call("HGET", KEYS[1], ARGV[1]))
+if not current or current < tonumber(ARGV[2]) then
+    redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+end
+"""
+
+
+def get_memory_usage() -> Optional[int]:
+    """Returns the current resident memory of the process in kilobytes.
+    Unlike `ru_maxrss`, it goes down, when the memory is released, so the
+    growth during a single job could be measured by a long-lived worker.
+
+    Returns:
+        Optional[int]: memory usage or None, if /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def track_job_progress(
+    job_id: str,
+    counts: dict[str, int],
+    metrics: Optional[dict[str, int]] = None,
+    maxima: Optional[dict[str, int]] = None,
+) -> dict[str, int]:
+    """Increments the progress counters of the harvest job, e.g the number of
+    fetched objects. The time of the first and the last increment is stored
+    for each counter as `<name>_started` and `<name>_updated`.
+
+    Args:
+        job_id (str): harvest job ID
+        counts (dict[str, int]): increments of the counters
+        metrics (Optional[dict[str, int]], optional): increments of the
+            counters, that don't need the timestamps, e.g number of
+            requests. Defaults to None.
+        maxima (Optional[dict[str, int]], optional): values, that are
+            stored only if they are bigger than the stored ones, e.g peak
+            memory growth. Defaults to None.
+
+    Returns:
+        dict[str, int]: new values of the counters
+    """
+    key = _job_progress_key(job_id)
+    now = time.time()
+    conn = connect_to_redis()
+    pipe = conn.pipeline()
+
+    for name, amount in counts.items():
+        pipe.hincrby(key, name, amount)
+        pipe.hsetnx(key, f"{name}_started", now)
+        pipe.hset(key, f"{name}_updated", now)
+
+    for name, amount in (metrics or {}).items():
+        pipe.hincrby(key, name, amount)
+
+    hset_max = conn.register_script(HSET_MAX_SCRIPT)
+    for name, value in (maxima or {}).items():
+        hset_max(keys=[key], args=[name, value], client=pipe)
+
+    pipe.expire(key, JOB_PROGRESS_TTL)
+
+    results = pipe.execute()
+    return {name: results[idx * 3] for idx, name in enumerate(counts)}
+
+
+def get_job_progress(job_id: str) -> dict[str, float]:
+    """Returns the progress counters of the harvest job along with the time
+    of their first and last update
+
+    Args:
+        job_id (str): harvest job ID
+
+    Returns:
+        dict[str, float]: counters and timestamps
+    """
+    data = connect_to_redis().hgetall(_job_progress_key(job_id))
+    return {
+        (k.decode() if isinstance(k, bytes) else k): float(v) for k, v in data.items()
+    }
+
+
+JOB_HISTORY_SIZE = 50
+
+# metrics of the job summary, that are checked for regressions: 1 if the
+# bigger value is worse, -1 otherwise, and the absolute change, that is
+# considered as noise
+REGRESSION_METRICS = {
+    "duration": (1, 60),
+    "gather_seconds": (1, 60),
+    "fetch_seconds": (1, 60),
+    "import_seconds": (1, 60),
+    "objects_per_second": (-1, 0.1),
+    "error_rate": (1, 0.01),
+    "peak_memory": (1, 10 * 1024),
+}
+# a couple of jobs is not a baseline yet
+REGRESSION_MIN_BASELINE = 3
+# number of previous jobs and relative change used by the regression warnings
+REGRESSION_WINDOW = 5
+REGRESSION_THRESHOLD = 0.5
+
+
+def add_job_summary(
+    source_id: str, summary: dict[str, Any], limit: int = JOB_HISTORY_SIZE
+) -> None:
+    """Remembers the performance summary of the finished harvest job. Only
+    the `limit` latest summaries of the source are kept.
+
+    Args:
+        source_id (str): harvest source ID
+        summary (dict[str, Any]): JSON-serializable summary
+        limit (int, optional): number of summaries to keep.
+            Defaults to JOB_HISTORY_SIZE.
+    """
+    key = _state_key(source_id, "job_history")
+    pipe = connect_to_redis().pipeline()
+    pipe.lpush(key, json.dumps(summary))
+    pipe.ltrim(key, 0, limit - 1)
+    pipe.execute()
+
+
+def get_job_history(
+    source_id: str, limit: int = JOB_HISTORY_SIZE
+) -> list[dict[str, Any]]:
+    """Returns the performance summaries of the finished harvest jobs of the
+    source, the latest first
+
+    Args:
+        source_id (str): harvest source ID
+        limit (int, optional): maximum number of summaries.
+            Defaults to JOB_HISTORY_SIZE.
+
+    Returns:
+        list[dict[str, Any]]: job summaries
+    """
+    key = _state_key(source_id, "job_history")
+    return [json.loads(item) for item in connect_to_redis().lrange(key, 0, limit - 1)]
+
+
+def find_regressions(
+    summary: dict[str, Any], baseline: list[dict[str, Any]], threshold: float
+) -> dict[str, dict[str, Any]]:
+    """Compares the job summary with the median of the previous jobs. Jobs,
+    that haven't processed any objects, e.g skipped by `skip_unchanged_catalog`,
+    are neither checked nor used as the baseline.
+
+    Args:
+        summary (dict[str, Any]): summary of the checked job
+        baseline (list[dict[str, Any]]): summaries of the previous jobs
+        threshold (float): relative change, e.g 0.5 means 50% worse
+
+    Returns:
+        dict[str, dict[str, Any]]: regressed metrics with the job value, the
+                                   baseline value and the relative change
+    """
+    baseline = [job for job in baseline if job.get("objects")]
+    if not summary.get("objects") or len(baseline) < REGRESSION_MIN_BASELINE:
+        return {}
+
+    regressions = {}
+    for name, (direction, noise) in REGRESSION_METRICS.items():
+        value = summary.get(name)
+        previous = [job[name] for job in baseline if job.get(name) is not None]
+        if value is None or len(previous) < REGRESSION_MIN_BASELINE:
+            continue
+
+        expected = statistics.median(previous)
+        delta = (value - expected) * direction
+        if delta <= noise:
+            continue
+
+        # e.g errors of the source that used to be error-free
+        change = delta / expected if expected else None
+        if change is not None and change <= threshold:
+            continue
+
+        regressions[name] = {
+            "value": value,
+            "baseline": expected,
+            "change": round(change, 2) if change is not None else None,
+        }
+
+    return regressions
+
+
+def is_streaming_available() -> bool:
+    """Incremental JSON parsing requires the optional `ijson` package"""
+    return ijson is not None
+
+
+def open_json_stream(resp: requests.Response) -> IO[bytes]:
+    """Wraps the streamed response body into a buffered reader, that
+    transparently decodes gzip/deflate encoded content and skips UTF-8 BOM"""
+    resp.raw.decode_content = True
+    # otherwise urllib3 closes the body on EOF and the reader fails on it
+    resp.raw.auto_close = False
+    stream = io.BufferedReader(resp.raw, buffer_size=1024 * 64)
+
+    if stream.peek(len(codecs.BOM_UTF8)).startswith(codecs.BOM_UTF8):
+        stream.read(len(codecs.BOM_UTF8))
+
+    return stream
+
+
+def iter_json_items(stream: IO[bytes], prefix: str) -> Iterator[Any]:
+    """Parses JSON document incrementally and yields the items of the array
+    located at `prefix`, e.g `item` for the top-level array or
+    `dataset.item` for the `dataset` array of the top-level object. Only one
+    item is kept in memory at a time.
+
+    Raises:
+        ValueError: if the document is not a valid JSON
+    """
+    try:
+        yield from ijson.items(stream, prefix, use_float=True)
+    except ijson.JSONError as e:
+        raise ValueError(f"JSON document is corrupted: {e}") from e
+
+
+def _iter_children(nodes: Iterable[Any], key: str) -> Iterator[Any]:
+    for node in nodes:
+        if key == "*":
+            if isinstance(node, dict):
+                yield from node.values()
+            elif isinstance(node, list):
+                yield from node
+        elif isinstance(node, dict) and key in node:
+            yield node[key]
+
+
+def prune_fields(data: Any, path: str) -> list[Any]:
+    """Removes the field located at the dotted `path` from the nested data
+    in place, e.g `columns.*.cachedContents` removes `cachedContents` from
+    every item of `columns` list. `*` matches every item of a list or every
+    value of a dict.
+
+    Args:
+        data (Any): parsed JSON document
+        path (str): dotted path of the field
+
+    Returns:
+        list[Any]: removed values
+    """
+    *parents, field = path.split(".")
+
+    nodes: Iterable[Any] = [data]
+    for key in parents:
+        nodes = _iter_children(nodes, key)
+
+    return [
+        node.pop(field)
+        for node in list(nodes)
+        if isinstance(node, dict) and field in node
+    ]